@@ -0,0 +1,463 @@
+"""
+Admission control for the local converters.
+
+Content-Length only bounds the upload; a small PDF can declare a huge page
+tree and a small DOCX can inflate to gigabytes. Before a local conversion runs:
+
+1. Work is estimated from the raw bytes without parsing the document: PDF
+   page count (page tree /Count) and object count, DOCX part count and
+   decompressed part sizes from the zip directory. Documents over the limits
+   are rejected with 413. Python's zipfile never inflates a member past its
+   declared size, so the directory sizes bound what the converters can read.
+   A page tree inside a compressed object stream (common since PDF 1.5)
+   can't be seen in the raw bytes; the PDF converters call check_pages with
+   the root /Count once they have opened the document, before reading pages.
+2. Each process runs at most ADMISSION_SLOTS conversions at once. Requests
+   past that wait in a queue of ADMISSION_QUEUE entries for up to
+   ADMISSION_QUEUE_TIMEOUT seconds; a full queue or a timeout is answered with
+   503 and a Retry-After estimated from recent conversion times.
+3. With ADMISSION_ISOLATE on (and fork available) the conversion runs in a
+   forked child with RLIMIT_CPU and an RLIMIT_AS budget above the child's
+   starting size, so a pathological document kills its worker instead of the
+   server. Results, progress, the worker's stage timings and state registered
+   with register_worker_state (e.g. new page cache entries) come back over a
+   pipe. A worker may still extract text on its own process pool
+   (api/_pdf_extract.py); the pool's processes inherit the worker's limits,
+   each with its own CPU time and memory budget.
+
+Configuration (environment):
+    ADMISSION_SLOTS                concurrent local conversions per process (default: available cores)
+    ADMISSION_QUEUE                conversions allowed to wait for a slot (default 2x slots)
+    ADMISSION_QUEUE_TIMEOUT        seconds a conversion may wait for a slot (default 10)
+    ADMISSION_MAX_PAGES            PDF page limit (default 2000)
+    ADMISSION_MAX_OBJECTS          PDF object limit (default 1000000)
+    ADMISSION_MAX_UNPACKED_BYTES   DOCX decompressed size limit (default 256 MB)
+    ADMISSION_MAX_RATIO            compression ratio limit for DOCX parts over 1 MB (default 200)
+    ADMISSION_ISOLATE              run conversions in a forked, rlimited worker: 1 or 0 (default 1)
+    ADMISSION_JOB_CPU_SECONDS      CPU seconds per isolated conversion (default 60)
+    ADMISSION_JOB_MEMORY_MB        memory per isolated conversion above its starting size (default 1024)
+
+No external dependencies — uses Python stdlib only.
+"""
+
+import io
+import os
+import re
+import math
+import time
+import signal
+import threading
+from contextlib import contextmanager
+from _metrics import Timings, bind, replay, timed
+from _pdf_extract import available_cores, shutdown_pool
+from _preview import PreviewError
+from _transport import send_json
+
+_MB = 1024 * 1024
+
+# Ratios of small parts say nothing; only parts above this size are checked
+RATIO_MIN_BYTES = _MB
+
+# Retry-After bounds (seconds)
+RETRY_AFTER_MIN = 1
+RETRY_AFTER_MAX = 60
+
+# Operations whose input is a PDF (the rest take a DOCX)
+PDF_DIRECTIONS = ('pdf-to-docx', 'compress-pdf')
+
+# name -> (collect, apply), see register_worker_state
+_worker_state = {}
+
+_PDF_COUNT = re.compile(rb'/Count\s+(\d+)')
+_PDF_PAGE = re.compile(rb'/Type\s*/Page(?![A-Za-z])')
+# The lookbehind keeps a long run of digits from being retried at every offset
+_PDF_OBJECT = re.compile(rb'(?<!\d)\d+\s+\d+\s+obj\b')
+# Objects packed into object streams: /N of each /Type /ObjStm dictionary,
+# read from a bounded window around each /ObjStm so no match can run long
+_OBJECT_STREAM_TYPE = b'/ObjStm'
+_OBJECT_STREAM_WINDOW = 1024
+_PDF_OBJECT_STREAM_COUNT = re.compile(rb'/N\s+(\d+)')
+
+
+class AdmissionError(Exception):
+    """A conversion refused (or stopped) by admission control; status is the HTTP status to answer."""
+
+    def __init__(self, message, status=503, retry_after=None):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+
+class Overloaded(AdmissionError):
+    def __init__(self, message, retry_after):
+        super().__init__(message, status=503, retry_after=retry_after)
+
+
+class LimitExceeded(AdmissionError):
+    def __init__(self, message):
+        super().__init__(message, status=413)
+
+
+class OverLimits(LimitExceeded):
+    """The document is over the work limits (as opposed to a worker stopped by an rlimit)."""
+
+
+def estimate_pdf(data):
+    """Page and object counts of a PDF, read from the raw bytes."""
+    counts = [int(count) for count in _PDF_COUNT.findall(data)]
+    # The root of the page tree carries the largest /Count
+    pages = max(counts) if counts else len(_PDF_PAGE.findall(data))
+    objects = len(_PDF_OBJECT.findall(data))
+    position = data.find(_OBJECT_STREAM_TYPE)
+    while position >= 0:
+        # The dictionary around this /Type /ObjStm, within the window on either side
+        start = data.rfind(b'<<', max(0, position - _OBJECT_STREAM_WINDOW), position)
+        end = data.find(b'>>', position, position + _OBJECT_STREAM_WINDOW)
+        if start >= 0 and end >= 0:
+            count = _PDF_OBJECT_STREAM_COUNT.search(data, start, end)
+            if count:
+                objects += int(count.group(1))
+        position = data.find(_OBJECT_STREAM_TYPE, position + len(_OBJECT_STREAM_TYPE))
+    return {'pages': pages, 'objects': objects}
+
+
+def estimate_docx(data):
+    """Part count and decompressed sizes of a DOCX, from its zip directory."""
+    import zipfile
+
+    try:
+        with zipfile.ZipFile(io.BytesIO(data)) as archive:
+            infos = archive.infolist()
+    except zipfile.BadZipFile:
+        # Not ours to judge; the converter reports the broken file
+        return {'parts': 0, 'unpacked_bytes': 0, 'max_ratio': 0.0}
+    max_ratio = 0.0
+    for info in infos:
+        if info.file_size >= RATIO_MIN_BYTES:
+            max_ratio = max(max_ratio, info.file_size / max(info.compress_size, 1))
+    return {
+        'parts': len(infos),
+        'unpacked_bytes': sum(info.file_size for info in infos),
+        'max_ratio': round(max_ratio, 1),
+    }
+
+
+def _address_space():
+    """Current virtual memory size of this process in bytes, or None if unknown."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[0]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _fork_context():
+    import multiprocessing
+
+    if 'fork' not in multiprocessing.get_all_start_methods():
+        return None
+    return multiprocessing.get_context('fork')
+
+
+def register_worker_state(name, collect, apply):
+    """
+    Process-local state a conversion updates (e.g. the page cache) that must
+    survive isolation: collect() runs in the worker after the conversion and
+    returns the changes (picklable, or None); apply(changes) merges them into
+    the parent.
+    """
+    _worker_state[name] = (collect, apply)
+
+
+def _collect_worker_state():
+    return {name: collect() for name, (collect, _) in _worker_state.items()}
+
+
+def _apply_worker_state(changes):
+    for name, state in changes.items():
+        if state is not None and name in _worker_state:
+            _worker_state[name][1](state)
+
+
+def _isolated_main(conn, convert, data, cpu_seconds, memory_bytes):
+    """Forked worker: apply the rlimits, convert, send the result (or error) to the parent."""
+    import resource
+
+    if cpu_seconds:
+        resource.setrlimit(resource.RLIMIT_CPU, (cpu_seconds, cpu_seconds + 1))
+    base = _address_space()
+    if memory_bytes and base is not None:
+        resource.setrlimit(resource.RLIMIT_AS, (base + memory_bytes, base + memory_bytes))
+
+    def progress(done, total=None):
+        conn.send(('progress', done, total))
+
+    # Stages recorded here are replayed into the parent's request
+    timings = Timings('worker')
+    bind(timings)
+    try:
+        buffer, *rest = convert(data, progress)
+        conn.send(('result', rest, timings.export(), _collect_worker_state()))
+        conn.send_bytes(buffer)
+    except OverLimits as e:
+        conn.send(('limits', str(e)))
+    except PreviewError as e:
+        conn.send(('preview', str(e)))
+    except MemoryError:
+        conn.send(('memory',))
+    except Exception as e:
+        conn.send(('error', str(e)))
+    finally:
+        shutdown_pool()
+        conn.close()
+
+
+def run_isolated(convert, data, progress=None, cpu_seconds=60, memory_bytes=None):
+    """
+    Run convert(data, progress) -> (buffer, page_count, ...) in a forked child
+    under CPU and memory limits and return the same tuple, the buffer as bytes.
+    Raises LimitExceeded when a limit stops it, PreviewError when the requested
+    pages aren't in the document and RuntimeError with the child's message
+    when the conversion itself fails.
+    """
+    ctx = _fork_context()
+    reader, writer = ctx.Pipe(duplex=False)
+    # Not a daemon: daemonic processes may not start the extraction pool's processes.
+    # It is always joined (or killed) below.
+    process = ctx.Process(target=_isolated_main, args=(writer, convert, data, cpu_seconds, memory_bytes))
+    process.start()
+    writer.close()
+    # CPU time can't exceed wall time, so this only catches a stuck (sleeping) worker
+    deadline = time.monotonic() + 2 * cpu_seconds + 5 if cpu_seconds else None
+    try:
+        while True:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            if not reader.poll(timeout):
+                raise LimitExceeded('Conversion exceeded its time limit')
+            try:
+                message = reader.recv()
+            except EOFError:
+                break
+            if message[0] == 'progress':
+                if progress:
+                    progress(*message[1:])
+            elif message[0] == 'result':
+                replay(message[2])
+                _apply_worker_state(message[3])
+                return (reader.recv_bytes(), *message[1])
+            elif message[0] == 'limits':
+                raise OverLimits(message[1])
+            elif message[0] == 'preview':
+                raise PreviewError(message[1])
+            elif message[0] == 'memory':
+                raise LimitExceeded('Conversion exceeded its memory limit')
+            else:
+                raise RuntimeError(message[1])
+    finally:
+        reader.close()
+        process.join(1)
+        if process.is_alive():
+            process.kill()
+            process.join()
+
+    # The worker died without answering
+    if process.exitcode == -signal.SIGXCPU:
+        raise LimitExceeded('Conversion exceeded its CPU time limit')
+    if process.exitcode == -signal.SIGKILL:
+        raise LimitExceeded('Conversion was killed (out of memory)')
+    raise RuntimeError(f'Conversion worker exited with code {process.exitcode}')
+
+
+class AdmissionController:
+    """Work limits, concurrency slots with a bounded wait queue, and isolated execution."""
+
+    def __init__(self, slots=1, queue_size=2, queue_timeout=10.0, max_pages=2000, max_objects=1000000,
+                 max_unpacked_bytes=256 * _MB, max_ratio=200.0, isolate=True, cpu_seconds=60,
+                 memory_bytes=1024 * _MB):
+        self.slots = slots
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.max_pages = max_pages
+        self.max_objects = max_objects
+        self.max_unpacked_bytes = max_unpacked_bytes
+        self.max_ratio = max_ratio
+        self.isolate = isolate and _fork_context() is not None
+        self.cpu_seconds = cpu_seconds
+        self.memory_bytes = memory_bytes
+        self._active = 0
+        self._waiting = 0
+        # Smoothed seconds per conversion, for Retry-After
+        self._average_seconds = 1.0
+        self._cond = threading.Condition()
+        self._stats = {'admitted': 0, 'queued': 0, 'rejected_limits': 0, 'rejected_queue_full': 0,
+                       'rejected_timeout': 0, 'isolated': 0, 'killed': 0}
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    @classmethod
+    def from_env(cls):
+        slots = int(os.environ.get('ADMISSION_SLOTS', 0)) or available_cores()
+        return cls(
+            slots=slots,
+            queue_size=int(os.environ.get('ADMISSION_QUEUE', 2 * slots)),
+            queue_timeout=float(os.environ.get('ADMISSION_QUEUE_TIMEOUT', 10)),
+            max_pages=int(os.environ.get('ADMISSION_MAX_PAGES', 2000)),
+            max_objects=int(os.environ.get('ADMISSION_MAX_OBJECTS', 1000000)),
+            max_unpacked_bytes=int(os.environ.get('ADMISSION_MAX_UNPACKED_BYTES', 256 * _MB)),
+            max_ratio=float(os.environ.get('ADMISSION_MAX_RATIO', 200)),
+            isolate=os.environ.get('ADMISSION_ISOLATE', '1').lower() not in ('0', 'false', 'no'),
+            cpu_seconds=int(os.environ.get('ADMISSION_JOB_CPU_SECONDS', 60)),
+            memory_bytes=int(os.environ.get('ADMISSION_JOB_MEMORY_MB', 1024)) * _MB,
+        )
+
+    def _after_fork(self):
+        # Another thread may have held the lock at fork time; workers call check_pages
+        self._cond = threading.Condition()
+
+    def _count(self, counter):
+        with self._cond:
+            self._stats[counter] += 1
+
+    def check(self, direction, data):
+        """Estimate the document's work; raise LimitExceeded if it is over the limits."""
+        if direction in PDF_DIRECTIONS:
+            estimate = estimate_pdf(data)
+            if estimate['pages'] > self.max_pages:
+                problem = f'{estimate["pages"]} pages (max {self.max_pages})'
+            elif estimate['objects'] > self.max_objects:
+                problem = f'{estimate["objects"]} objects (max {self.max_objects})'
+            else:
+                return estimate
+        else:
+            estimate = estimate_docx(data)
+            if estimate['unpacked_bytes'] > self.max_unpacked_bytes:
+                problem = f'{estimate["unpacked_bytes"]} bytes unpacked (max {self.max_unpacked_bytes})'
+            elif estimate['max_ratio'] > self.max_ratio:
+                problem = f'a part compressed {estimate["max_ratio"]:.0f}:1 (max {self.max_ratio:.0f}:1)'
+            else:
+                return estimate
+        self._count('rejected_limits')
+        raise OverLimits(f'Document too large to convert: {problem}')
+
+    def check_pages(self, pages):
+        """
+        Raise OverLimits if a PDF's page count (read by the converter, e.g. from
+        a page tree in an object stream) is over the limit; None passes.
+        """
+        if pages is not None and pages > self.max_pages:
+            self._count('rejected_limits')
+            raise OverLimits(f'Document too large to convert: {pages} pages (max {self.max_pages})')
+
+    def overloaded(self):
+        """
+        Overloaded for a request turned away before reaching the queue (the
+        self-hosted server's conversion executor is full), counted as a full queue.
+        """
+        with self._cond:
+            self._stats['rejected_queue_full'] += 1
+            return Overloaded('Server busy, try again later', self._retry_after())
+
+    def _retry_after(self):
+        """Seconds until a slot is likely free for a new request (call with the lock held)."""
+        seconds = self._average_seconds * (self._waiting + 1) / self.slots
+        return max(RETRY_AFTER_MIN, min(RETRY_AFTER_MAX, math.ceil(seconds)))
+
+    def acquire(self):
+        """Take a conversion slot, waiting in the queue if needed; raises Overloaded."""
+        with self._cond:
+            if self._active >= self.slots:
+                if self._waiting >= self.queue_size:
+                    self._stats['rejected_queue_full'] += 1
+                    raise Overloaded('Server busy, try again later', self._retry_after())
+                self._stats['queued'] += 1
+                self._waiting += 1
+                deadline = time.monotonic() + self.queue_timeout
+                try:
+                    while self._active >= self.slots:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            self._stats['rejected_timeout'] += 1
+                            raise Overloaded('Server busy, try again later', self._retry_after())
+                        self._cond.wait(remaining)
+                finally:
+                    self._waiting -= 1
+            self._active += 1
+            self._stats['admitted'] += 1
+
+    def acquire_free(self, count):
+        """
+        Take up to count more slots if they are free now, without queueing (none
+        while other conversions are waiting for one); returns how many were taken.
+        """
+        with self._cond:
+            taken = 0 if self._waiting else max(0, min(count, self.slots - self._active))
+            self._active += taken
+            self._stats['admitted'] += taken
+            return taken
+
+    def release(self, seconds=None):
+        """Give a slot back; seconds (how long it was held) feeds the Retry-After estimate."""
+        with self._cond:
+            self._active -= 1
+            if seconds is not None:
+                self._average_seconds += 0.2 * (seconds - self._average_seconds)
+            self._cond.notify()
+
+    @contextmanager
+    def slot(self):
+        with timed('queue'):
+            self.acquire()
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(time.monotonic() - started)
+
+    def run(self, direction, data, convert, progress=None, prepare=None):
+        """
+        Admit and run convert(data, progress) -> (buffer, page_count, ...).
+        prepare() runs in this process before forking (e.g. to import the
+        converter's dependencies once instead of in every worker).
+        """
+        with timed('estimate'):
+            self.check(direction, data)
+        with self.slot():
+            return self.execute(convert, data, progress, prepare)
+
+    def execute(self, convert, data, progress=None, prepare=None):
+        """
+        Run an admitted conversion (the caller holds a slot): in an isolated
+        worker when isolation is on, otherwise in this thread.
+        """
+        if not self.isolate:
+            return convert(data, progress)
+        if prepare:
+            with timed('prepare'):
+                prepare()
+        self._count('isolated')
+        try:
+            # 'worker' is the fork and transfer overhead; the conversion's own stages are replayed
+            with timed('worker'):
+                return run_isolated(convert, data, progress, self.cpu_seconds, self.memory_bytes)
+        except OverLimits:
+            # Found by check_pages in the worker
+            self._count('rejected_limits')
+            raise
+        except LimitExceeded:
+            self._count('killed')
+            raise
+
+    def stats(self):
+        with self._cond:
+            return dict(self._stats, slots=self.slots, active=self._active, waiting=self._waiting,
+                        queue_size=self.queue_size, isolate=self.isolate,
+                        average_seconds=round(self._average_seconds, 3))
+
+
+def send_rejected(handler, origin, error):
+    """Answer an AdmissionError with its status (and Retry-After when overloaded)."""
+    headers = {'Retry-After': str(error.retry_after)} if error.retry_after else None
+    send_json(handler, origin, {'success': False, 'error': str(error)}, status=error.status, extra_headers=headers)
+
+
+admission = AdmissionController.from_env()
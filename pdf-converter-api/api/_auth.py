@@ -2,6 +2,14 @@
 Shared JWT verification for Vercel serverless functions.
 Uses HS256 (HMAC-SHA256) with the JWT_SECRET environment variable.
 No external dependencies — uses Python stdlib only.
+
+Key rotation: JWT_SECRETS may hold additional active secrets as
+"kid1:secret1,kid2:secret2". Tokens with a `kid` header are checked against
+that key only; tokens without one against JWT_SECRET (or every key if unset).
+
+Verified tokens are cached per process (JWT_CACHE_SIZE entries, at most
+JWT_CACHE_TTL_SECONDS and never past the token's `exp`), since the frontend
+reuses one token for many requests.
 """
 
 import os
@@ -10,11 +18,27 @@ import hmac
 import hashlib
 import base64
 import time
+import threading
+from collections import OrderedDict
 
 ALLOWED_ORIGIN = 'https://arch-viz-ai-studio.vercel.app'
 ALLOWED_ORIGINS = [ALLOWED_ORIGIN, 'http://localhost:3000', 'http://localhost:5173']
 MAX_PAYLOAD_BYTES = 25 * 1024 * 1024  # 25 MB
 
+JWT_CACHE_SIZE = int(os.environ.get('JWT_CACHE_SIZE', 1024))
+JWT_CACHE_TTL_SECONDS = float(os.environ.get('JWT_CACHE_TTL_SECONDS', 300))
+
+# Keyring: {kid: HMAC state}, kid None for JWT_SECRET. Rebuilt only when the
+# environment changes, so adding a key doesn't flush cached tokens.
+_keyring = {}
+_keyring_secrets = {}
+_keyring_source = None
+
+# token -> (payload, cached_until, kid, hmac_state)
+_token_cache = OrderedDict()
+_token_cache_lock = threading.Lock()
+_token_cache_stats = {'hits': 0, 'misses': 0}
+
 
 def _base64url_decode(s):
     """Decode base64url string to bytes."""
@@ -30,40 +54,113 @@ def _base64url_encode(data):
     return base64.b64encode(data).rstrip(b'=').replace(b'+', b'-').replace(b'/', b'_').decode('ascii')
 
 
+def _load_keyring():
+    """Return {kid: precomputed HMAC-SHA256 state} for the configured secrets."""
+    global _keyring, _keyring_secrets, _keyring_source
+    source = (os.environ.get('JWT_SECRET', ''), os.environ.get('JWT_SECRETS', ''))
+    if source != _keyring_source:
+        secrets = {}
+        if source[0]:
+            secrets[None] = source[0]
+        for entry in source[1].split(','):
+            kid, sep, secret = entry.strip().partition(':')
+            if sep and kid and secret:
+                secrets[kid] = secret
+
+        keyring = {}
+        for kid, secret in secrets.items():
+            previous = _keyring.get(kid)
+            if previous is not None and _keyring_secrets.get(kid) == secret:
+                # Keep the same state object so tokens cached under it stay valid
+                keyring[kid] = previous
+            else:
+                keyring[kid] = hmac.new(secret.encode('utf-8'), digestmod=hashlib.sha256)
+        _keyring, _keyring_secrets, _keyring_source = keyring, secrets, source
+    return _keyring
+
+
+def _verify_signature(parts, keyring):
+    """Check the signature against the matching key(s); returns (kid, hmac_state)."""
+    if len(keyring) == 1 and None in keyring:
+        # Single-secret setup: no need to parse the header for a kid
+        kid = None
+    else:
+        header = json.loads(_base64url_decode(parts[0]).decode('utf-8'))
+        kid = header.get('kid') if isinstance(header, dict) else None
+
+    if kid is not None and kid in keyring:
+        candidates = [(kid, keyring[kid])]
+    elif kid is not None:
+        raise ValueError('Unknown JWT key id')
+    elif None in keyring:
+        candidates = [(None, keyring[None])]
+    else:
+        candidates = list(keyring.items())
+
+    signing_input = f'{parts[0]}.{parts[1]}'.encode('ascii')
+    actual_sig = _base64url_decode(parts[2])
+    for key_id, state in candidates:
+        mac = state.copy()
+        mac.update(signing_input)
+        if hmac.compare_digest(mac.digest(), actual_sig):
+            return key_id, state
+    raise ValueError('Invalid JWT signature')
+
+
 def verify_jwt(token):
     """
     Verify an HS256 JWT token.
     Returns the decoded payload dict or raises ValueError.
     """
-    secret = os.environ.get('JWT_SECRET')
-    if not secret:
+    keyring = _load_keyring()
+    if not keyring:
         raise ValueError('JWT_SECRET not configured')
 
+    now = time.time()
+    with _token_cache_lock:
+        entry = _token_cache.get(token)
+        if entry is not None:
+            payload, cached_until, kid, state = entry
+            # Serve only if unexpired and the signing key is still active and unchanged
+            if cached_until > now and keyring.get(kid) is state:
+                _token_cache.move_to_end(token)
+                _token_cache_stats['hits'] += 1
+                return dict(payload)
+            del _token_cache[token]
+        _token_cache_stats['misses'] += 1
+
     parts = token.split('.')
     if len(parts) != 3:
         raise ValueError('Invalid JWT format')
 
     # Verify signature
-    signing_input = f'{parts[0]}.{parts[1]}'.encode('ascii')
-    expected_sig = hmac.new(
-        secret.encode('utf-8'),
-        signing_input,
-        hashlib.sha256
-    ).digest()
-
-    actual_sig = _base64url_decode(parts[2])
-
-    if not hmac.compare_digest(expected_sig, actual_sig):
-        raise ValueError('Invalid JWT signature')
+    kid, state = _verify_signature(parts, keyring)
 
     # Decode payload
     payload = json.loads(_base64url_decode(parts[1]).decode('utf-8'))
 
     # Check expiration
-    if 'exp' in payload and payload['exp'] < time.time():
+    if 'exp' in payload and payload['exp'] < now:
         raise ValueError('JWT expired')
 
-    return payload
+    if JWT_CACHE_SIZE > 0:
+        cached_until = now + JWT_CACHE_TTL_SECONDS
+        if 'exp' in payload:
+            cached_until = min(cached_until, payload['exp'])
+        with _token_cache_lock:
+            _token_cache[token] = (payload, cached_until, kid, state)
+            while len(_token_cache) > JWT_CACHE_SIZE:
+                _token_cache.popitem(last=False)
+
+    return dict(payload)
+
+
+def jwt_cache_stats():
+    """Hit/miss counters and size of the verified-token cache."""
+    with _token_cache_lock:
+        stats = dict(_token_cache_stats)
+        stats['entries'] = len(_token_cache)
+    return stats
 
 
 def authenticate_request(handler):
@@ -112,18 +209,22 @@ def send_cors_headers(handler, origin=None):
 def send_unauthorized(handler, message='Unauthorized'):
     """Send a 401 response."""
     origin = get_cors_origin(handler)
+    body = json.dumps({'success': False, 'error': message}).encode('utf-8')
     handler.send_response(401)
     handler.send_header('Content-Type', 'application/json')
+    handler.send_header('Content-Length', str(len(body)))
     send_cors_headers(handler, origin)
     handler.end_headers()
-    handler.wfile.write(json.dumps({'success': False, 'error': message}).encode('utf-8'))
+    handler.wfile.write(body)
 
 
 def send_payload_too_large(handler):
     """Send a 413 response."""
     origin = get_cors_origin(handler)
+    body = json.dumps({'success': False, 'error': 'Payload too large'}).encode('utf-8')
     handler.send_response(413)
     handler.send_header('Content-Type', 'application/json')
+    handler.send_header('Content-Length', str(len(body)))
     send_cors_headers(handler, origin)
     handler.end_headers()
-    handler.wfile.write(json.dumps({'success': False, 'error': 'Payload too large'}).encode('utf-8'))
+    handler.wfile.write(body)
@@ -0,0 +1,307 @@
+"""
+Multi-file batch conversion, streamed back as a ZIP archive.
+
+Local conversions run in parallel, one document per task, and each result is
+written to the archive as soon as it finishes. Every document in flight holds
+an admission slot (api/_admission.py): a batch takes one, queueing like any
+conversion, plus those free when it starts. With admission isolation on each
+document is converted in its own rlimited worker, like a single conversion;
+otherwise on a process pool, retrying the documents a dying pool process
+took down once each. The iLovePDF backend uploads every file into a single
+task, so one `process` call covers the batch. A manifest.json entry at the end
+of the archive lists per-file status, output name, page count and errors.
+
+Configuration (environment):
+    BATCH_MAX_FILES   files accepted per request (default 50)
+    BATCH_WORKERS     documents converted at once, within the free admission slots
+                      (default: available cores; 1 converts one at a time)
+"""
+
+import os
+import json
+import collections
+import time
+import threading
+import importlib.util
+from _admission import AdmissionError, LimitExceeded, admission
+from _cache import conversion_cache
+from _pdf_extract import available_cores
+
+API_DIR = os.path.dirname(os.path.abspath(__file__))
+
+BATCH_MAX_FILES = int(os.environ.get('BATCH_MAX_FILES', 50))
+
+# Direction -> (input extension, output extension)
+DIRECTIONS = {
+    'pdf-to-docx': ('.pdf', '.docx'),
+    'docx-to-pdf': ('.docx', '.pdf'),
+}
+
+_pool = None
+_pool_lock = threading.Lock()
+_pool_broken = False
+_converters = {}
+
+
+def pool_size():
+    return int(os.environ.get('BATCH_WORKERS', 0)) or available_cores()
+
+
+def _init_worker():
+    # Batches are parallel across documents; nested page-level pools would
+    # only oversubscribe the cores
+    os.environ['PDF_EXTRACT_WORKERS'] = '1'
+
+
+def _get_pool():
+    """Create the batch process pool on first use; None if unavailable."""
+    global _pool, _pool_broken
+    if _pool is not None or _pool_broken:
+        return _pool
+    with _pool_lock:
+        if _pool is None and not _pool_broken:
+            try:
+                from concurrent.futures import ProcessPoolExecutor
+                _pool = ProcessPoolExecutor(max_workers=pool_size(), initializer=_init_worker)
+            except (ImportError, NotImplementedError, OSError) as e:
+                print(f'Process pool unavailable, converting batch serially: {e}')
+                _pool_broken = True
+    return _pool
+
+
+def _discard_pool(pool):
+    """Drop a broken pool (a worker died); the next batch starts a fresh one."""
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def acquire_slots():
+    """
+    Take the admission slots a local batch converts with: one, queueing like
+    any conversion (raises Overloaded), plus any others free now, up to
+    pool_size(). Each document in flight holds one; returns how many.
+    """
+    admission.acquire()
+    return 1 + admission.acquire_free(pool_size() - 1)
+
+
+def release_slots(slots):
+    for _ in range(slots):
+        admission.release()
+
+
+def _converter(direction):
+    """Load api/<direction>.py (hyphenated, so not importable by name) once per process."""
+    module = _converters.get(direction)
+    if module is None:
+        name = direction.replace('-', '_')
+        spec = importlib.util.spec_from_file_location(f'batch_{name}', os.path.join(API_DIR, f'{direction}.py'))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        _converters[direction] = module
+    return module
+
+
+def _convert_document(direction, data, nested=True):
+    """
+    Convert one admitted document; returns (bytes, page_count). With admission
+    isolation on it runs in its own rlimited worker (api/_admission.py).
+    nested=False turns page-level pools off, for documents converted side by side.
+    """
+    module = _converter(direction)
+    convert = getattr(module, 'convert_' + direction.replace('-', '_'))
+
+    def convert_one(data, progress):
+        if not nested:
+            _init_worker()
+        return convert(data, progress)
+
+    buffer, page_count = admission.execute(convert_one, data, prepare=module.warm_up)
+    return bytes(buffer), page_count
+
+
+def convert_local(direction, documents, slots=None):
+    """
+    Convert documents with the local converters, as many at once as the
+    caller holds admission slots (see acquire_slots; None takes them here).
+    Yields (index, data, page_count, error) in completion order; cached results first.
+    Documents over the admission work limits fail individually.
+    """
+    if slots is None:
+        try:
+            slots = acquire_slots()
+        except AdmissionError as e:
+            for index in range(len(documents)):
+                yield index, None, None, str(e)
+            return
+        try:
+            yield from convert_local(direction, documents, slots)
+        finally:
+            release_slots(slots)
+        return
+
+    pending = []
+    for index, (_, data) in enumerate(documents):
+        key = conversion_cache.key(direction, data)
+        cached = conversion_cache.get(key)
+        if cached is not None:
+            yield index, cached[0], cached[1].get('page_count'), None
+            continue
+        try:
+            admission.check(direction, data)
+        except LimitExceeded as e:
+            yield index, None, None, str(e)
+            continue
+        pending.append((index, key, data))
+
+    def finish(index, key, result):
+        data, page_count = result
+        conversion_cache.put(key, data, {'page_count': page_count})
+        return index, data, page_count, None
+
+    def convert_serially(documents, nested=True):
+        for index, key, data in documents:
+            try:
+                yield finish(index, key, _convert_document(direction, data, nested))
+            except Exception as e:
+                yield index, None, None, str(e)
+
+    parallel = min(slots, len(pending))
+    if parallel <= 1:
+        yield from convert_serially(pending)
+        return
+
+    from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+    from concurrent.futures.process import BrokenProcessPool
+
+    if admission.isolate:
+        # Each document runs in its own forked worker; the threads only wait on them
+        _converter(direction)
+        executor = ThreadPoolExecutor(max_workers=parallel)
+    else:
+        executor = _get_pool()
+        if executor is None:
+            yield from convert_serially(pending)
+            return
+
+    queued = collections.deque(pending)
+    running = {}
+    retried = set()
+    try:
+        while queued or running:
+            while queued and len(running) < parallel:
+                index, key, data = queued.popleft()
+                running[executor.submit(_convert_document, direction, data, False)] = (index, key, data)
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            broken = []
+            for future in done:
+                index, key, data = running.pop(future)
+                try:
+                    yield finish(index, key, future.result())
+                except BrokenProcessPool:
+                    broken.append((index, key, data))
+                except Exception as e:
+                    yield index, None, None, str(e)
+            if not broken:
+                continue
+            # A worker died and took the pool, and every document on it, down. Each
+            # of those gets one more try, one at a time on a fresh pool, so a
+            # document that kills its worker again fails on its own
+            print(f'Batch process pool failed, retrying {len(broken) + len(running)} documents one at a time')
+            broken.extend(running.values())
+            running.clear()
+            _discard_pool(executor)
+            executor = _get_pool()
+            if executor is None:
+                for index, key, data in broken:
+                    yield index, None, None, 'Conversion worker exited unexpectedly'
+                yield from convert_serially(queued)
+                return
+            parallel = 1
+            for index, key, data in reversed(broken):
+                if index in retried:
+                    yield index, None, None, 'Conversion worker exited unexpectedly'
+                else:
+                    retried.add(index)
+                    queued.appendleft((index, key, data))
+    finally:
+        if executor is not _pool:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+def convert_ilovepdf(direction, documents, public_key):
+    """
+    Convert documents in a single iLovePDF task.
+    Yields (index, data, page_count, error); page counts are not reported by iLovePDF.
+    If iLovePDF is down (or its breaker is open) the batch is converted locally
+    when ILOVEPDF_FALLBACK is 'local'.
+    """
+    from _ilovepdf import TOOLS, UpstreamError, run_batch, use_fallback
+
+    try:
+        outputs, errors = run_batch(public_key, TOOLS[direction], documents, DIRECTIONS[direction][1])
+    except UpstreamError as e:
+        if use_fallback(e):
+            yield from convert_local(direction, documents)
+            return
+        outputs, errors = {}, {index: str(e) for index in range(len(documents))}
+    except Exception as e:
+        outputs, errors = {}, {index: str(e) for index in range(len(documents))}
+    for index in range(len(documents)):
+        if index in outputs:
+            yield index, outputs[index], None, None
+        else:
+            yield index, None, None, errors.get(index, 'Conversion failed')
+
+
+def unique_names(filenames, extension):
+    """Sanitized, unique archive names with the given extension, in input order."""
+    names = []
+    used = set()
+    for i, filename in enumerate(filenames):
+        stem = os.path.splitext(os.path.basename(filename.replace('\\', '/')))[0] or f'document-{i + 1}'
+        name = f'{stem}{extension}'
+        suffix = 1
+        while name.lower() in used:
+            suffix += 1
+            name = f'{stem}-{suffix}{extension}'
+        used.add(name.lower())
+        names.append(name)
+    return names
+
+
+def write_zip(writer, documents, output_names, results):
+    """
+    Write each result to a ZIP on writer as it arrives, then manifest.json.
+    Returns the manifest. Documents and outputs are stored uncompressed:
+    PDF and DOCX are already compressed.
+    """
+    import zipfile
+
+    entries = [None] * len(documents)
+    start = time.perf_counter()
+    with zipfile.ZipFile(writer, 'w', compression=zipfile.ZIP_STORED) as archive:
+        for index, data, page_count, error in results:
+            entry = {
+                'filename': documents[index][0],
+                'status': 'ok' if error is None else 'error',
+                'completed_ms': round((time.perf_counter() - start) * 1000, 1),
+            }
+            if error is None:
+                archive.writestr(output_names[index], data)
+                entry.update({'output': output_names[index], 'bytes': len(data), 'page_count': page_count})
+            else:
+                entry['error'] = error
+            entries[index] = entry
+
+        manifest = {
+            'success': all(entry['status'] == 'ok' for entry in entries),
+            'files': entries,
+            'succeeded': sum(1 for entry in entries if entry['status'] == 'ok'),
+            'failed': sum(1 for entry in entries if entry['status'] == 'error'),
+        }
+        archive.writestr('manifest.json', json.dumps(manifest, indent=2))
+    return manifest
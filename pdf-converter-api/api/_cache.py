@@ -0,0 +1,198 @@
+"""
+Content-addressed cache for conversion results.
+
+Keys are the SHA-256 of the input document plus the conversion kind and options,
+so identical uploads are served without re-parsing. Two tiers:
+- memory: bounded LRU (entry count and total bytes)
+- disk (optional): directory of result files with size-based LRU eviction
+
+Configuration (environment):
+    CONVERSION_CACHE_MAX_BYTES       memory tier budget (default 64 MB, 0 disables)
+    CONVERSION_CACHE_MAX_ENTRIES     memory tier entry limit (default 128)
+    CONVERSION_CACHE_DIR             enables the disk tier when set
+    CONVERSION_CACHE_DISK_MAX_BYTES  disk tier budget (default 512 MB)
+
+No external dependencies — uses Python stdlib only.
+"""
+
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+from _metrics import timed
+
+# Bump when converter output changes so stale results are never served
+CACHE_VERSION = 5
+
+
+class ConversionCache:
+    def __init__(self, max_bytes, max_entries, disk_dir=None, disk_max_bytes=0):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.disk_dir = disk_dir
+        self.disk_max_bytes = disk_max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._counters = {
+            'hits': 0,
+            'memory_hits': 0,
+            'disk_hits': 0,
+            'misses': 0,
+            'stores': 0,
+            'memory_evictions': 0,
+            'disk_evictions': 0,
+        }
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            max_bytes=int(os.environ.get('CONVERSION_CACHE_MAX_BYTES', 64 * 1024 * 1024)),
+            max_entries=int(os.environ.get('CONVERSION_CACHE_MAX_ENTRIES', 128)),
+            disk_dir=os.environ.get('CONVERSION_CACHE_DIR') or None,
+            disk_max_bytes=int(os.environ.get('CONVERSION_CACHE_DISK_MAX_BYTES', 512 * 1024 * 1024)),
+        )
+
+    @staticmethod
+    def key(kind, data, options=None):
+        """Cache key: SHA-256 over the kind, the options and the input bytes."""
+        with timed('hash'):
+            digest = hashlib.sha256()
+            header = json.dumps([CACHE_VERSION, kind, options or {}], sort_keys=True)
+            digest.update(header.encode('utf-8'))
+            digest.update(b'\0')
+            digest.update(data)
+            return digest.hexdigest()
+
+    def get(self, key):
+        """Return (data, meta) for a cached result, or None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self._counters['hits'] += 1
+                self._counters['memory_hits'] += 1
+                return entry
+
+        entry = self._disk_get(key)
+        with self._lock:
+            if entry is None:
+                self._counters['misses'] += 1
+                return None
+            self._counters['hits'] += 1
+            self._counters['disk_hits'] += 1
+            self._memory_put(key, entry)
+        return entry
+
+    def put(self, key, data, meta=None):
+        """Store a result in both tiers. data is copied into an immutable bytes object."""
+        entry = (bytes(data), meta or {})
+        with self._lock:
+            self._counters['stores'] += 1
+            self._memory_put(key, entry)
+        self._disk_put(key, entry)
+
+    def stats(self):
+        """Snapshot of the counters and tier sizes."""
+        with self._lock:
+            stats = dict(self._counters)
+            stats['memory_entries'] = len(self._entries)
+            stats['memory_bytes'] = self._bytes
+            stats['memory_max_bytes'] = self.max_bytes
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_ratio'] = round(stats['hits'] / lookups, 4) if lookups else 0.0
+        if self.disk_dir:
+            stats['disk_bytes'] = sum(size for _, size, _ in self._disk_files())
+            stats['disk_max_bytes'] = self.disk_max_bytes
+        return stats
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    # Memory tier (caller holds the lock)
+
+    def _memory_put(self, key, entry):
+        size = len(entry[0])
+        if size > self.max_bytes or self.max_entries <= 0:
+            return
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._bytes -= len(old[0])
+        self._entries[key] = entry
+        self._bytes += size
+        while self._bytes > self.max_bytes or len(self._entries) > self.max_entries:
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= len(evicted[0])
+            self._counters['memory_evictions'] += 1
+
+    # Disk tier: one file per entry, a JSON meta line followed by the raw bytes.
+    # mtime is bumped on every hit so eviction removes the least recently used files.
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, f'{key}.bin')
+
+    def _disk_get(self, key):
+        if not self.disk_dir:
+            return None
+        path = self._disk_path(key)
+        try:
+            with open(path, 'rb') as f:
+                meta = json.loads(f.readline().decode('utf-8'))
+                data = f.read()
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        return data, meta
+
+    def _disk_put(self, key, entry):
+        if not self.disk_dir or len(entry[0]) > self.disk_max_bytes:
+            return
+        path = self._disk_path(key)
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(json.dumps(entry[1]).encode('utf-8') + b'\n')
+                f.write(entry[0])
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f'Cache write error: {e}')
+            return
+        self._disk_evict()
+
+    def _disk_files(self):
+        files = []
+        try:
+            with os.scandir(self.disk_dir) as it:
+                for item in it:
+                    if item.name.endswith('.bin'):
+                        st = item.stat()
+                        files.append((item.path, st.st_size, st.st_mtime))
+        except OSError:
+            pass
+        return files
+
+    def _disk_evict(self):
+        files = self._disk_files()
+        total = sum(size for _, size, _ in files)
+        if total <= self.disk_max_bytes:
+            return
+        files.sort(key=lambda f: f[2])
+        for path, size, _ in files:
+            if total <= self.disk_max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            with self._lock:
+                self._counters['disk_evictions'] += 1
+
+
+# Shared per-process instance used by the endpoint handlers
+conversion_cache = ConversionCache.from_env()
@@ -0,0 +1,217 @@
+"""
+Inline images for the DOCX to PDF converter, pre-scaled with a per-process cache.
+
+reportlab embeds an image at its full resolution, so a 4000 px photo placed
+two inches wide costs its full size in the PDF and at every render. Each
+picture is instead resampled with Pillow to DOCX_PDF_IMAGE_DPI at the size it
+is placed at: JPEG for photos, PNG for images with transparency or few
+colours (logos, line work). Images that already have no more pixels than that
+are embedded as they are, when reportlab can take them directly (JPEG, PNG).
+
+Results are cached by (hash of the image bytes, target size in pixels), so a
+logo or title-block image repeated across documents is resampled once per
+warm process. Entries created in an isolated conversion worker (see
+api/_admission.py) are sent back and merged into the parent's cache.
+
+Configuration (environment):
+    DOCX_PDF_IMAGE_DPI           resolution at the placed size (default 150)
+    DOCX_PDF_IMAGE_QUALITY       JPEG quality (default 80)
+    DOCX_IMAGE_CACHE_MAX_BYTES   cache memory budget (default 32 MB, 0 disables)
+    DOCX_IMAGE_CACHE_MAX_ENTRIES cache entry limit (default 1024)
+"""
+
+import io
+import os
+import math
+import hashlib
+import threading
+from collections import OrderedDict
+
+IMAGE_DPI = int(os.environ.get('DOCX_PDF_IMAGE_DPI', 150))
+IMAGE_QUALITY = int(os.environ.get('DOCX_PDF_IMAGE_QUALITY', 80))
+
+# Images are only resampled when they shrink by at least this factor per side
+MIN_SCALE = 0.9
+
+# Images with at most this many colours are kept lossless (PNG)
+LOSSLESS_MAX_COLORS = 256
+
+# Rough per-entry overhead (key, tuple, dict slot) in bytes
+ENTRY_OVERHEAD = 200
+
+# Formats reportlab embeds without help
+_DIRECT_FORMATS = ('JPEG', 'PNG')
+
+
+def target_size(width, height, dpi=None):
+    """Pixels needed to show a picture of width x height points at dpi (default IMAGE_DPI)."""
+    dpi = dpi or IMAGE_DPI
+    return max(1, math.ceil(width * dpi / 72)), max(1, math.ceil(height * dpi / 72))
+
+
+def _has_alpha(image):
+    return image.mode in ('RGBA', 'LA', 'PA') or (image.mode == 'P' and 'transparency' in image.info)
+
+
+def prescale(data, size, quality=IMAGE_QUALITY):
+    """
+    The image in data (file bytes) for a target size (pixels): the original
+    bytes if they need no resampling, else a resampled JPEG or PNG.
+    Raises for data Pillow can't read.
+    """
+    from PIL import Image
+
+    with Image.open(io.BytesIO(data)) as image:
+        source = image.size
+        scale = max(size[0] / source[0], size[1] / source[1])
+        if scale > MIN_SCALE and image.format in _DIRECT_FORMATS:
+            return data
+        if scale > MIN_SCALE:
+            # Not a format reportlab takes as is: re-encode at the source size
+            size = source
+        elif image.format == 'JPEG':
+            # Let the JPEG decoder scale down by up to 8x while decoding
+            image.draft(image.mode, size)
+        image.load()
+
+        if _has_alpha(image):
+            image = image.convert('RGBA')
+            lossless = True
+        else:
+            if image.mode not in ('RGB', 'L'):
+                image = image.convert('RGB')
+            lossless = image.format != 'JPEG' and image.getcolors(LOSSLESS_MAX_COLORS) is not None
+        if image.size != size:
+            image = image.resize(size, Image.LANCZOS, reducing_gap=3.0)
+
+        out = io.BytesIO()
+        if lossless:
+            image.save(out, format='PNG', compress_level=6)
+        else:
+            image.save(out, format='JPEG', quality=quality)
+        return out.getvalue()
+
+
+def _entry_size(data):
+    return ENTRY_OVERHEAD + len(data)
+
+
+class ImageCache:
+    def __init__(self, max_bytes, max_entries):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        # key -> (data, size, sequence number)
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._sequence = 0
+        self._fork_sequence = None
+        self._lock = threading.Lock()
+        self._counters = {'hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0, 'merged': 0}
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            max_bytes=int(os.environ.get('DOCX_IMAGE_CACHE_MAX_BYTES', 32 * 1024 * 1024)),
+            max_entries=int(os.environ.get('DOCX_IMAGE_CACHE_MAX_ENTRIES', 1024)),
+        )
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0 and self.max_entries > 0
+
+    @staticmethod
+    def key(data, size):
+        """Cache key: hash of the image bytes and the target size in pixels."""
+        return f'{hashlib.blake2b(data, digest_size=16).hexdigest()}:{size[0]}x{size[1]}'
+
+    def _after_fork(self):
+        # The lock may have been held by another thread of the parent
+        self._lock = threading.Lock()
+        self._fork_sequence = self._sequence
+
+    def get(self, key):
+        """The cached image bytes, or None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._counters['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._counters['hits'] += 1
+            return entry[0]
+
+    def put(self, key, data):
+        if not self.enabled:
+            return
+        size = _entry_size(data)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            self._counters['stores'] += 1
+            self._store(key, data, size)
+
+    def _store(self, key, data, size):
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._bytes -= old[1]
+        self._sequence += 1
+        self._entries[key] = (data, size, self._sequence)
+        self._bytes += size
+        while self._entries and (self._bytes > self.max_bytes or len(self._entries) > self.max_entries):
+            _, (_, evicted_size, _) = self._entries.popitem(last=False)
+            self._bytes -= evicted_size
+            self._counters['evictions'] += 1
+
+    def changes_since_fork(self):
+        """In a forked worker: the entries stored since the fork, as [(key, data)]."""
+        if self._fork_sequence is None:
+            return None
+        with self._lock:
+            return [(key, data) for key, (data, _, sequence) in self._entries.items()
+                    if sequence > self._fork_sequence]
+
+    def merge(self, changes):
+        """Store entries a forked worker created (see changes_since_fork)."""
+        if not changes:
+            return
+        with self._lock:
+            for key, data in changes:
+                self._counters['merged'] += 1
+                self._store(key, data, _entry_size(data))
+
+    def stats(self):
+        """Snapshot of the counters and size."""
+        with self._lock:
+            lookups = self._counters['hits'] + self._counters['misses']
+            return dict(self._counters, entries=len(self._entries), bytes=self._bytes,
+                        max_bytes=self.max_bytes, max_entries=self.max_entries,
+                        hit_rate=round(self._counters['hits'] / lookups, 4) if lookups else None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+
+image_cache = ImageCache.from_env()
+
+
+def scaled_image(data, width, height):
+    """
+    Image bytes for a picture drawn at width x height points, from the cache
+    or pre-scaled (see prescale). Returns None for images Pillow can't read.
+    """
+    size = target_size(width, height)
+    key = ImageCache.key(data, size)
+    cached = image_cache.get(key)
+    if cached is not None:
+        return cached
+    try:
+        scaled = prescale(data, size)
+    except Exception as e:
+        print(f'Image left out of the PDF: {e}')
+        return None
+    image_cache.put(key, scaled)
+    return scaled
@@ -0,0 +1,349 @@
+"""
+Low-memory DOCX reader for the DOCX to PDF converter.
+
+Opens the DOCX zip directly and streams the main document part with
+ElementTree's iterparse instead of building python-docx's full lxml tree and
+proxy objects. Each top-level body element (paragraph or table) is turned into
+a lightweight record as soon as it has been parsed and is then dropped, so
+memory stays proportional to the largest single block, not to the document.
+
+Records are the tuples the converter's python-docx walker yields:
+    ('paragraph', text, style_name, fonts)
+                         fonts is the (ascii, eastAsia, cs) font names of the
+                         first run that sets any (w:rFonts), or None
+    ('table', rows)      rows is a list of lists of cell text
+    ('image', data, width, height)
+                         a picture (w:drawing, inline or anchored) in the
+                         paragraph before it: the image part's bytes and the
+                         drawn size in points, one record per picture in order
+
+Text, style names and table cells follow python-docx's rules: run text with
+tabs, breaks and non-breaking hyphens mapped to characters, hyperlink text
+included, the document's default paragraph style when none is set, and
+merged cells repeated across the grid positions they span. Documents this
+reader doesn't cover raise UnsupportedDocx; callers convert those with
+python-docx instead.
+
+Configuration (environment):
+    DOCX_READER   default reader: stream or python-docx (default stream)
+
+No external dependencies — uses Python stdlib only.
+"""
+
+import os
+import re
+import zipfile
+import posixpath
+import xml.etree.ElementTree as ET
+
+DOCX_READERS = ('stream', 'python-docx')
+DOCX_READER = os.environ.get('DOCX_READER', 'stream')
+
+_W = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+_REL = '{http://schemas.openxmlformats.org/package/2006/relationships}Relationship'
+_OFFICE_DOCUMENT = '/officeDocument'
+_STYLES = '/styles'
+
+_BODY = _W + 'body'
+_P = _W + 'p'
+_TBL = _W + 'tbl'
+_TR = _W + 'tr'
+_TC = _W + 'tc'
+_R = _W + 'r'
+_DRAWING = _W + 'drawing'
+_HYPERLINK = _W + 'hyperlink'
+_VAL = _W + 'val'
+
+_WP = '{http://schemas.openxmlformats.org/drawingml/2006/wordprocessingDrawing}'
+_DRAWING_CONTAINERS = (_WP + 'inline', _WP + 'anchor')
+_BLIP = '{http://schemas.openxmlformats.org/drawingml/2006/main}blip'
+_EMBED = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}embed'
+
+EMU_PER_POINT = 12700
+
+# Run children with a text equivalent (w:t and w:br are handled separately)
+_RUN_CHARS = {_W + 'tab': '\t', _W + 'ptab': '\t', _W + 'cr': '\n', _W + 'noBreakHyphen': '-'}
+
+# python-docx reports these built-in style names in their UI spelling
+_UI_STYLE_NAMES = {'caption': 'Caption', 'footer': 'Footer', 'header': 'Header'}
+_UI_STYLE_NAMES.update((f'heading {n}', f'Heading {n}') for n in range(1, 10))
+
+_TRUE = ('1', 'true', 'on')
+
+_SAVED_PAGES = re.compile(rb'<Pages>(\d+)</Pages>')
+
+
+class UnsupportedDocx(Exception):
+    """The document uses something this reader doesn't handle; read it with python-docx."""
+
+
+def saved_page_count(archive):
+    """Page count of an open DOCX zip as last saved by Word (docProps/app.xml), or None."""
+    try:
+        match = _SAVED_PAGES.search(archive.read('docProps/app.xml'))
+    except KeyError:
+        return None
+    return int(match.group(1)) if match else None
+
+
+def _rels_path(part):
+    directory, name = posixpath.split(part)
+    return posixpath.join(directory, '_rels', name + '.rels')
+
+
+def _rel_targets(archive, source):
+    """{relationship id: zip path} of the internal parts that `source` links to."""
+    try:
+        rels = ET.fromstring(archive.read(_rels_path(source)))
+    except KeyError:
+        return {}
+    targets = {}
+    for rel in rels.iter(_REL):
+        if rel.get('TargetMode') != 'External':
+            target = rel.get('Target', '')
+            targets[rel.get('Id')] = (target[1:] if target.startswith('/') else
+                                      posixpath.normpath(posixpath.join(posixpath.dirname(source), target)))
+    return targets
+
+
+def _rel_target(archive, source, rel_type):
+    """Zip path of the part that `source` (None for the package) links to with rel_type."""
+    try:
+        rels = ET.fromstring(archive.read(_rels_path(source or '')))
+    except KeyError:
+        return None
+    for rel in rels.iter(_REL):
+        if rel.get('Type', '').endswith(rel_type) and rel.get('TargetMode') != 'External':
+            target = rel.get('Target', '')
+            if target.startswith('/'):
+                return target[1:]
+            return posixpath.normpath(posixpath.join(posixpath.dirname(source or ''), target))
+    return None
+
+
+def _read_styles(archive, document_part):
+    """Return (paragraph style names by id, default paragraph style name)."""
+    styles_part = _rel_target(archive, document_part, _STYLES)
+    if styles_part is None:
+        raise UnsupportedDocx('no styles part')
+    names = {}
+    default = None
+    for style in ET.fromstring(archive.read(styles_part)).iter(_W + 'style'):
+        if style.get(_W + 'type') != 'paragraph':
+            continue
+        name_element = style.find(_W + 'name')
+        name = name_element.get(_VAL) if name_element is not None else None
+        name = _UI_STYLE_NAMES.get(name, name)
+        style_id = style.get(_W + 'styleId')
+        # The first style with an id wins, the last default wins (as in python-docx)
+        if style_id is not None and style_id not in names:
+            names[style_id] = name
+        if style.get(_W + 'default') in _TRUE:
+            default = name
+    return names, default
+
+
+def _run_text(run, parts):
+    for child in run:
+        tag = child.tag
+        if tag == _W + 't':
+            parts.append(child.text or '')
+        elif tag == _W + 'br':
+            if child.get(_W + 'type', 'textWrapping') == 'textWrapping':
+                parts.append('\n')
+        else:
+            char = _RUN_CHARS.get(tag)
+            if char:
+                parts.append(char)
+
+
+def _paragraph_text(paragraph):
+    """Text of the runs and hyperlinks directly inside a w:p."""
+    parts = []
+    for child in paragraph:
+        if child.tag == _R:
+            _run_text(child, parts)
+        elif child.tag == _HYPERLINK:
+            for run in child:
+                if run.tag == _R:
+                    _run_text(run, parts)
+    return ''.join(parts)
+
+
+def paragraph_pictures(paragraph):
+    """
+    [(relationship id, width, height)] of the pictures in a w:p, sizes in points.
+    Works on ElementTree and lxml (python-docx) elements alike.
+    """
+    pictures = []
+    for drawing in paragraph.iter(_DRAWING):
+        for container in drawing:
+            if container.tag not in _DRAWING_CONTAINERS:
+                continue
+            extent = container.find(_WP + 'extent')
+            blip = next(container.iter(_BLIP), None)
+            if extent is None or blip is None or not blip.get(_EMBED):
+                continue
+            try:
+                width = int(extent.get('cx')) / EMU_PER_POINT
+                height = int(extent.get('cy')) / EMU_PER_POINT
+            except (TypeError, ValueError):
+                continue
+            pictures.append((blip.get(_EMBED), width, height))
+    return pictures
+
+
+def paragraph_fonts(paragraph):
+    """
+    (ascii, eastAsia, cs) font names of the first run in a w:p that sets any,
+    or None. Works on ElementTree and lxml (python-docx) elements alike.
+    """
+    for child in paragraph:
+        runs = (child,) if child.tag == _R else child if child.tag == _HYPERLINK else ()
+        for run in runs:
+            if run.tag != _R:
+                continue
+            properties = run.find(_W + 'rPr')
+            fonts = properties.find(_W + 'rFonts') if properties is not None else None
+            if fonts is None:
+                continue
+            names = (fonts.get(_W + 'ascii') or fonts.get(_W + 'hAnsi'), fonts.get(_W + 'eastAsia'),
+                     fonts.get(_W + 'cs'))
+            if any(names):
+                return names
+    return None
+
+
+def _paragraph_style_id(paragraph):
+    properties = paragraph.find(_W + 'pPr')
+    if properties is None:
+        return None
+    style = properties.find(_W + 'pStyle')
+    return style.get(_VAL) if style is not None else None
+
+
+def _cell_properties(cell):
+    """(grid span, vMerge value or None) of a w:tc."""
+    properties = cell.find(_W + 'tcPr')
+    if properties is None:
+        return 1, None
+    span = properties.find(_W + 'gridSpan')
+    merge = properties.find(_W + 'vMerge')
+    return (int(span.get(_VAL, 1)) if span is not None else 1,
+            (merge.get(_VAL) or 'continue') if merge is not None else None)
+
+
+def _grid_before(row):
+    properties = row.find(_W + 'trPr')
+    before = properties.find(_W + 'gridBefore') if properties is not None else None
+    return int(before.get(_VAL, 0)) if before is not None else 0
+
+
+def _table_rows(table):
+    """Rows of cell text; a merged cell repeats for each grid column it spans."""
+    rows = []
+    above = {}
+    for row in table:
+        if row.tag != _TR:
+            continue
+        cells = []
+        current = {}
+        offset = _grid_before(row)
+        for cell in row:
+            if cell.tag != _TC:
+                continue
+            span, merge = _cell_properties(cell)
+            if merge == 'continue':
+                # Continuation of a vertical merge: the cell above holds the content
+                if offset not in above:
+                    raise UnsupportedDocx('vertical merge without a cell above')
+                text, span = above[offset]
+            else:
+                text = '\n'.join(_paragraph_text(p) for p in cell if p.tag == _P)
+            current[offset] = (text, span)
+            cells.extend([text] * span)
+            offset += span
+        rows.append(cells)
+        above = current
+    return rows
+
+
+def iter_docx_blocks(docx_bytes):
+    """
+    Yield the body's paragraphs and tables in document order as records.
+    Raises UnsupportedDocx for packages this reader can't handle.
+    """
+    try:
+        archive = zipfile.ZipFile(_BytesReader(docx_bytes))
+    except zipfile.BadZipFile as e:
+        raise UnsupportedDocx(str(e))
+
+    with archive:
+        document_part = _rel_target(archive, None, _OFFICE_DOCUMENT)
+        if document_part is None:
+            raise UnsupportedDocx('no main document part')
+        try:
+            style_names, default_style = _read_styles(archive, document_part)
+            targets = _rel_targets(archive, document_part)
+            source = archive.open(document_part)
+        except (KeyError, ET.ParseError) as e:
+            raise UnsupportedDocx(str(e))
+
+        with source:
+            depth = 0
+            body = None
+            try:
+                for event, element in ET.iterparse(source, events=('start', 'end')):
+                    if event == 'start':
+                        depth += 1
+                        if depth == 2 and element.tag == _BODY:
+                            body = element
+                        continue
+                    depth -= 1
+                    if depth != 2 or body is None:
+                        continue
+
+                    # A top-level body element is complete: emit it and let it go
+                    if element.tag == _P:
+                        style_id = _paragraph_style_id(element)
+                        style = style_names.get(style_id, default_style) if style_id else default_style
+                        yield 'paragraph', _paragraph_text(element), style or '', paragraph_fonts(element)
+                        for rel_id, width, height in paragraph_pictures(element):
+                            try:
+                                data = archive.read(targets[rel_id])
+                            except KeyError:
+                                continue
+                            yield 'image', data, width, height
+                    elif element.tag == _TBL:
+                        yield 'table', _table_rows(element)
+                    body.remove(element)
+            except ET.ParseError as e:
+                raise UnsupportedDocx(str(e))
+
+
+class _BytesReader:
+    """Minimal seekable file over a bytes-like object, without copying it (unlike BytesIO of a memoryview)."""
+
+    def __init__(self, data):
+        self._view = memoryview(data)
+        self._pos = 0
+
+    def seekable(self):
+        return True
+
+    def seek(self, offset, whence=0):
+        if whence == 1:
+            offset += self._pos
+        elif whence == 2:
+            offset += len(self._view)
+        self._pos = max(0, offset)
+        return self._pos
+
+    def tell(self):
+        return self._pos
+
+    def read(self, size=-1):
+        end = len(self._view) if size is None or size < 0 else min(len(self._view), self._pos + size)
+        data = self._view[self._pos:end].tobytes()
+        self._pos = end
+        return data
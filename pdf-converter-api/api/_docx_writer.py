@@ -0,0 +1,245 @@
+"""
+Streaming WordprocessingML writer for the PDF to DOCX converter.
+
+python-docx builds an lxml element per paragraph, run and text node and then
+serializes the whole tree on save. This writer instead takes every package
+part from a python-docx template document once, then writes a new DOCX
+straight into a zip stream: the parts before word/document.xml are copied,
+the body is appended as XML text while paragraphs arrive, and the remaining
+parts are copied on close.
+
+The paragraph markup is what python-docx emits for add_paragraph(text),
+add_heading(text, level) and add_page_break() (tabs as <w:tab/>, line breaks
+as <w:br/>, xml:space="preserve" on text with outer whitespace), so the
+resulting document.xml is byte-identical to saving the same calls through
+python-docx. Heading style references are resolved from the template once.
+
+Pictures use the markup of add_picture(stream, width, height): one media part
+per distinct image (word/media/imageN.png or .jpg), referenced from the
+document's relationships, with Default content types for the extensions used.
+"""
+
+import re
+import io
+import zipfile
+
+_DOCUMENT_PART = 'word/document.xml'
+_DOCUMENT_RELS = 'word/_rels/document.xml.rels'
+_CONTENT_TYPES = '[Content_Types].xml'
+_BODY_END = '</w:body>'
+_SECTION = '<w:sectPr'
+
+# Text runs are split on the characters python-docx turns into elements
+_RUN_SPLIT = re.compile('([\t\r\n])')
+_RUN_ELEMENTS = {'\t': '<w:tab/>', '\r': '<w:br/>', '\n': '<w:br/>'}
+
+# lxml refuses these in text, and python-docx with it
+_XML_INVALID = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff\ud800-\udfff]')
+
+_PAGE_BREAK = '<w:p><w:r><w:br w:type="page"/></w:r></w:p>'
+
+# Media extension -> content type, as python-docx names image parts
+MEDIA_TYPES = {'png': 'image/png', 'jpg': 'image/jpeg'}
+
+_IMAGE_RELATIONSHIP = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships/image'
+_DEFAULT_TYPE = re.compile(r'<Default Extension="([^"]+)" ContentType="[^"]+"/>')
+_RELATIONSHIP_ID = re.compile(r'Id="rId(\d+)"')
+
+EMU_PER_POINT = 12700
+
+_PICTURE = (
+    '<w:p><w:r><w:drawing><wp:inline xmlns:a="http://schemas.openxmlformats.org/drawingml/2006/main" '
+    'xmlns:pic="http://schemas.openxmlformats.org/drawingml/2006/picture"><wp:extent cx="{cx}" cy="{cy}"/>'
+    '<wp:docPr id="{id}" name="Picture {id}"/><wp:cNvGraphicFramePr><a:graphicFrameLocks noChangeAspect="1"/>'
+    '</wp:cNvGraphicFramePr><a:graphic><a:graphicData uri="http://schemas.openxmlformats.org/drawingml/2006/picture">'
+    '<pic:pic><pic:nvPicPr><pic:cNvPr id="0" name="image.{ext}"/><pic:cNvPicPr/></pic:nvPicPr><pic:blipFill>'
+    '<a:blip r:embed="{rid}"/><a:stretch><a:fillRect/></a:stretch></pic:blipFill><pic:spPr><a:xfrm>'
+    '<a:off x="0" y="0"/><a:ext cx="{cx}" cy="{cy}"/></a:xfrm><a:prstGeom prst="rect"/></pic:spPr></pic:pic>'
+    '</a:graphicData></a:graphic></wp:inline></w:drawing></w:r></w:p>'
+)
+
+
+def _with_media_types(content_types, extensions):
+    """[Content_Types].xml with a Default entry for each media extension, in python-docx's (sorted) order."""
+    xml = content_types.decode('utf-8')
+    defaults = {match.group(1): match.group(0) for match in _DEFAULT_TYPE.finditer(xml)}
+    if not defaults or extensions <= set(defaults):
+        return content_types
+    for extension in extensions:
+        defaults.setdefault(extension, f'<Default Extension="{extension}" ContentType="{MEDIA_TYPES[extension]}"/>')
+    matches = list(_DEFAULT_TYPE.finditer(xml))
+    start, end = matches[0].start(), matches[-1].end()
+    return (xml[:start] + ''.join(defaults[name] for name in sorted(defaults)) + xml[end:]).encode('utf-8')
+
+
+def _escape(text):
+    return text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+
+
+def _run_xml(text):
+    """The <w:r> python-docx writes for run.text = text."""
+    if _XML_INVALID.search(text):
+        raise ValueError('All strings must be XML compatible: Unicode or ASCII, no NULL bytes or control characters')
+    parts = ['<w:r>']
+    for piece in _RUN_SPLIT.split(text):
+        element = _RUN_ELEMENTS.get(piece)
+        if element:
+            parts.append(element)
+        elif piece:
+            parts.append('<w:t xml:space="preserve">' if len(piece.strip()) < len(piece) else '<w:t>')
+            parts.append(_escape(piece))
+            parts.append('</w:t>')
+    parts.append('</w:r>')
+    return ''.join(parts)
+
+
+class DocxTemplate:
+    """
+    The package parts of a python-docx document with the body split open at
+    the point where python-docx inserts new paragraphs (before the section
+    properties), and the style ids of its heading styles.
+    """
+
+    def __init__(self, doc):
+        from docx.enum.style import WD_STYLE_TYPE
+
+        package = io.BytesIO()
+        doc.save(package)
+        with zipfile.ZipFile(package) as archive:
+            self.parts = [(name, archive.read(name)) for name in archive.namelist()]
+
+        names = [name for name, _ in self.parts]
+        self.document_index = names.index(_DOCUMENT_PART)
+        document_xml = self.parts[self.document_index][1].decode('utf-8')
+        split = document_xml.rfind(_SECTION)
+        if split < 0:
+            split = document_xml.rfind(_BODY_END)
+        if split < 0:
+            raise ValueError('Template document has no open body')
+        self.body_prefix = document_xml[:split].encode('utf-8')
+        self.body_suffix = document_xml[split:].encode('utf-8')
+        self.relationships = dict(self.parts)[_DOCUMENT_RELS].decode('utf-8')
+
+        # add_heading(level=n) uses the paragraph style named 'Heading n' ('Title' for 0)
+        self._heading_props = {}
+        for level in range(10):
+            name = 'Title' if level == 0 else f'Heading {level}'
+            try:
+                style = doc.styles[name]
+            except KeyError:
+                continue
+            if style.type == WD_STYLE_TYPE.PARAGRAPH:
+                self._heading_props[level] = f'<w:pPr><w:pStyle w:val="{style.style_id}"/></w:pPr>'
+
+        # Text area of the (last) section in EMU, for fitting pictures
+        section = doc.sections[-1]
+        self.text_width = section.page_width - section.left_margin - section.right_margin
+        self.text_height = section.page_height - section.top_margin - section.bottom_margin
+
+    def fit(self, cx, cy):
+        """A picture extent (EMU) scaled down, keeping its aspect ratio, to fit the text area."""
+        scale = min(1.0, self.text_width / cx, self.text_height / cy) if cx and cy else 1.0
+        return max(1, int(cx * scale)), max(1, int(cy * scale))
+
+    def heading_properties(self, level):
+        try:
+            return self._heading_props[level]
+        except KeyError:
+            raise ValueError(f'Template has no style for heading level {level}')
+
+
+class DocxWriter:
+    """
+    Writes a DOCX built from `template` into the binary stream `out`.
+    Add paragraphs in order, then close() (or use it as a context manager);
+    paragraphs are buffered and written to the compressed document part in batches.
+    """
+
+    # Buffered body text (characters) before it is handed to the compressor
+    FLUSH_CHARS = 64 * 1024
+
+    def __init__(self, template, out, media=()):
+        """
+        media: [(file bytes, extension)] of the pictures the document will show
+        (extensions from MEDIA_TYPES); picture(index, ...) refers to them by index.
+        """
+        self._template = template
+        self._media = list(media)
+        # python-docx gives new relationships the next free ids
+        first = max((int(n) for n in _RELATIONSHIP_ID.findall(template.relationships)), default=0) + 1
+        self._media_ids = [f'rId{first + n}' for n in range(len(self._media))]
+        self._pictures = 0
+        self._zip = zipfile.ZipFile(out, 'w', compression=zipfile.ZIP_DEFLATED)
+        for name, data in template.parts[:template.document_index]:
+            if name == _CONTENT_TYPES and self._media:
+                data = _with_media_types(data, {extension for _, extension in self._media})
+            self._zip.writestr(name, data)
+        self._document = self._zip.open(_DOCUMENT_PART, 'w')
+        self._document.write(template.body_prefix)
+        self._pending = []
+        self._pending_chars = 0
+
+    def _append(self, xml):
+        self._pending.append(xml)
+        self._pending_chars += len(xml)
+        if self._pending_chars >= self.FLUSH_CHARS:
+            self.flush()
+
+    def flush(self):
+        """Write the buffered paragraphs to the document part."""
+        if self._pending:
+            self._document.write(''.join(self._pending).encode('utf-8'))
+            self._pending = []
+            self._pending_chars = 0
+
+    def paragraph(self, text=''):
+        """Same markup as doc.add_paragraph(text)."""
+        self._append(f'<w:p>{_run_xml(text)}</w:p>' if text else '<w:p/>')
+
+    def heading(self, text='', level=1):
+        """Same markup as doc.add_heading(text, level)."""
+        properties = self._template.heading_properties(level)
+        self._append(f'<w:p>{properties}{_run_xml(text) if text else ""}</w:p>')
+
+    def page_break(self):
+        """Same markup as doc.add_page_break()."""
+        self._append(_PAGE_BREAK)
+
+    def picture(self, index, cx, cy):
+        """Same markup as doc.add_picture(media[index], width=Emu(cx), height=Emu(cy))."""
+        self._pictures += 1
+        self._append(_PICTURE.format(cx=int(cx), cy=int(cy), id=self._pictures, ext=self._media[index][1],
+                                     rid=self._media_ids[index]))
+
+    def close(self):
+        """Finish the document part and copy the remaining template parts."""
+        self.flush()
+        self._document.write(self._template.body_suffix)
+        self._document.close()
+        for name, data in self._template.parts[self._template.document_index + 1:]:
+            if name == _DOCUMENT_RELS and self._media:
+                data = self._relationships()
+            self._zip.writestr(name, data)
+        for number, (data, extension) in enumerate(self._media, 1):
+            # Already compressed: stored, not deflated again
+            self._zip.writestr(f'word/media/image{number}.{extension}', data, compress_type=zipfile.ZIP_STORED)
+        self._zip.close()
+
+    def _relationships(self):
+        """The document's relationships part with one image relationship per media part."""
+        xml = self._template.relationships
+        end = xml.rindex('</Relationships>')
+        added = ''.join(f'<Relationship Id="{rid}" Type="{_IMAGE_RELATIONSHIP}" Target="media/image{number}.{extension}"/>'
+                        for number, (rid, (_, extension)) in enumerate(zip(self._media_ids, self._media), 1))
+        return (xml[:end] + added + xml[end:]).encode('utf-8')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            # Leave the partial package unfinished, but release the zip handles
+            self._document.close()
+            self._zip.close()
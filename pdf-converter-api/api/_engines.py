@@ -0,0 +1,382 @@
+"""
+Converter engines and the router that picks one for each conversion.
+
+The local converters (pdf-to-docx.py, docx-to-pdf.py) and the iLovePDF proxy
+are two engines behind the same endpoint per direction. With engine=auto
+(the default) the router ranks the eligible engines for each document:
+
+1. Eligibility: iLovePDF needs a public_key (from the request or
+   ILOVEPDF_PUBLIC_KEY) and a circuit breaker that isn't open.
+2. Document: images (when the local converter drops them), many tables, a
+   large file or many pages send the document to iLovePDF first; simple
+   documents stay local and skip the upstream round trips.
+3. Health: the preferred engine is demoted when its rolling error rate reaches
+   ROUTER_MAX_ERROR_RATE, or its rolling median latency per MB is more than
+   ROUTER_LATENCY_FACTOR times the other engine's.
+
+Local conversions go through admission control (api/_admission.py); a local
+rejection (overload or work limits) falls back to iLovePDF like any other
+failure, but doesn't count against the local engine's health.
+
+If the first engine fails, the next one is tried. Cached local results are
+served before any routing. Previews (some pages only, see api/_preview.py)
+are converted locally. Every decision (features, order, reason, engine,
+fallback errors) goes into a ring buffer, and every call into its engine's
+latency histogram; GET on the conversion endpoints returns both.
+
+Configuration (environment):
+    CONVERTER_ENGINE          default engine: auto, local or ilovepdf (default auto)
+    ILOVEPDF_PUBLIC_KEY       iLovePDF key used when the request doesn't carry one
+    ROUTER_LOCAL_MAX_BYTES    larger documents prefer iLovePDF (default 10 MB)
+    ROUTER_LOCAL_MAX_PAGES    documents with more pages prefer iLovePDF (default 300)
+    ROUTER_LOCAL_MAX_TABLES   DOCX with more tables prefer iLovePDF (default 200)
+    ROUTER_WINDOW             calls per engine in the rolling window (default 50)
+    ROUTER_MIN_SAMPLES        calls in the window before health can demote (default 5)
+    ROUTER_MAX_ERROR_RATE     rolling error rate that demotes an engine (default 0.5)
+    ROUTER_LATENCY_FACTOR     latency ratio that demotes an engine (default 3)
+"""
+
+import io
+import os
+import re
+import time
+import threading
+from bisect import bisect_left
+from collections import deque
+from _admission import AdmissionError, admission
+from _cache import conversion_cache
+from _metrics import timed
+from _pdf_extract import declared_page_count
+from _preview import PreviewError
+
+ENGINES = ('auto', 'local', 'ilovepdf')
+DEFAULT_ENGINE = os.environ.get('CONVERTER_ENGINE', 'auto')
+
+# Upper bounds (ms) of the latency histogram buckets; a +Inf bucket follows
+LATENCY_BUCKETS_MS = (100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000)
+
+# Documents under 1 MB count as 1 MB for latency per MB: fixed costs dominate them
+_MB = 1024 * 1024
+
+_PDF_IMAGE = re.compile(rb'/Subtype\s*/Image\b')
+
+_local_converters = {}
+_local_warm_ups = {}
+# Directions whose local converter keeps the document's images
+_local_keeps_images = set()
+
+
+def register_local(direction, convert, warm_up=None, keeps_images=False):
+    """
+    Register the local converter for a direction:
+    convert(data, progress, **options) -> (buffer, page_count) or
+    (buffer, page_count, details); details (e.g. {'preview': ...}) is added to
+    the routing decision and cached with the result.
+    warm_up() imports its dependencies; it runs before an isolated conversion forks.
+    keeps_images: documents with images don't need iLovePDF for this direction.
+    """
+    _local_converters[direction] = convert
+    _local_warm_ups[direction] = warm_up
+    if keeps_images:
+        _local_keeps_images.add(direction)
+    else:
+        _local_keeps_images.discard(direction)
+
+
+def _pdf_features(data):
+    from PyPDF2 import PdfReader
+
+    try:
+        # The root /Count, without flattening the page tree
+        pages = declared_page_count(PdfReader(io.BytesIO(data)))
+    except Exception:
+        pages = None
+    # Image XObjects are stream dictionaries, which are never compressed
+    return {'pages': pages, 'images': bool(_PDF_IMAGE.search(data)), 'tables': None}
+
+
+def _docx_features(data):
+    import zipfile
+    from _docx_reader import saved_page_count
+
+    try:
+        with zipfile.ZipFile(io.BytesIO(data)) as archive:
+            names = archive.namelist()
+            body = archive.read('word/document.xml')
+            pages = saved_page_count(archive)
+    except (zipfile.BadZipFile, KeyError):
+        return {'pages': None, 'images': False, 'tables': 0}
+    return {
+        'pages': pages,
+        'images': any(name.startswith('word/media/') for name in names),
+        'tables': body.count(b'<w:tbl>'),
+    }
+
+
+class ConversionJob:
+    """
+    One document to convert; its features are probed only if routing needs them.
+    options are passed through to the local converter.
+    """
+
+    def __init__(self, direction, data, cache_key, public_key=None, options=None):
+        self.direction = direction
+        self.data = data
+        self.cache_key = cache_key
+        self.public_key = public_key or os.environ.get('ILOVEPDF_PUBLIC_KEY')
+        self.options = options or {}
+        self._features = None
+
+    @property
+    def size(self):
+        return len(self.data)
+
+    def features(self):
+        if self._features is None:
+            probe = _pdf_features if self.direction == 'pdf-to-docx' else _docx_features
+            with timed('probe'):
+                self._features = probe(self.data)
+        return self._features
+
+
+class LocalEngine:
+    name = 'local'
+
+    def eligible(self, job):
+        return True, None
+
+    def convert(self, job, progress=None):
+        converter = _local_converters[job.direction]
+
+        def convert(data, progress):
+            return converter(data, progress, **job.options)
+
+        buffer, page_count, *details = admission.run(job.direction, job.data, convert, progress,
+                                                     prepare=_local_warm_ups[job.direction])
+        details = details[0] if details else {}
+        with timed('cache'):
+            conversion_cache.put(job.cache_key, buffer, dict(details, page_count=page_count))
+        return buffer, page_count, details
+
+
+class ILovePDFEngine:
+    name = 'ilovepdf'
+
+    def eligible(self, job):
+        if not job.public_key:
+            return False, 'no public_key'
+        from _ilovepdf import breaker
+
+        if breaker.is_open():
+            return False, 'circuit open'
+        return True, None
+
+    def convert(self, job, progress=None):
+        from _ilovepdf import run_pipeline
+
+        with run_pipeline(job.public_key, job.data, job.direction, progress) as result:
+            with timed('ilovepdf_download'):
+                return result.read(), None, {}
+
+
+class EngineStats:
+    """Rolling outcomes (the last `window` calls) and a latency histogram for one engine."""
+
+    def __init__(self, window):
+        self._recent = deque(maxlen=window)
+        self._buckets = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self._calls = 0
+        self._errors = 0
+        self._sum_ms = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, ok, ms, size):
+        with self._lock:
+            self._recent.append((ok, ms, size))
+            self._calls += 1
+            self._errors += not ok
+            self._sum_ms += ms
+            self._buckets[bisect_left(LATENCY_BUCKETS_MS, ms)] += 1
+
+    def health(self):
+        """(samples, error_rate, ms_per_mb) over the rolling window; ms_per_mb is None without successes."""
+        with self._lock:
+            recent = list(self._recent)
+        if not recent:
+            return 0, 0.0, None
+        errors = sum(1 for ok, _, _ in recent if not ok)
+        rates = sorted(ms / max(size / _MB, 1.0) for ok, ms, size in recent if ok)
+        return len(recent), errors / len(recent), rates[len(rates) // 2] if rates else None
+
+    def snapshot(self):
+        samples, error_rate, ms_per_mb = self.health()
+        with self._lock:
+            latencies = sorted(ms for _, ms, _ in self._recent)
+            buckets = list(self._buckets)
+            calls, errors, sum_ms = self._calls, self._errors, self._sum_ms
+
+        # Cumulative counts, Prometheus style
+        histogram = []
+        total = 0
+        for bound, count in zip(LATENCY_BUCKETS_MS + ('+Inf',), buckets):
+            total += count
+            histogram.append({'le': bound, 'count': total})
+        return {
+            'calls': calls,
+            'errors': errors,
+            'sum_ms': round(sum_ms, 1),
+            'rolling': {
+                'samples': samples,
+                'error_rate': round(error_rate, 3),
+                'p50_ms': round(latencies[len(latencies) // 2], 1) if latencies else None,
+                'p95_ms': round(latencies[int(len(latencies) * 0.95)], 1) if latencies else None,
+                'ms_per_mb': round(ms_per_mb, 1) if ms_per_mb is not None else None,
+            },
+            'histogram': histogram,
+        }
+
+
+class Router:
+    def __init__(self, local_max_bytes=10 * _MB, local_max_pages=300, local_max_tables=200, window=50,
+                 min_samples=5, max_error_rate=0.5, latency_factor=3.0, log_size=100):
+        self.local_max_bytes = local_max_bytes
+        self.local_max_pages = local_max_pages
+        self.local_max_tables = local_max_tables
+        self.min_samples = min_samples
+        self.max_error_rate = max_error_rate
+        self.latency_factor = latency_factor
+        self.engines = {engine.name: engine for engine in (LocalEngine(), ILovePDFEngine())}
+        self.stats = {name: EngineStats(window) for name in self.engines}
+        self._decisions = deque(maxlen=log_size)
+        self._counters = {'decisions': 0, 'fallbacks': 0, 'failures': 0}
+        self._by_engine = {}
+        self._by_reason = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            local_max_bytes=int(os.environ.get('ROUTER_LOCAL_MAX_BYTES', 10 * _MB)),
+            local_max_pages=int(os.environ.get('ROUTER_LOCAL_MAX_PAGES', 300)),
+            local_max_tables=int(os.environ.get('ROUTER_LOCAL_MAX_TABLES', 200)),
+            window=int(os.environ.get('ROUTER_WINDOW', 50)),
+            min_samples=int(os.environ.get('ROUTER_MIN_SAMPLES', 5)),
+            max_error_rate=float(os.environ.get('ROUTER_MAX_ERROR_RATE', 0.5)),
+            latency_factor=float(os.environ.get('ROUTER_LATENCY_FACTOR', 3)),
+        )
+
+    def _prefer(self, job):
+        """(engine, reason) preferred for the document alone."""
+        features = job.features()
+        if features['images'] and job.direction not in _local_keeps_images:
+            return 'ilovepdf', 'images'
+        if features['tables'] and features['tables'] > self.local_max_tables:
+            return 'ilovepdf', 'tables'
+        if job.size > self.local_max_bytes:
+            return 'ilovepdf', 'size'
+        if features['pages'] and features['pages'] > self.local_max_pages:
+            return 'ilovepdf', 'pages'
+        return 'local', 'simple'
+
+    def rank(self, job):
+        """Return (engine names in the order to try, reason code, detail)."""
+        eligible = []
+        skipped = []
+        for name, engine in self.engines.items():
+            ok, why = engine.eligible(job)
+            if ok:
+                eligible.append(name)
+            else:
+                skipped.append(f'{name}: {why}')
+        if len(eligible) < 2:
+            return eligible, 'unavailable', '; '.join(skipped)
+
+        preferred, reason = self._prefer(job)
+        other = 'local' if preferred == 'ilovepdf' else 'ilovepdf'
+        detail = None
+
+        samples, error_rate, ms_per_mb = self.stats[preferred].health()
+        other_samples, other_error_rate, other_ms_per_mb = self.stats[other].health()
+        if samples >= self.min_samples and error_rate >= self.max_error_rate and other_error_rate < error_rate:
+            detail = f'{reason} prefers {preferred}, but its error rate is {error_rate:.0%}'
+            preferred, other, reason = other, preferred, 'error_rate'
+        elif (samples >= self.min_samples and other_samples >= self.min_samples
+              and ms_per_mb is not None and other_ms_per_mb is not None
+              and ms_per_mb > self.latency_factor * other_ms_per_mb):
+            detail = f'{reason} prefers {preferred}, but it takes {ms_per_mb:.0f} ms/MB vs {other_ms_per_mb:.0f}'
+            preferred, other, reason = other, preferred, 'latency'
+        return [preferred, other], reason, detail
+
+    def convert(self, job, engine='auto', progress=None):
+        """
+        Convert job with the requested engine, or the ranked engines for 'auto'
+        (falling back to the next one on failure).
+        Returns (buffer, page_count, decision); raises the last engine's error.
+        The local converter's details (see register_local) are in the decision.
+        """
+        decision = {'time': round(time.time(), 3), 'direction': job.direction, 'bytes': job.size, 'requested': engine}
+
+        with timed('cache'):
+            cached = conversion_cache.get(job.cache_key)
+        if cached is not None:
+            decision.update(engine='local', order=['local'], reason='cached', cache='HIT')
+            decision.update((name, value) for name, value in cached[1].items() if name != 'page_count')
+            self._log(decision)
+            return cached[0], cached[1].get('page_count'), decision
+
+        if engine == 'auto':
+            order, reason, detail = self.rank(job)
+        else:
+            order, reason, detail = [engine], 'requested', None
+        decision.update(order=order, reason=reason, cache='MISS')
+        if detail:
+            decision['detail'] = detail
+        if job._features is not None:
+            decision['features'] = job._features
+
+        errors = {}
+        for name in order:
+            started = time.perf_counter()
+            try:
+                buffer, page_count, details = self.engines[name].convert(job, progress)
+            except Exception as e:
+                # Admission rejections and previews of missing pages say nothing about the engine's health
+                if not isinstance(e, (AdmissionError, PreviewError)):
+                    self.stats[name].record(False, (time.perf_counter() - started) * 1000, job.size)
+                print(f'{name} engine failed: {e}')
+                errors[name] = str(e)
+                last_error = e
+                continue
+            ms = (time.perf_counter() - started) * 1000
+            self.stats[name].record(True, ms, job.size)
+            decision.update(details, engine=name, ms=round(ms, 1))
+            if errors:
+                decision['errors'] = errors
+            self._log(decision)
+            return buffer, page_count, decision
+
+        decision.update(engine=None, errors=errors)
+        self._log(decision)
+        raise last_error
+
+    def _log(self, decision):
+        with self._lock:
+            self._decisions.append(decision)
+            self._counters['decisions'] += 1
+            if decision.get('errors'):
+                self._counters['fallbacks' if decision['engine'] else 'failures'] += 1
+            engine = decision['engine'] or 'none'
+            self._by_engine[engine] = self._by_engine.get(engine, 0) + 1
+            self._by_reason[decision['reason']] = self._by_reason.get(decision['reason'], 0) + 1
+
+    def report(self, recent=20):
+        """Counters, per-engine stats and the most recent decisions (newest first)."""
+        with self._lock:
+            decisions = list(self._decisions)[::-1][:recent]
+            report = dict(self._counters, by_engine=dict(self._by_engine), by_reason=dict(self._by_reason))
+        report['engines'] = {name: stats.snapshot() for name, stats in self.stats.items()}
+        report['recent'] = decisions
+        return report
+
+
+router = Router.from_env()
@@ -0,0 +1,334 @@
+"""
+TrueType font registry for the DOCX to PDF converter.
+
+reportlab's built-in Type1 fonts only cover Western European text; Cyrillic,
+Greek, CJK or Arabic come out as boxes. The TTF fonts listed in DOCX_PDF_FONTS
+are parsed and registered with reportlab once per process (before conversion
+workers are forked, see api/_admission.py), so requests never parse a font file.
+
+By default that is DejaVu Sans, bundled in api/fonts (Latin, Greek, Cyrillic,
+Armenian, Georgian, Hebrew, Arabic), followed by the CJK and other fallback
+fonts of SYSTEM_FONTS found in the system font directories. reportlab only
+reads TrueType outlines, so CFF fonts such as Noto Sans CJK (.otf/.ttc) can't
+be used.
+
+Text is mapped to fonts character by character:
+1. the run font the DOCX asks for (w:rFonts ascii, eastAsia or cs, by the
+   character's script), when a registered family of that name has the glyph;
+2. the built-in font, for letters it can encode (as before);
+3. the font of the characters before it, so spaces, digits and punctuation
+   don't split a run of text;
+4. the built-in font, for the rest of what it can encode;
+5. the first registered family, in configuration order, that has the glyph.
+Headings use a family's bold face when one is registered.
+
+reportlab embeds only the glyphs a document uses (font subsets). Subsets are
+cached by font and glyph list, so documents in the same language and fonts
+reuse them, including subsets made in isolated workers. Font loading and
+subsetting are timed as the `fonts` stage.
+
+Configuration (environment):
+    DOCX_PDF_FONTS               comma-separated .ttf/.ttc files or directories of
+                                 them, used instead of the defaults (default: api/fonts,
+                                 then SYSTEM_FONTS found in SYSTEM_FONT_DIRS)
+    DOCX_PDF_FONT_SUBSET_CACHE   cached font subsets (default 256, 0 disables)
+"""
+
+import os
+import threading
+from collections import OrderedDict
+from xml.sax.saxutils import escape
+from _metrics import timed
+
+FONT_PATHS = [path.strip() for path in
+              os.environ.get('DOCX_PDF_FONTS', os.path.join(os.path.dirname(__file__), 'fonts')).split(',')
+              if path.strip()]
+# Without DOCX_PDF_FONTS, the bundled fonts are followed by these system fonts
+USE_SYSTEM_FONTS = 'DOCX_PDF_FONTS' not in os.environ
+SUBSET_CACHE_ENTRIES = int(os.environ.get('DOCX_PDF_FONT_SUBSET_CACHE', 256))
+
+FONT_EXTENSIONS = ('.ttf', '.ttc')
+
+SYSTEM_FONT_DIRS = ('/usr/share/fonts', '/usr/local/share/fonts', os.path.expanduser('~/.fonts'),
+                    '/Library/Fonts', '/System/Library/Fonts')
+# Fallback fonts with TrueType outlines, in fallback order (file names, lower case)
+SYSTEM_FONTS = (
+    'droidsansfallbackfull.ttf', 'droidsansfallback.ttf',  # CJK (fonts-droid-fallback)
+    'wqy-zenhei.ttc', 'wqy-microhei.ttc',                  # CJK (fonts-wqy-*)
+    'notosansdevanagari-regular.ttf', 'notosansdevanagari-bold.ttf',
+    'notosansthai-regular.ttf', 'notosansthai-bold.ttf',
+    'arial unicode.ttf', 'arialuni.ttf',                   # macOS
+)
+
+# Unicode ranges Word takes from w:eastAsia and w:cs; everything else uses w:ascii
+_EAST_ASIAN = ((0x1100, 0x11FF), (0x2E80, 0x9FFF), (0xA960, 0xA97F), (0xAC00, 0xD7FF),
+               (0xF900, 0xFAFF), (0xFE30, 0xFE4F), (0xFF00, 0xFFEF), (0x20000, 0x2FA1F))
+_COMPLEX = ((0x0590, 0x08FF), (0x0900, 0x0DFF), (0x0E00, 0x0E7F), (0xFB1D, 0xFDFF), (0xFE70, 0xFEFF))
+
+# Slots of the (ascii, east_asia, complex) run font tuple
+_ASCII, _EAST_ASIA, _COMPLEX_SCRIPT = 0, 1, 2
+
+
+def _slot(code):
+    for low, high in _EAST_ASIAN:
+        if low <= code <= high:
+            return _EAST_ASIA
+    for low, high in _COMPLEX:
+        if low <= code <= high:
+            return _COMPLEX_SCRIPT
+    return _ASCII
+
+
+def _builtin_covers(char):
+    """The built-in fonts' WinAnsi encoding has char."""
+    try:
+        char.encode('cp1252')
+        return True
+    except UnicodeEncodeError:
+        return False
+
+
+def _font_files(paths):
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(os.path.join(path, name) for name in sorted(os.listdir(path))
+                         if name.lower().endswith(FONT_EXTENSIONS))
+        elif os.path.isfile(path):
+            files.append(path)
+    return files
+
+
+def _system_font_files():
+    """The SYSTEM_FONTS found in SYSTEM_FONT_DIRS, in SYSTEM_FONTS order."""
+    found = {}
+    for directory in SYSTEM_FONT_DIRS:
+        for root, _, names in os.walk(directory):
+            for name in names:
+                key = name.lower()
+                if key in SYSTEM_FONTS and key not in found:
+                    found[key] = os.path.join(root, name)
+    return [found[key] for key in SYSTEM_FONTS if key in found]
+
+
+class FontRegistry:
+    def __init__(self, paths, subset_cache_entries, system_fonts=False):
+        self.paths = paths
+        self.system_fonts = system_fonts
+        self.subset_cache_entries = subset_cache_entries
+        self._loaded = False
+        # family (lower case) -> {'regular': font name, 'bold': font name}
+        self._families = {}
+        # Families in configuration order, for the script fallback
+        self._order = []
+        # font name -> set of code points the font has glyphs for
+        self._coverage = {}
+        # (font name, glyph codes) -> subset bytes, with sequence numbers for fork merging
+        self._subsets = OrderedDict()
+        self._sequence = 0
+        self._fork_sequence = None
+        self._lock = threading.Lock()
+        self._counters = {'subset_hits': 0, 'subset_misses': 0, 'merged': 0}
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    @classmethod
+    def from_env(cls):
+        return cls(FONT_PATHS, SUBSET_CACHE_ENTRIES, USE_SYSTEM_FONTS)
+
+    def _after_fork(self):
+        self._lock = threading.Lock()
+        self._fork_sequence = self._sequence
+
+    def load(self):
+        """Parse and register the configured fonts; only the first call does any work."""
+        if self._loaded:
+            return
+        with self._lock:
+            if self._loaded:
+                return
+            with timed('fonts'):
+                files = _font_files(self.paths)
+                if self.system_fonts:
+                    files += _system_font_files()
+                for path in files:
+                    try:
+                        self._register(path)
+                    except Exception as e:
+                        print(f'Font {path} not registered: {e}')
+            self._loaded = True
+
+    def _register(self, path):
+        from reportlab.pdfbase import pdfmetrics
+        from reportlab.pdfbase.ttfonts import TTFont
+
+        name = os.path.splitext(os.path.basename(path))[0]
+        registered = pdfmetrics.getRegisteredFontNames()
+        base, suffix = name, 1
+        while name in registered:
+            suffix += 1
+            name = f'{base}-{suffix}'
+
+        font = TTFont(name, path)
+        face = font.face
+        family = face.familyName.decode('latin-1') if isinstance(face.familyName, bytes) else face.familyName
+        style = (face.styleName.decode('latin-1') if isinstance(face.styleName, bytes) else face.styleName).lower()
+        if 'italic' in style or 'oblique' in style:
+            # Paragraphs are never italic here
+            return
+        pdfmetrics.registerFont(font)
+        face.makeSubset = self._cached_subset(name, face.makeSubset)
+        self._coverage[name] = set(face.charToGlyph)
+
+        key = family.lower()
+        faces = self._families.get(key)
+        if faces is None:
+            faces = self._families[key] = {}
+            self._order.append(key)
+        variant = 'bold' if any(word in style for word in ('bold', 'black', 'heavy')) else 'regular'
+        faces.setdefault(variant, name)
+
+    def _cached_subset(self, name, make_subset):
+        # makeSubset reads the font through a shared position, so one document at a time
+        face_lock = threading.Lock()
+
+        def make_cached_subset(subset):
+            key = (name, tuple(subset))
+            with self._lock:
+                entry = self._subsets.get(key)
+                if entry is not None:
+                    self._subsets.move_to_end(key)
+                    self._counters['subset_hits'] += 1
+                    return entry[0]
+                self._counters['subset_misses'] += 1
+            with timed('fonts'), face_lock:
+                data = make_subset(subset)
+            if self.subset_cache_entries > 0:
+                with self._lock:
+                    self._store(key, data)
+            return data
+
+        return make_cached_subset
+
+    def _store(self, key, data):
+        self._subsets.pop(key, None)
+        self._sequence += 1
+        self._subsets[key] = (data, self._sequence)
+        while len(self._subsets) > self.subset_cache_entries:
+            self._subsets.popitem(last=False)
+
+    def changes_since_fork(self):
+        """In a forked worker: the subsets made since the fork, as [(key, data)]."""
+        if self._fork_sequence is None:
+            return None
+        with self._lock:
+            return [(key, data) for key, (data, sequence) in self._subsets.items()
+                    if sequence > self._fork_sequence]
+
+    def merge(self, changes):
+        """Store subsets a forked worker made (see changes_since_fork)."""
+        if not changes or self.subset_cache_entries <= 0:
+            return
+        with self._lock:
+            for key, data in changes:
+                self._counters['merged'] += 1
+                self._store(key, data)
+
+    def _face(self, family, bold, code):
+        """Name of the family's face with the glyph for code (bold preferred when asked), or None."""
+        faces = self._families.get(family)
+        if not faces:
+            return None
+        for variant in (('bold', 'regular') if bold else ('regular', 'bold')):
+            name = faces.get(variant)
+            if name is not None and code in self._coverage[name]:
+                return name
+        return None
+
+    def _pick(self, char, fonts, bold, current):
+        """Font name for char (None: the built-in font), given the run fonts and the current font."""
+        code = ord(char)
+        if fonts:
+            requested = fonts[_slot(code)] or fonts[_ASCII]
+            if requested:
+                name = self._face(requested.lower(), bold, code)
+                if name is not None:
+                    return name
+        builtin = _builtin_covers(char)
+        if builtin and char.isalpha():
+            return None
+        if current is not None and code in self._coverage[current]:
+            return current
+        if builtin:
+            return None
+        for family in self._order:
+            name = self._face(family, bold, code)
+            if name is not None:
+                return name
+        return current
+
+    def _segments(self, text, fonts, bold):
+        """[(font name or None, text)] for the text, or None when the built-in font draws all of it."""
+        if not self._families:
+            return None
+        if not any(name and name.lower() in self._families for name in fonts or ()):
+            try:
+                text.encode('cp1252')
+                return None
+            except UnicodeEncodeError:
+                pass
+
+        segments = []
+        current = None
+        start = 0
+        for index, char in enumerate(text):
+            font = self._pick(char, fonts, bold, current)
+            if font != current:
+                if index > start:
+                    segments.append((current, text[start:index]))
+                current, start = font, index
+        segments.append((current, text[start:]))
+        if len(segments) == 1 and segments[0][0] is None:
+            return None
+        return segments
+
+    def markup(self, text, fonts=None, bold=False):
+        """
+        Paragraph markup drawing text in the registered fonts, or None when
+        the built-in font draws all of it (the text is then used as it is).
+        fonts is the run fonts tuple (ascii, east_asia, complex) or None.
+        """
+        segments = self._segments(text, fonts, bold)
+        if segments is None:
+            return None
+        return ''.join(escape(part) if font is None else f'<font name="{font}">{escape(part)}</font>'
+                       for font, part in segments)
+
+    def font_for(self, text, bold=False):
+        """A single registered font drawing all of text, or None (built-in font or no such font)."""
+        segments = self._segments(text, None, bold)
+        if segments is None:
+            return None
+        names = {font for font, _ in segments if font is not None}
+        for name in names:
+            if all(ord(char) in self._coverage[name] or not char.strip() for char in text):
+                return name
+        # No one font has every glyph: use the one drawing the most text
+        return max(names, key=lambda name: sum(len(part) for font, part in segments if font == name))
+
+    def clear(self):
+        """Drop the cached subsets (the fonts stay registered)."""
+        with self._lock:
+            self._subsets.clear()
+
+    def stats(self):
+        """Registered fonts and subset cache counters."""
+        with self._lock:
+            lookups = self._counters['subset_hits'] + self._counters['subset_misses']
+            return dict(self._counters,
+                        families={key: dict(faces) for key, faces in self._families.items()},
+                        subsets=len(self._subsets), max_subsets=self.subset_cache_entries,
+                        subset_hit_rate=round(self._counters['subset_hits'] / lookups, 4) if lookups else None)
+
+
+font_registry = FontRegistry.from_env()
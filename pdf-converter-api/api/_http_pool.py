@@ -0,0 +1,263 @@
+"""
+Shared HTTP(S) client with per-host keep-alive connection pools.
+
+Used by the iLovePDF proxy so the start/upload/process/download steps of one
+task — three of them on the same `server` host — and requests handled by a
+warm process reuse TCP+TLS connections instead of handshaking each time.
+Request bodies can be generated on the fly (MultipartUpload) and responses
+read incrementally (stream()), so large files never sit in memory whole.
+
+Configuration (environment):
+    HTTP_POOL_MAXSIZE        idle connections kept per host (default 4)
+    HTTP_POOL_IDLE_SECONDS   idle connections older than this are closed (default 30)
+
+No external dependencies — uses Python stdlib only.
+"""
+
+import os
+import ssl
+import time
+import threading
+import http.client
+from urllib.parse import urlsplit
+
+# Errors that mean a reused keep-alive connection was closed by the server
+# before our request reached it; the request is retried once on a new connection.
+_STALE_CONNECTION_ERRORS = (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError)
+
+
+class HTTPStatusError(Exception):
+    """Raised for HTTP responses with status >= 400."""
+
+    def __init__(self, url, status, body):
+        super().__init__(f'HTTP {status} from {url}')
+        self.url = url
+        self.status = status
+        self.body = body
+
+
+class ConnectionPool:
+    def __init__(self, maxsize=4, idle_seconds=30.0):
+        self.maxsize = maxsize
+        self.idle_seconds = idle_seconds
+        self._idle = {}
+        self._lock = threading.Lock()
+        self._ssl_context = None
+        self._stats = {
+            'requests': 0,
+            'connections_created': 0,
+            'connections_reused': 0,
+            'stale_retries': 0,
+            'idle_evictions': 0,
+            'overflow_closes': 0,
+            'handshake_ms_total': 0.0,
+        }
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            maxsize=int(os.environ.get('HTTP_POOL_MAXSIZE', 4)),
+            idle_seconds=float(os.environ.get('HTTP_POOL_IDLE_SECONDS', 30)),
+        )
+
+    def _new_connection(self, key, timeout):
+        scheme, host, port = key
+        if scheme == 'https':
+            if self._ssl_context is None:
+                self._ssl_context = ssl.create_default_context()
+            conn = http.client.HTTPSConnection(host, port, timeout=timeout, context=self._ssl_context)
+        else:
+            conn = http.client.HTTPConnection(host, port, timeout=timeout)
+
+        start = time.perf_counter()
+        conn.connect()
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        with self._lock:
+            self._stats['connections_created'] += 1
+            self._stats['handshake_ms_total'] += elapsed_ms
+        return conn
+
+    def _acquire(self, key, timeout):
+        """Return (connection, reused)."""
+        now = time.monotonic()
+        with self._lock:
+            idle = self._idle.get(key, [])
+            while idle:
+                conn, last_used = idle.pop()
+                if now - last_used <= self.idle_seconds:
+                    self._stats['connections_reused'] += 1
+                    break
+                conn.close()
+                self._stats['idle_evictions'] += 1
+            else:
+                conn = None
+
+        if conn is None:
+            return self._new_connection(key, timeout), False
+        conn.timeout = timeout
+        if conn.sock is not None:
+            conn.sock.settimeout(timeout)
+        return conn, True
+
+    def _release(self, key, conn):
+        now = time.monotonic()
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            # Drop connections that went idle too long, oldest first
+            while idle and now - idle[0][1] > self.idle_seconds:
+                idle.pop(0)[0].close()
+                self._stats['idle_evictions'] += 1
+            if len(idle) < self.maxsize:
+                idle.append((conn, now))
+                return
+            self._stats['overflow_closes'] += 1
+        conn.close()
+
+    def _send(self, method, url, body, headers, timeout):
+        """Send a request and return (key, connection, response) with the headers read."""
+        parts = urlsplit(url)
+        key = (parts.scheme, parts.hostname, parts.port or (443 if parts.scheme == 'https' else 80))
+        path = parts.path + (f'?{parts.query}' if parts.query else '')
+
+        with self._lock:
+            self._stats['requests'] += 1
+
+        for attempt in range(2):
+            conn, reused = self._acquire(key, timeout)
+            try:
+                conn.request(method, path, body=body, headers=headers or {})
+                return key, conn, conn.getresponse()
+            except _STALE_CONNECTION_ERRORS:
+                conn.close()
+                if reused and attempt == 0:
+                    with self._lock:
+                        self._stats['stale_retries'] += 1
+                    continue
+                raise
+            except Exception:
+                conn.close()
+                raise
+
+    def _finish(self, key, conn, response):
+        """Return the connection to the pool if its response was read to the end."""
+        if response.isclosed() and not response.will_close:
+            self._release(key, conn)
+        else:
+            conn.close()
+
+    def request(self, method, url, body=None, headers=None, timeout=None):
+        """
+        Send a request on a pooled connection and read the whole response.
+        Returns (status, headers, body_bytes); raises HTTPStatusError for status >= 400.
+        """
+        key, conn, response = self._send(method, url, body, headers, timeout)
+        try:
+            data = response.read()
+        finally:
+            self._finish(key, conn, response)
+
+        if response.status >= 400:
+            raise HTTPStatusError(url, response.status, data)
+        return response.status, response.headers, data
+
+    def stream(self, method, url, body=None, headers=None, timeout=None):
+        """
+        Like request(), but returns a PooledResponse whose body is read
+        incrementally; use it as a context manager so the connection is released.
+        """
+        key, conn, response = self._send(method, url, body, headers, timeout)
+        if response.status >= 400:
+            try:
+                data = response.read()
+            finally:
+                self._finish(key, conn, response)
+            raise HTTPStatusError(url, response.status, data)
+        return PooledResponse(self, key, conn, response)
+
+    def stats(self):
+        """Counters plus reuse rate and estimated handshake time saved."""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['idle_connections'] = sum(len(idle) for idle in self._idle.values())
+        acquired = stats['connections_created'] + stats['connections_reused']
+        stats['reuse_rate'] = round(stats['connections_reused'] / acquired, 4) if acquired else 0.0
+        avg_handshake = stats['handshake_ms_total'] / stats['connections_created'] if stats['connections_created'] else 0.0
+        stats['avg_handshake_ms'] = round(avg_handshake, 2)
+        stats['handshake_ms_saved'] = round(avg_handshake * stats['connections_reused'], 1)
+        stats['handshake_ms_total'] = round(stats['handshake_ms_total'], 1)
+        return stats
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for connections in idle.values():
+            for conn, _ in connections:
+                conn.close()
+
+
+class PooledResponse:
+    """Streaming response body; the connection goes back to the pool on close()."""
+
+    def __init__(self, pool, key, conn, response):
+        self._pool = pool
+        self._key = key
+        self._conn = conn
+        self._response = response
+        self.status = response.status
+        self.headers = response.headers
+        # From Content-Length; None when the body is chunked or close-delimited
+        self.length = response.length
+
+    def read(self, amt=None):
+        return self._response.read(amt)
+
+    def close(self):
+        if self._conn is not None:
+            self._pool._finish(self._key, self._conn, self._response)
+            self._conn = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class MultipartUpload:
+    """
+    multipart/form-data request body generated on the fly.
+    Form fields come first, then one file part whose content is pulled from
+    open_file() chunk by chunk, so the body is never assembled in memory.
+    Iterable more than once, so a stale-connection retry can resend it.
+    """
+
+    def __init__(self, fields, file_field, filename, file_size, open_file):
+        self.boundary = '----WebKitFormBoundary' + os.urandom(16).hex()
+        self.content_type = f'multipart/form-data; boundary={self.boundary}'
+        lines = []
+        for name, value in fields.items():
+            lines += [f'--{self.boundary}', f'Content-Disposition: form-data; name="{name}"', '', value]
+        lines += [
+            f'--{self.boundary}',
+            f'Content-Disposition: form-data; name="{file_field}"; filename="{filename}"',
+            'Content-Type: application/octet-stream',
+            '',
+            '',
+        ]
+        self._head = '\r\n'.join(lines).encode('utf-8')
+        self._tail = f'\r\n--{self.boundary}--'.encode('utf-8')
+        self._file_size = file_size
+        self._open_file = open_file
+
+    def __len__(self):
+        return len(self._head) + self._file_size + len(self._tail)
+
+    def __iter__(self):
+        yield self._head
+        for chunk in self._open_file():
+            yield chunk
+        yield self._tail
+
+
+# Shared per-process pool used by the iLovePDF proxy handlers
+ilovepdf_pool = ConnectionPool.from_env()
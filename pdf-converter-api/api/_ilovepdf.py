@@ -0,0 +1,388 @@
+"""
+iLovePDF API client shared by the proxy endpoints.
+
+All requests go through the keep-alive pool in _http_pool. The upload is a
+multipart body generated on the fly from the caller's base64 text, and the
+result is returned as an open stream, so a proxied conversion never holds a
+decoded copy of the input or the output in memory. run_batch() converts
+several files in a single task.
+
+Each conversion runs against one time budget shared out between its steps
+(start, upload, process, download); every call gets the rest of its step's
+share as socket timeout. start, upload and download are retried on transient
+failures (connection errors, timeouts, 429 and 5xx) with jittered backoff.
+process is never retried: it is the step iLovePDF bills. The download can be
+hedged with a second request. A circuit breaker over all calls fails requests
+fast while iLovePDF is unhealthy, and convert() then falls back to the local
+converters.
+
+Configuration (environment):
+    ILOVEPDF_API_URL                   API base URL (default https://api.ilovepdf.com); task
+                                       servers are reached with the same scheme, so this can
+                                       point at a local fake upstream for tests and benchmarks
+    ILOVEPDF_BUDGET_SECONDS            time budget per conversion (default 55)
+    ILOVEPDF_RETRIES                   retries of a start/upload/download call (default 2)
+    ILOVEPDF_HEDGE_AFTER_SECONDS       send a second download request when the first has not
+                                       answered after this long (default 0: off)
+    ILOVEPDF_BREAKER_FAILURE_RATIO     failure ratio that opens the breaker (default 0.5)
+    ILOVEPDF_BREAKER_MIN_CALLS         calls in the window before it can open (default 10)
+    ILOVEPDF_BREAKER_WINDOW_SECONDS    sliding window for the failure ratio (default 60)
+    ILOVEPDF_BREAKER_COOLDOWN_SECONDS  time open before a trial call (default 30)
+    ILOVEPDF_FALLBACK                  'local' to convert locally when iLovePDF is failing,
+                                       'none' to answer 503/502/504 instead (default local)
+"""
+
+import os
+import io
+import json
+import socket
+import threading
+from http.client import HTTPException
+from urllib.parse import urlsplit
+from _metrics import timed
+from _http_pool import ilovepdf_pool, HTTPStatusError, MultipartUpload
+from _resilience import Budget, CircuitBreaker, DeadlineExceeded, call_with_retries, hedged_call
+from _transport import SPOOL_MEMORY_BYTES, WRITE_CHUNK_BYTES, base64_decoded_size, iter_base64_decoded
+
+API_URL = os.environ.get('ILOVEPDF_API_URL', 'https://api.ilovepdf.com').rstrip('/')
+
+BUDGET_SECONDS = float(os.environ.get('ILOVEPDF_BUDGET_SECONDS', 55))
+RETRIES = int(os.environ.get('ILOVEPDF_RETRIES', 2))
+HEDGE_AFTER_SECONDS = float(os.environ.get('ILOVEPDF_HEDGE_AFTER_SECONDS', 0))
+FALLBACK = os.environ.get('ILOVEPDF_FALLBACK', 'local')
+
+# Relative share of the budget per step; process is where iLovePDF does the work
+STEP_WEIGHTS = (('start', 1), ('upload', 3), ('process', 4), ('download', 2))
+
+# Conversion direction -> iLovePDF tool
+TOOLS = {'pdf-to-docx': 'pdfdocx', 'docx-to-pdf': 'officepdf'}
+
+# Conversion direction -> (upload filename, output label for errors)
+_FORMATS = {'pdf-to-docx': ('document.pdf', 'DOCX'), 'docx-to-pdf': ('document.docx', 'PDF')}
+
+# Files of one batch uploaded to the task server at the same time
+BATCH_UPLOAD_CONCURRENCY = 4
+
+breaker = CircuitBreaker(
+    failure_ratio=float(os.environ.get('ILOVEPDF_BREAKER_FAILURE_RATIO', 0.5)),
+    min_calls=int(os.environ.get('ILOVEPDF_BREAKER_MIN_CALLS', 10)),
+    window_seconds=float(os.environ.get('ILOVEPDF_BREAKER_WINDOW_SECONDS', 60)),
+    cooldown_seconds=float(os.environ.get('ILOVEPDF_BREAKER_COOLDOWN_SECONDS', 30)),
+)
+
+_stats = {'retries': 0, 'hedges': 0, 'hedge_wins': 0, 'deadline_exceeded': 0, 'fast_failures': 0, 'fallbacks': 0}
+_stats_lock = threading.Lock()
+
+
+class UpstreamError(Exception):
+    """
+    An iLovePDF step failed. status is the HTTP status to answer with;
+    transient is True when the local converters are a sensible fallback.
+    """
+
+    def __init__(self, message, status=502, transient=True):
+        super().__init__(message)
+        self.status = status
+        self.transient = transient
+
+
+class CircuitOpenError(UpstreamError):
+    """iLovePDF calls are being failed fast by the circuit breaker."""
+
+    def __init__(self):
+        super().__init__('iLovePDF is temporarily unavailable', status=503)
+
+
+class BufferedResult(io.BytesIO):
+    """In-memory conversion result with the read/length/close interface of a PooledResponse."""
+
+    def __init__(self, data):
+        super().__init__(data)
+        self.length = len(data)
+
+
+def _count(name):
+    with _stats_lock:
+        _stats[name] += 1
+
+
+def stats():
+    """Resilience counters and breaker state, for the proxy endpoints' GET."""
+    with _stats_lock:
+        counters = dict(_stats)
+    return dict(counters, breaker=breaker.stats())
+
+
+def _is_transient(e):
+    if isinstance(e, HTTPStatusError):
+        return e.status == 429 or e.status >= 500
+    return isinstance(e, (OSError, HTTPException, DeadlineExceeded))
+
+
+def _server_url(server):
+    return f'{urlsplit(API_URL).scheme}://{server}'
+
+
+def _check_breaker():
+    if not breaker.allow():
+        _count('fast_failures')
+        raise CircuitOpenError()
+
+
+def _call(budget, step, label, fn, retries=RETRIES):
+    """
+    Run one step: fn(timeout) with the step's deadline, retried while the
+    failure is transient. Every attempt's outcome is recorded on the breaker;
+    4xx answers mean iLovePDF is up and count as successes.
+    Raises UpstreamError with the status to answer with.
+    """
+    def attempt(timeout):
+        try:
+            result = fn(timeout)
+        except Exception as e:
+            breaker.record(not _is_transient(e))
+            raise
+        breaker.record(True)
+        return result
+
+    try:
+        with timed(f'ilovepdf_{step}'):
+            return call_with_retries(attempt, budget.step_deadline(step), retries, _is_transient,
+                                     on_retry=lambda e: _count('retries'))
+    except Exception as e:
+        print(f'{label} error: {e!r}')
+        if isinstance(e, (DeadlineExceeded, socket.timeout)):
+            _count('deadline_exceeded')
+            raise UpstreamError(f'{label}: timed out', status=504)
+        raise UpstreamError(f'{label}: {e}', transient=_is_transient(e))
+
+
+def start_task(public_key, tool, timeout=None):
+    """Start iLovePDF task"""
+    url = f'{API_URL}/v1/start/{tool}'
+    data = json.dumps({'public_key': public_key}).encode('utf-8')
+
+    _, _, response = ilovepdf_pool.request('POST', url, body=data, headers={'Content-Type': 'application/json'},
+                                           timeout=timeout)
+    return json.loads(response.decode('utf-8'))
+
+
+def upload_document(server, task, filename, size, open_file, timeout=None):
+    """Upload one file to a task; open_file() returns an iterable of its byte chunks"""
+    upload = MultipartUpload({'task': task}, 'file', filename, size, open_file)
+    url = f'{_server_url(server)}/v1/upload'
+    _, _, response = ilovepdf_pool.request(
+        'POST', url,
+        body=upload,
+        headers={'Content-Type': upload.content_type, 'Content-Length': str(len(upload))},
+        timeout=timeout
+    )
+    return json.loads(response.decode('utf-8'))
+
+
+def upload_file(server, task, file_base64, filename, timeout=None):
+    """Upload file to iLovePDF, decoding the base64 input while it is sent"""
+    if any(c in file_base64 for c in '\r\n '):
+        file_base64 = ''.join(file_base64.split())
+    # Skip a data URL prefix without copying the payload
+    start = file_base64.find(',', 0, 100) + 1
+
+    return upload_document(
+        server, task, filename,
+        base64_decoded_size(file_base64, start),
+        lambda: iter_base64_decoded(file_base64, start),
+        timeout
+    )
+
+
+def process_files(server, task, files, tool, timeout=None):
+    """Process every uploaded file of a task; files is a list of (server_filename, filename)"""
+    url = f'{_server_url(server)}/v1/process'
+    data = json.dumps({
+        'task': task,
+        'tool': tool,
+        'files': [{'server_filename': server_filename, 'filename': filename} for server_filename, filename in files]
+    }).encode('utf-8')
+
+    _, _, response = ilovepdf_pool.request('POST', url, body=data, headers={'Content-Type': 'application/json'},
+                                           timeout=timeout)
+    return json.loads(response.decode('utf-8'))
+
+
+def download_file(server, task, timeout=None):
+    """
+    Open the converted file; returns a PooledResponse to read and close.
+    With ILOVEPDF_HEDGE_AFTER_SECONDS set, a second request races the first
+    if it is slow to answer, and the losing response is closed.
+    """
+    url = f'{_server_url(server)}/v1/download/{task}'
+
+    def open_download():
+        return ilovepdf_pool.stream('GET', url, timeout=timeout)
+
+    if not HEDGE_AFTER_SECONDS or timeout is not None and HEDGE_AFTER_SECONDS >= timeout:
+        return open_download()
+
+    def on_hedge(won):
+        _count('hedges')
+        if won:
+            _count('hedge_wins')
+
+    return hedged_call(open_download, HEDGE_AFTER_SECONDS, lambda response: response.close(), on_hedge)
+
+
+def run_pipeline(public_key, document, direction, progress=None):
+    """
+    Run the four iLovePDF steps (start, upload, process, download) within
+    ILOVEPDF_BUDGET_SECONDS. document is the input as base64 text (data URLs
+    are fine) or as bytes. Returns an open PooledResponse; raises UpstreamError.
+    """
+    tool = TOOLS[direction]
+    filename, output_label = _FORMATS[direction]
+    input_label = filename.rsplit('.', 1)[-1].upper()
+    _check_breaker()
+    budget = Budget(BUDGET_SECONDS, STEP_WEIGHTS)
+
+    # Step 1: Start task
+    task_data = _call(budget, 'start', 'Failed to start iLovePDF task',
+                      lambda timeout: start_task(public_key, tool, timeout))
+    if progress:
+        progress(1, 4)
+
+    server = task_data['server']
+    task = task_data['task']
+
+    def upload(timeout):
+        if isinstance(document, str):
+            return upload_file(server, task, document, filename, timeout)
+        return upload_document(server, task, filename, len(document), lambda: (document,), timeout)
+
+    # Step 2: Upload file (retries are safe: process names the file to convert)
+    upload_data = _call(budget, 'upload', f'Failed to upload {input_label}', upload)
+    if progress:
+        progress(2, 4)
+
+    server_filename = upload_data['server_filename']
+
+    # Step 3: Process conversion (billed per call, so never retried)
+    _call(budget, 'process', 'Failed to process conversion',
+          lambda timeout: process_files(server, task, [(server_filename, server_filename)], tool, timeout),
+          retries=0)
+    if progress:
+        progress(3, 4)
+
+    # Step 4: Download result
+    download = _call(budget, 'download', f'Failed to download {output_label}',
+                     lambda timeout: download_file(server, task, timeout))
+    if progress:
+        progress(4, 4)
+
+    return download
+
+
+def use_fallback(error):
+    """True if a failed iLovePDF conversion should be redone locally (counted in stats)."""
+    if FALLBACK != 'local' or not error.transient:
+        return False
+    print(f'iLovePDF unavailable ({error}), converting locally')
+    _count('fallbacks')
+    return True
+
+
+def convert(direction, public_key, file_base64, progress=None):
+    """
+    Convert through iLovePDF, falling back to the local converter when the
+    upstream is failing or the breaker is open and ILOVEPDF_FALLBACK is 'local'.
+    Returns (result, engine): result is readable, has .length and must be
+    closed (use it as a context manager); engine is 'ilovepdf' or 'local'.
+    """
+    try:
+        return run_pipeline(public_key, file_base64, direction, progress), 'ilovepdf'
+    except UpstreamError as e:
+        if not use_fallback(e):
+            raise
+        error = e
+
+    import base64
+    from _batch import convert_local
+
+    data = base64.b64decode(file_base64[file_base64.find(',', 0, 100) + 1:])
+    results = convert_local(direction, [(_FORMATS[direction][0], data)])
+    try:
+        _, output, _, local_error = next(results)
+    finally:
+        # Gives back the admission slot it took
+        results.close()
+    if local_error is not None:
+        raise UpstreamError(f'{error}; local conversion failed: {local_error}', status=error.status)
+    return BufferedResult(output), 'local'
+
+
+def run_batch(public_key, tool, documents, output_ext):
+    """
+    Convert several documents in a single task: one start, concurrent uploads,
+    one process call covering every file and one download, all within one budget.
+    documents is a list of (filename, bytes) with unique filenames.
+    Returns (outputs, errors): outputs maps document index -> converted bytes,
+    errors maps index -> message. Raises UpstreamError if the whole batch failed.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    _check_breaker()
+    budget = Budget(BUDGET_SECONDS, STEP_WEIGHTS)
+    task_data = _call(budget, 'start', 'Failed to start iLovePDF task',
+                      lambda timeout: start_task(public_key, tool, timeout))
+    server = task_data['server']
+    task = task_data['task']
+
+    def upload(document):
+        filename, data = document
+        upload_data = _call(budget, 'upload', 'Failed to upload',
+                            lambda timeout: upload_document(server, task, filename, len(data), lambda: (data,), timeout))
+        return upload_data['server_filename']
+
+    uploaded = []
+    errors = {}
+    with ThreadPoolExecutor(max_workers=min(BATCH_UPLOAD_CONCURRENCY, len(documents))) as uploads:
+        futures = [uploads.submit(upload, document) for document in documents]
+        for index, future in enumerate(futures):
+            try:
+                uploaded.append((index, future.result()))
+            except Exception as e:
+                errors[index] = str(e)
+    if not uploaded:
+        return {}, errors
+
+    _call(budget, 'process', 'Failed to process conversion',
+          lambda timeout: process_files(server, task, [(server_filename, documents[index][0])
+                                                       for index, server_filename in uploaded], tool, timeout),
+          retries=0)
+
+    download = _call(budget, 'download', 'Failed to download results',
+                     lambda timeout: download_file(server, task, timeout))
+    if len(uploaded) == 1:
+        with download:
+            return {uploaded[0][0]: download.read()}, errors
+
+    # Several files come back as one ZIP, named after the input files; spool it
+    # so only the extracted outputs are held in memory
+    import shutil
+    import tempfile
+    import zipfile
+
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MEMORY_BYTES)
+    with download:
+        shutil.copyfileobj(download, spool, WRITE_CHUNK_BYTES)
+
+    by_stem = {os.path.splitext(documents[index][0])[0]: index for index, _ in uploaded}
+    outputs = {}
+    with spool, zipfile.ZipFile(spool) as archive:
+        for info in archive.infolist():
+            stem, ext = os.path.splitext(os.path.basename(info.filename))
+            index = by_stem.get(stem)
+            if index is not None and ext.lower() == output_ext:
+                outputs[index] = archive.read(info)
+    for index, _ in uploaded:
+        if index not in outputs:
+            errors[index] = 'No output from iLovePDF'
+    return outputs, errors
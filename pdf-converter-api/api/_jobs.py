@@ -0,0 +1,305 @@
+"""
+Asynchronous conversion jobs: submit / poll / fetch.
+
+A POST to a converter with `Prefer: respond-async` (or "async": true / ?async=1)
+returns 202 with a job id immediately; the conversion runs on a local worker
+queue and clients poll /api/jobs?id=<job_id> for status and progress, then fetch
+the result with /api/jobs?id=<job_id>&result=1.
+
+The job store is pluggable (see set_job_store). Two stand-ins are provided:
+- MemoryJobStore: in-process dict, for a single long-running server process
+- SQLiteJobStore: a SQLite file, so every process on one box sees the same jobs
+
+Configuration (environment):
+    JOB_STORE               'memory' (default) or 'sqlite'
+    JOB_STORE_PATH          SQLite file path (default: <tmp>/pdf-converter-jobs.sqlite3)
+    JOB_WORKERS             worker threads running conversions (default 2)
+    JOB_RESULT_TTL_SECONDS  how long jobs and results are kept after completion (default 3600)
+
+Note: serverless platforms may freeze the process once the 202 response is sent,
+so async mode is meant for the self-hosted server rather than one-shot functions.
+"""
+
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+from _metrics import background
+from _transport import send_json
+
+JOB_RESULT_TTL_SECONDS = int(os.environ.get('JOB_RESULT_TTL_SECONDS', 3600))
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 2))
+
+# Progress writes are throttled so a 400-page job doesn't hit the store 400 times
+PROGRESS_INTERVAL_SECONDS = 0.25
+
+STATUS_QUEUED = 'queued'
+STATUS_RUNNING = 'running'
+STATUS_DONE = 'done'
+STATUS_ERROR = 'error'
+# Only finished jobs expire; queued and running ones are kept however long they take
+_FINISHED = (STATUS_DONE, STATUS_ERROR)
+
+_JOB_FIELDS = ('id', 'kind', 'owner', 'status', 'pages_done', 'pages_total',
+               'error', 'created_at', 'updated_at', 'expires_at')
+
+
+def _new_job(kind, owner):
+    now = time.time()
+    return {
+        'id': os.urandom(16).hex(),
+        'kind': kind,
+        'owner': owner,
+        'status': STATUS_QUEUED,
+        'pages_done': 0,
+        'pages_total': None,
+        'error': None,
+        'created_at': now,
+        'updated_at': now,
+        # Set when the job finishes: the TTL runs from completion, however long it queued
+        'expires_at': None,
+    }
+
+
+class MemoryJobStore:
+    """In-process job store. Results live as long as the process (or until expiry)."""
+
+    def __init__(self):
+        self._jobs = {}
+        self._results = {}
+        self._lock = threading.Lock()
+
+    def create(self, kind, owner):
+        job = _new_job(kind, owner)
+        with self._lock:
+            self._jobs[job['id']] = job
+        return dict(job)
+
+    def update(self, job_id, **fields):
+        fields['updated_at'] = time.time()
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                job.update(fields)
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job is not None else None
+
+    def set_result(self, job_id, data, meta):
+        with self._lock:
+            self._results[job_id] = (bytes(data), dict(meta))
+
+    def get_result(self, job_id):
+        with self._lock:
+            return self._results.get(job_id)
+
+    def delete(self, job_id):
+        with self._lock:
+            self._jobs.pop(job_id, None)
+            self._results.pop(job_id, None)
+
+    def purge_expired(self, now=None):
+        now = now or time.time()
+        with self._lock:
+            expired = [job_id for job_id, job in self._jobs.items()
+                       if job['status'] in _FINISHED and job['expires_at'] < now]
+            for job_id in expired:
+                self._jobs.pop(job_id, None)
+                self._results.pop(job_id, None)
+        return len(expired)
+
+
+class SQLiteJobStore:
+    """Job store backed by a SQLite file, shared by every process on the box."""
+
+    def __init__(self, path):
+        self.path = path
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS jobs ('
+                ' id TEXT PRIMARY KEY, kind TEXT, owner TEXT, status TEXT,'
+                ' pages_done INTEGER, pages_total INTEGER, error TEXT,'
+                ' created_at REAL, updated_at REAL, expires_at REAL,'
+                ' result BLOB, result_meta TEXT)'
+            )
+            conn.execute('CREATE INDEX IF NOT EXISTS jobs_expires_at ON jobs (expires_at)')
+
+    @contextmanager
+    def _connect(self):
+        import sqlite3  # only loaded when the SQLite store is selected
+        conn = sqlite3.connect(self.path, timeout=10)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def create(self, kind, owner):
+        job = _new_job(kind, owner)
+        with self._connect() as conn:
+            conn.execute(
+                f'INSERT INTO jobs ({", ".join(_JOB_FIELDS)}) VALUES ({", ".join("?" * len(_JOB_FIELDS))})',
+                [job[field] for field in _JOB_FIELDS]
+            )
+        return job
+
+    def update(self, job_id, **fields):
+        fields['updated_at'] = time.time()
+        columns = [name for name in fields if name in _JOB_FIELDS]
+        with self._connect() as conn:
+            conn.execute(
+                f'UPDATE jobs SET {", ".join(f"{name} = ?" for name in columns)} WHERE id = ?',
+                [fields[name] for name in columns] + [job_id]
+            )
+
+    def get(self, job_id):
+        with self._connect() as conn:
+            row = conn.execute(
+                f'SELECT {", ".join(_JOB_FIELDS)} FROM jobs WHERE id = ?', (job_id,)
+            ).fetchone()
+        return dict(zip(_JOB_FIELDS, row)) if row else None
+
+    def set_result(self, job_id, data, meta):
+        with self._connect() as conn:
+            conn.execute(
+                'UPDATE jobs SET result = ?, result_meta = ? WHERE id = ?',
+                (bytes(data), json.dumps(meta), job_id)
+            )
+
+    def get_result(self, job_id):
+        with self._connect() as conn:
+            row = conn.execute(
+                'SELECT result, result_meta FROM jobs WHERE id = ? AND result IS NOT NULL', (job_id,)
+            ).fetchone()
+        return (bytes(row[0]), json.loads(row[1])) if row else None
+
+    def delete(self, job_id):
+        with self._connect() as conn:
+            conn.execute('DELETE FROM jobs WHERE id = ?', (job_id,))
+
+    def purge_expired(self, now=None):
+        with self._connect() as conn:
+            return conn.execute(
+                'DELETE FROM jobs WHERE status IN (?, ?) AND expires_at < ?', _FINISHED + (now or time.time(),)
+            ).rowcount
+
+
+_store = None
+_store_lock = threading.Lock()
+_queue = None
+
+
+def get_job_store():
+    """Return the configured job store, creating it on first use."""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                if os.environ.get('JOB_STORE', 'memory') == 'sqlite':
+                    import tempfile
+                    path = os.environ.get('JOB_STORE_PATH') or os.path.join(
+                        tempfile.gettempdir(), 'pdf-converter-jobs.sqlite3')
+                    _store = SQLiteJobStore(path)
+                else:
+                    _store = MemoryJobStore()
+    return _store
+
+
+def set_job_store(store):
+    """Plug in a different job store (any object with the MemoryJobStore methods)."""
+    global _store
+    _store = store
+
+
+def _get_queue():
+    global _queue
+    if _queue is None:
+        with _store_lock:
+            if _queue is None:
+                # Imported here: only async requests need the worker queue
+                from concurrent.futures import ThreadPoolExecutor
+                _queue = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix='job')
+    return _queue
+
+
+def _progress_reporter(store, job_id):
+    """Build a progress(done, total) callback that throttles store writes."""
+    last = [0.0]
+
+    def progress(done, total=None):
+        now = time.monotonic()
+        if now - last[0] < PROGRESS_INTERVAL_SECONDS and (total is None or done < total):
+            return
+        last[0] = now
+        store.update(job_id, pages_done=done, pages_total=total)
+
+    return progress
+
+
+def _run_job(store, job_id, kind, fn, result_meta):
+    store.update(job_id, status=STATUS_RUNNING)
+    try:
+        # Stage timings of async conversions are recorded under job:<kind>
+        with background(f'job:{kind}'):
+            data, info = fn(_progress_reporter(store, job_id))
+        meta = dict(result_meta)
+        meta.update(info or {})
+        store.set_result(job_id, data, meta)
+        fields = {'status': STATUS_DONE, 'expires_at': time.time() + JOB_RESULT_TTL_SECONDS}
+        if 'page_count' in meta:
+            fields['pages_done'] = fields['pages_total'] = meta['page_count']
+        store.update(job_id, **fields)
+    except Exception as e:
+        print(f'Job {job_id} failed: {e}')
+        store.update(job_id, status=STATUS_ERROR, error=str(e),
+                     expires_at=time.time() + JOB_RESULT_TTL_SECONDS)
+
+
+def wants_async(handler, params):
+    """True when the client asked for the job-based mode."""
+    if 'respond-async' in handler.headers.get('Prefer', '').lower():
+        return True
+    return str(params.get('async', '')).lower() in ('1', 'true')
+
+
+def submit_job(kind, owner, fn, mime, filename, field, data_url=False):
+    """
+    Queue fn(progress) -> (data, info) and return the new job.
+    mime/filename/field describe how the result is sent back (see api/jobs.py);
+    info may carry 'message' and 'page_count'.
+    """
+    store = get_job_store()
+    store.purge_expired()
+    job = store.create(kind, owner)
+    result_meta = {'mime': mime, 'filename': filename, 'field': field, 'data_url': data_url}
+    _get_queue().submit(_run_job, store, job['id'], kind, fn, result_meta)
+    return job
+
+
+def job_status(job):
+    """Public view of a job record."""
+    return {
+        'job_id': job['id'],
+        'kind': job['kind'],
+        'status': job['status'],
+        'pages_done': job['pages_done'],
+        'pages_total': job['pages_total'],
+        'error': job['error'],
+        'expires_at': job['expires_at'],
+    }
+
+
+def send_job_accepted(handler, origin, job):
+    """Send 202 Accepted with the job id and where to poll for it."""
+    status_url = f'/api/jobs?id={job["id"]}'
+    response = job_status(job)
+    response.update({
+        'success': True,
+        'status_url': status_url,
+        'result_url': f'{status_url}&result=1',
+    })
+    send_json(handler, origin, response, status=202, extra_headers={'Location': status_url})
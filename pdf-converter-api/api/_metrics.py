@@ -0,0 +1,377 @@
+"""
+Per-stage timing, in-process metrics and Prometheus text exposition.
+
+Handlers are wrapped with @instrumented(route) (or request_timing(handler,
+route)). That binds a Timings object to the request's thread, and code on the
+request path marks its stages with `with timed('parse'):` or
+`timed_iter('extract', pages)` (time spent producing each item). Stage times are exclusive: a stage nested in another is
+subtracted from the outer one, so the stages of a request add up to at most
+its total. Every response of an instrumented handler carries them in a
+Server-Timing header (milliseconds, plus `total`), and they feed the
+in-process histograms:
+
+    converter_requests_total{route,method,status} counter
+    converter_errors_total{route,error}           counter (exception class or http_<status>)
+    converter_request_seconds{route,method}       histogram
+    converter_stage_seconds{route,stage}          histogram
+    converter_input_bytes{route}                  histogram
+    converter_pages{route}                        histogram
+    converter_pages_reused{route}                 histogram (pages served from the page cache)
+
+GET /api/metrics renders them in the Prometheus text format. Metrics are per
+process: the self-hosted server shares one process across routes, while each
+serverless function instance keeps its own.
+
+Stages (and the reused page count) recorded in a forked worker
+(api/_admission.py) are exported there and replayed into the parent's request
+with replay().
+
+Configuration (environment):
+    METRICS_ENABLED   1 (default) or 0 to turn timing and metrics off
+
+No external dependencies — uses Python stdlib only.
+"""
+
+import os
+import time
+import threading
+import functools
+from bisect import bisect_left
+from contextlib import contextmanager
+
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '1').lower() not in ('0', 'false', 'no')
+
+SECONDS_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+BYTES_BUCKETS = (1 << 10, 16 << 10, 64 << 10, 256 << 10, 1 << 20, 4 << 20, 16 << 20, 64 << 20)
+PAGES_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000)
+
+_local = threading.local()
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=''):
+    pairs = [f'{name}="{_escape_label(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        with self._lock:
+            values = sorted(self._values.items())
+        for label_values, value in values:
+            lines.append(f'{self.name}{_format_labels(self.labels, label_values)} {_format_value(value)}')
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, buckets, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        # label values -> [bucket counts..., +Inf count, sum]
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series = sorted((key, list(value)) for key, value in self._series.items())
+        for label_values, counts in series:
+            total = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                total += count
+                le = 'le="' + _format_value(bound) + '"'
+                lines.append(f'{self.name}_bucket{_format_labels(self.labels, label_values, le)} {total}')
+            labels = _format_labels(self.labels, label_values)
+            lines.append(f'{self.name}_sum{labels} {_format_value(counts[-1])}')
+            lines.append(f'{self.name}_count{labels} {total}')
+        return lines
+
+
+requests_total = Counter('converter_requests_total', 'Requests by route, method and status.',
+                         ('route', 'method', 'status'))
+errors_total = Counter('converter_errors_total', 'Failed requests by route and error class.', ('route', 'error'))
+request_seconds = Histogram('converter_request_seconds', 'Request latency in seconds.', SECONDS_BUCKETS,
+                            ('route', 'method'))
+stage_seconds = Histogram('converter_stage_seconds', 'Exclusive time per request stage in seconds.',
+                          SECONDS_BUCKETS, ('route', 'stage'))
+input_bytes = Histogram('converter_input_bytes', 'Request body size in bytes.', BYTES_BUCKETS, ('route',))
+pages = Histogram('converter_pages', 'Pages per converted document.', PAGES_BUCKETS, ('route',))
+pages_reused = Histogram('converter_pages_reused', 'Pages per document served from the page cache.',
+                         PAGES_BUCKETS, ('route',))
+
+METRICS = (requests_total, errors_total, request_seconds, stage_seconds, input_bytes, pages, pages_reused)
+
+
+def _reset_locks():
+    # Another thread may have held a metric's lock at fork time; the forked
+    # worker (api/_admission.py) records stages, so it needs fresh locks
+    for metric in METRICS:
+        metric._lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_locks)
+
+
+class Timings:
+    """Stage times (seconds, exclusive) of one request or background job."""
+
+    def __init__(self, route):
+        self.route = route
+        self.started = time.perf_counter()
+        self.stages = {}
+        self.status = None
+        self.error = None
+        self.pages = None
+        self.pages_reused = None
+        # One [child seconds] frame per open stage
+        self._stack = []
+
+    def add(self, stage, seconds):
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+        if self._stack:
+            self._stack[-1][0] += seconds
+        stage_seconds.observe(seconds, self.route, stage)
+
+    def header(self):
+        """Server-Timing header value."""
+        parts = [f'{stage};dur={seconds * 1000:.1f}' for stage, seconds in self.stages.items()]
+        parts.append(f'total;dur={(time.perf_counter() - self.started) * 1000:.1f}')
+        return ', '.join(parts)
+
+    def export(self):
+        """What a forked worker sends back to its parent for replay()."""
+        return {'stages': self.stages, 'pages_reused': self.pages_reused}
+
+
+def current():
+    """The Timings bound to this thread, or None."""
+    return getattr(_local, 'timings', None)
+
+
+def bind(timings):
+    """Bind timings to this thread (None unbinds); returns the previous binding."""
+    previous = current()
+    _local.timings = timings
+    return previous
+
+
+class _Stage:
+    """Context manager recording the exclusive time of one stage."""
+
+    __slots__ = ('name', 'timings', 'frame', 'started')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.timings = current()
+        if self.timings is not None:
+            self.frame = [0.0]
+            self.timings._stack.append(self.frame)
+            self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        timings = self.timings
+        if timings is not None:
+            elapsed = time.perf_counter() - self.started
+            timings._stack.pop()
+            timings.add(self.name, elapsed - self.frame[0])
+
+
+class _NoStage:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        pass
+
+
+_NO_STAGE = _NoStage()
+
+
+def timed(name):
+    """`with timed(name):` records the block as a stage of the current request."""
+    if not METRICS_ENABLED or current() is None:
+        return _NO_STAGE
+    return _Stage(name)
+
+
+def timed_iter(name, iterable):
+    """Yield from iterable, recording the time spent producing each item as stage `name`."""
+    iterator = iter(iterable)
+    while True:
+        with timed(name):
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+        yield item
+
+
+def replay(exported):
+    """Record what a forked worker measured (Timings.export()) in the current request."""
+    timings = current()
+    if timings is not None:
+        for stage, seconds in exported['stages'].items():
+            timings.add(stage, seconds)
+        if exported['pages_reused'] is not None:
+            timings.pages_reused = exported['pages_reused']
+
+
+def note_error(error):
+    """Record the class of an error a handler caught and answered itself."""
+    timings = current()
+    if timings is not None:
+        timings.error = type(error).__name__
+
+
+def note_pages(count):
+    """Record the page count of the converted document."""
+    timings = current()
+    if timings is not None and count is not None:
+        timings.pages = count
+
+
+def note_pages_reused(count):
+    """Record how many pages of the document came from the page cache."""
+    timings = current()
+    if timings is not None:
+        timings.pages_reused = count
+
+
+def request_pages_reused():
+    """Pages of the current request's document served from the page cache, or None."""
+    timings = current()
+    return None if timings is None else timings.pages_reused
+
+
+def _finish(timings, handler):
+    route = timings.route
+    status = timings.status or 500
+    requests_total.inc(route, handler.command, str(status))
+    request_seconds.observe(time.perf_counter() - timings.started, route, handler.command)
+    if status >= 400 or timings.error:
+        errors_total.inc(route, timings.error or f'http_{status}')
+    length = handler.headers.get('Content-Length')
+    if length and length.isdigit():
+        input_bytes.observe(int(length), route)
+    if timings.pages is not None:
+        pages.observe(timings.pages, route)
+    if timings.pages_reused is not None:
+        pages_reused.observe(timings.pages_reused, route)
+
+
+@contextmanager
+def request_timing(handler, route):
+    """
+    Time one request: adds Server-Timing to every response the handler sends
+    and records the request metrics when the block exits. Nested use for the
+    same request (e.g. on the server's conversion executor) reuses its Timings.
+    Yields the Timings, or None when metrics are off.
+    """
+    if not METRICS_ENABLED:
+        yield None
+        return
+    timings = getattr(handler, '_timings', None)
+    if timings is not None:
+        previous = bind(timings)
+        try:
+            yield timings
+        finally:
+            bind(previous)
+        return
+
+    timings = handler._timings = Timings(route)
+    previous = bind(timings)
+    send_response = handler.send_response
+    end_headers = handler.end_headers
+
+    def capture_status(code, message=None):
+        timings.status = code
+        send_response(code, message)
+
+    def add_timing_header():
+        handler.send_header('Server-Timing', timings.header())
+        end_headers()
+
+    # Instance attributes shadow the class methods for this request only
+    handler.send_response = capture_status
+    handler.end_headers = add_timing_header
+    try:
+        yield timings
+    except Exception as e:
+        timings.error = type(e).__name__
+        raise
+    finally:
+        del handler.send_response, handler.end_headers, handler._timings
+        bind(previous)
+        _finish(timings, handler)
+
+
+def instrumented(route):
+    """Decorator for a handler's do_* method: runs it under request_timing(route)."""
+    def decorate(method):
+        @functools.wraps(method)
+        def wrapper(self):
+            with request_timing(self, route):
+                return method(self)
+        return wrapper
+    return decorate
+
+
+@contextmanager
+def background(route):
+    """Record the stages of work done outside a request (async jobs) under `route`."""
+    if not METRICS_ENABLED:
+        yield None
+        return
+    timings = Timings(route)
+    previous = bind(timings)
+    try:
+        yield timings
+    finally:
+        bind(previous)
+
+
+def render():
+    """All metrics in the Prometheus text exposition format."""
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
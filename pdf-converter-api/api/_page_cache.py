@@ -0,0 +1,219 @@
+"""
+Page-level extraction cache for the PDF to DOCX converter.
+
+Revisions of a drawing set or spec book usually change a few pages, but the
+whole-document cache (api/_cache.py) is keyed by the complete input. This
+cache is keyed per page instead: a hash of the page's content streams and of
+everything its /Resources reference (fonts, ToUnicode maps, form XObjects),
+so a new revision only re-extracts the pages that changed. Image data and
+embedded font programs are left out of the hash; text extraction never reads
+them. Each entry holds the page's paragraph structure as built by the
+converter.
+
+Indirect objects are hashed once per document, so fonts shared by every page
+cost one pass. Fingerprinting reads the raw (still compressed) streams and is
+far cheaper than extracting the page.
+
+Entries created in an isolated conversion worker (api/_admission.py) are sent
+back and merged into the parent's cache.
+
+Configuration (environment):
+    PAGE_CACHE_MAX_BYTES     memory budget (default 32 MB, 0 disables)
+    PAGE_CACHE_MAX_ENTRIES   entry limit (default 50000)
+
+No external dependencies — uses Python stdlib only (PyPDF2 objects are passed in).
+"""
+
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+
+# Bump when extraction or the converter's page structure changes
+PAGE_CACHE_VERSION = 1
+
+# Rough per-entry and per-block overhead (key, tuples, dict slot) in bytes
+ENTRY_OVERHEAD = 200
+BLOCK_OVERHEAD = 64
+
+# Stream data under these keys is never read by text extraction
+_SKIPPED_STREAM_KEYS = ('/FontFile', '/FontFile2', '/FontFile3')
+
+
+def _is_image(stream):
+    return stream.get('/Subtype') == '/Image'
+
+
+class _Fingerprinter:
+    """Hashes the pages of one document, memoizing indirect objects."""
+
+    def __init__(self):
+        self._digests = {}
+        self._active = set()
+
+    def _indirect(self, ref, skip_data):
+        key = (ref.idnum, ref.generation, skip_data)
+        digest = self._digests.get(key)
+        if digest is None:
+            if key in self._active:
+                # Reference cycle: the object is already being hashed further up
+                return b'R%d' % ref.idnum
+            self._active.add(key)
+            try:
+                h = hashlib.blake2b(digest_size=16)
+                self._feed(h, ref.get_object(), skip_data)
+                digest = self._digests[key] = h.digest()
+            finally:
+                self._active.discard(key)
+        return digest
+
+    def _feed(self, h, obj, skip_data=False):
+        from PyPDF2.generic import ArrayObject, DictionaryObject, IndirectObject, StreamObject
+
+        if isinstance(obj, IndirectObject):
+            h.update(b'R')
+            h.update(self._indirect(obj, skip_data))
+        elif isinstance(obj, DictionaryObject):
+            h.update(b'<<')
+            for name in sorted(obj):
+                if name == '/Parent':
+                    continue
+                h.update(name.encode('utf-8', 'surrogatepass'))
+                # dict.__getitem__ keeps indirect references unresolved, so they hit the memo
+                self._feed(h, dict.__getitem__(obj, name), name in _SKIPPED_STREAM_KEYS)
+            h.update(b'>>')
+            if isinstance(obj, StreamObject) and not skip_data and not _is_image(obj):
+                h.update(b'stream%d:' % len(obj._data))
+                h.update(obj._data)
+        elif isinstance(obj, ArrayObject):
+            h.update(b'[')
+            for item in obj:
+                self._feed(h, item, skip_data)
+            h.update(b']')
+        else:
+            h.update(type(obj).__name__.encode())
+            h.update(repr(obj).encode('utf-8', 'surrogatepass'))
+            h.update(b'\0')
+
+    def page(self, page):
+        h = hashlib.blake2b(digest_size=16)
+        h.update(b'%d:' % PAGE_CACHE_VERSION)
+        for name in ('/Contents', '/Resources', '/Rotate'):
+            h.update(name.encode())
+            if name in page:
+                self._feed(h, dict.__getitem__(page, name))
+        return h.hexdigest()
+
+
+def page_fingerprints(reader, pages=None):
+    """Cache key of every page of an open PdfReader (or of the page indices in pages), in page order."""
+    fingerprinter = _Fingerprinter()
+    if pages is None:
+        return [fingerprinter.page(page) for page in reader.pages]
+    return [fingerprinter.page(reader.pages[page_num]) for page_num in pages]
+
+
+def _entry_size(blocks):
+    return ENTRY_OVERHEAD + sum(BLOCK_OVERHEAD + len(text) for _, text in blocks)
+
+
+class PageCache:
+    def __init__(self, max_bytes, max_entries):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        # key -> (blocks, size, sequence number)
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._sequence = 0
+        self._fork_sequence = None
+        self._lock = threading.Lock()
+        self._counters = {'hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0, 'merged': 0}
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            max_bytes=int(os.environ.get('PAGE_CACHE_MAX_BYTES', 32 * 1024 * 1024)),
+            max_entries=int(os.environ.get('PAGE_CACHE_MAX_ENTRIES', 50000)),
+        )
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0 and self.max_entries > 0
+
+    def _after_fork(self):
+        # The lock may have been held by another thread of the parent
+        self._lock = threading.Lock()
+        self._fork_sequence = self._sequence
+
+    def get_many(self, keys):
+        """Cached page structures for keys, None where missing."""
+        results = []
+        with self._lock:
+            for key in keys:
+                entry = self._entries.get(key)
+                if entry is None:
+                    self._counters['misses'] += 1
+                    results.append(None)
+                else:
+                    self._entries.move_to_end(key)
+                    self._counters['hits'] += 1
+                    results.append(entry[0])
+        return results
+
+    def put(self, key, blocks):
+        """Store a page's structure, a tuple of (heading level or 0, text) blocks."""
+        if not self.enabled:
+            return
+        size = _entry_size(blocks)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            self._counters['stores'] += 1
+            self._store(key, blocks, size)
+
+    def _store(self, key, blocks, size):
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._bytes -= old[1]
+        self._sequence += 1
+        self._entries[key] = (blocks, size, self._sequence)
+        self._bytes += size
+        while self._entries and (self._bytes > self.max_bytes or len(self._entries) > self.max_entries):
+            _, (_, evicted_size, _) = self._entries.popitem(last=False)
+            self._bytes -= evicted_size
+            self._counters['evictions'] += 1
+
+    def changes_since_fork(self):
+        """In a forked worker: the entries stored since the fork, as [(key, blocks)]."""
+        if self._fork_sequence is None:
+            return None
+        with self._lock:
+            return [(key, blocks) for key, (blocks, _, sequence) in self._entries.items()
+                    if sequence > self._fork_sequence]
+
+    def merge(self, changes):
+        """Store entries a forked worker created (see changes_since_fork)."""
+        if not changes:
+            return
+        with self._lock:
+            for key, blocks in changes:
+                self._counters['merged'] += 1
+                self._store(key, blocks, _entry_size(blocks))
+
+    def stats(self):
+        """Snapshot of the counters and size."""
+        with self._lock:
+            lookups = self._counters['hits'] + self._counters['misses']
+            return dict(self._counters, entries=len(self._entries), bytes=self._bytes,
+                        max_bytes=self.max_bytes, max_entries=self.max_entries,
+                        hit_rate=round(self._counters['hits'] / lookups, 4) if lookups else None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+
+page_cache = PageCache.from_env()
@@ -0,0 +1,630 @@
+"""
+PDF compression: downsample and recompress embedded images, merge duplicates.
+
+1. Every image XObject reachable from a page (directly or through form
+   XObjects) is found, along with the largest size it is drawn at, read from
+   the q/Q/cm/Do operators of the content streams.
+2. Identical images (same data, dictionary and soft mask, e.g. a title-block
+   logo repeated by a merged sheet set) are merged into one object.
+3. Each distinct image is resampled to the target DPI at its placed size and
+   re-encoded on a thread pool (Pillow releases the GIL while decoding,
+   resampling and encoding). Photographic images become JPEG; images with few
+   colours (line work, scanned drawings) stay lossless as Flate. A result is
+   only used if it is smaller than the original.
+4. The pages are written to a new document with their outline, links and
+   named destinations.
+
+Only 8-bit RGB and grey images are recompressed (DCT, or Flate with or
+without a PNG predictor); CMYK, indexed, masked-by-colour-key, 1-bit and
+JPX/JBIG2/CCITT images are kept as they are, as are images that are not
+drawn larger than the target resolution would need.
+
+Configuration (environment):
+    COMPRESS_WORKERS   image recompression threads, also used for PDF to DOCX
+                       images (default: available cores)
+"""
+
+import io
+import os
+import re
+import math
+import zlib
+import struct
+import hashlib
+import threading
+from _admission import admission
+from _metrics import timed
+from _pdf_extract import available_cores, declared_page_count
+
+# level -> (target DPI, JPEG quality), the levels the frontend offers
+LEVELS = {
+    'light': (200, 85),
+    'balanced': (150, 75),
+    'aggressive': (96, 60),
+}
+DEFAULT_LEVEL = 'balanced'
+
+# Images are only resampled when they shrink by at least this factor per side;
+# below it the quality loss isn't worth the bytes
+MIN_SCALE = 0.9
+
+# Images with at most this many colours are kept lossless (Flate)
+LOSSLESS_MAX_COLORS = 256
+
+# Form XObjects nested deeper than this are not scanned for placements
+MAX_FORM_DEPTH = 8
+
+_COLORSPACE_MODES = {'/DeviceRGB': 'RGB', '/DeviceGray': 'L', '/CalRGB': 'RGB', '/CalGray': 'L'}
+
+# q, Q, "a b c d e f cm" and "/Name Do", each delimited by whitespace
+_NUMBER = rb'[-+]?(?:\d+(?:\.\d*)?|\.\d+)'
+_CONTENT_OPERATORS = re.compile(
+    rb'(?<![^\s])(?:(q)|(Q)|((?:' + _NUMBER + rb'\s+){6})cm|/([^\s/\[\]()<>{}%]+)\s+Do)(?![^\s])'
+)
+
+_IDENTITY = (1.0, 0.0, 0.0, 1.0)
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _reset_pool():
+    # Threads don't survive fork; an isolated worker starts its own pool
+    global _pool, _pool_lock
+    _pool = None
+    _pool_lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_pool)
+
+
+def pool_size():
+    return int(os.environ.get('COMPRESS_WORKERS', 0)) or available_cores()
+
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                from concurrent.futures import ThreadPoolExecutor
+                _pool = ThreadPoolExecutor(max_workers=pool_size(), thread_name_prefix='compress')
+    return _pool
+
+
+def resolve_options(params):
+    """(dpi, quality) from request params: level, optionally overridden by dpi and quality."""
+    level = params.get('level', DEFAULT_LEVEL)
+    if level not in LEVELS:
+        raise ValueError(f'Unknown level: {level} (expected {", ".join(LEVELS)})')
+    dpi, quality = LEVELS[level]
+    try:
+        dpi = int(params.get('dpi', dpi))
+        quality = int(params.get('quality', quality))
+    except (TypeError, ValueError):
+        raise ValueError('dpi and quality must be integers')
+    if not 36 <= dpi <= 600:
+        raise ValueError('dpi must be between 36 and 600')
+    if not 10 <= quality <= 95:
+        raise ValueError('quality must be between 10 and 95')
+    return dpi, quality
+
+
+def _multiply(m, n):
+    """2x2 part of the matrix product m x n (PDF row-vector convention)."""
+    return (m[0] * n[0] + m[1] * n[2], m[0] * n[1] + m[1] * n[3],
+            m[2] * n[0] + m[3] * n[2], m[2] * n[1] + m[3] * n[3])
+
+
+def _stream_bytes(contents):
+    """Decoded bytes of a /Contents entry: one stream or an array of them."""
+    from PyPDF2.generic import ArrayObject
+
+    contents = contents.get_object()
+    if isinstance(contents, ArrayObject):
+        return b'\n'.join(part.get_object().get_data() for part in contents)
+    return contents.get_data()
+
+
+class ImageScan:
+    """Image XObjects of one document and the largest size (points) each is drawn at."""
+
+    def __init__(self):
+        # image ref key -> image stream
+        self.images = {}
+        # image ref key -> [width, height] in points, the largest placement seen
+        self.placed = {}
+        # image ref key -> largest page (width, height) it appears on, for images with no placement found
+        self.page_sizes = {}
+        # every XObject resource dictionary, for rewriting references to duplicates
+        self.xobject_dicts = []
+        # form ref key -> [(image key, matrix)] relative to the form's parent space
+        self._forms = {}
+        self._seen_dicts = set()
+
+    def _xobjects(self, resources):
+        """{name: (ref, object)} of a /Resources dictionary's XObjects."""
+        from PyPDF2.generic import IndirectObject
+
+        if resources is None:
+            return {}
+        resources = resources.get_object()
+        xobjects = resources.get('/XObject')
+        if xobjects is None:
+            return {}
+        xobjects = xobjects.get_object()
+        if id(xobjects) not in self._seen_dicts:
+            self._seen_dicts.add(id(xobjects))
+            self.xobject_dicts.append(xobjects)
+        found = {}
+        for name in xobjects:
+            ref = dict.__getitem__(xobjects, name)
+            if isinstance(ref, IndirectObject):
+                found[name[1:]] = (ref, ref.get_object())
+        return found
+
+    def _placements(self, content, resources, page_size, depth):
+        """[(image key, matrix)] of the images a content stream draws, in its own space."""
+        xobjects = self._xobjects(resources)
+        placements = []
+        names = {}
+        for name, (ref, obj) in xobjects.items():
+            key = (ref.idnum, ref.generation)
+            subtype = obj.get('/Subtype')
+            if subtype == '/Image':
+                self.images[key] = obj
+                width, height = self.page_sizes.get(key, (0, 0))
+                self.page_sizes[key] = (max(width, page_size[0]), max(height, page_size[1]))
+            elif subtype != '/Form':
+                continue
+            names[name.encode('utf-8', 'surrogatepass')] = (key, subtype, obj)
+        if not names:
+            return placements
+
+        ctm = _IDENTITY
+        stack = []
+        for match in _CONTENT_OPERATORS.finditer(content):
+            if match.group(1):
+                stack.append(ctm)
+            elif match.group(2):
+                if stack:
+                    ctm = stack.pop()
+            elif match.group(3):
+                a, b, c, d = (float(n) for n in match.group(3).split()[:4])
+                ctm = _multiply((a, b, c, d), ctm)
+            else:
+                entry = names.get(match.group(4))
+                if entry is None:
+                    continue
+                key, subtype, obj = entry
+                if subtype == '/Image':
+                    placements.append((key, ctm))
+                elif depth < MAX_FORM_DEPTH:
+                    for image_key, matrix in self._form(key, obj, page_size, depth + 1):
+                        placements.append((image_key, _multiply(matrix, ctm)))
+        return placements
+
+    def _form(self, key, form, page_size, depth):
+        placements = self._forms.get(key)
+        if placements is None:
+            # Cycles (a form drawing itself) end here
+            self._forms[key] = []
+            matrix = form.get('/Matrix')
+            matrix = tuple(float(n) for n in matrix[:4]) if matrix else _IDENTITY
+            try:
+                content = form.get_data()
+            except Exception:
+                content = b''
+            placements = [(image_key, _multiply(inner, matrix)) for image_key, inner in
+                          self._placements(content, form.get('/Resources'), page_size, depth)]
+            self._forms[key] = placements
+        return placements
+
+    def scan_page(self, page):
+        """Record the page's images; returns [(image key, width, height)] in points, in drawing order."""
+        box = page.mediabox
+        page_size = (abs(float(box.width)), abs(float(box.height)))
+        try:
+            content = _stream_bytes(page['/Contents']) if '/Contents' in page else b''
+        except Exception:
+            # Unreadable content: images fall back to the page size
+            content = b''
+        drawn = []
+        for key, (a, b, c, d) in self._placements(content, page.get('/Resources'), page_size, 0):
+            width, height = math.hypot(a, b), math.hypot(c, d)
+            placed = self.placed.setdefault(key, [0.0, 0.0])
+            placed[0] = max(placed[0], width)
+            placed[1] = max(placed[1], height)
+            drawn.append((key, width, height))
+        return drawn
+
+    def placed_size(self, key):
+        placed = self.placed.get(key)
+        if placed is None or not placed[0] or not placed[1]:
+            return self.page_sizes.get(key)
+        return tuple(placed)
+
+
+class Digester:
+    """Content hashes of PDF objects (stream data included), memoizing indirect objects."""
+
+    def __init__(self):
+        self._digests = {}
+
+    def indirect(self, ref):
+        key = (ref.idnum, ref.generation)
+        digest = self._digests.get(key)
+        if digest is None:
+            # A placeholder ends reference cycles
+            self._digests[key] = b'R%d' % ref.idnum
+            h = hashlib.blake2b(digest_size=16)
+            self.feed(h, ref.get_object())
+            digest = self._digests[key] = h.digest()
+        return digest
+
+    def feed(self, h, obj):
+        from PyPDF2.generic import ArrayObject, DictionaryObject, IndirectObject, StreamObject
+
+        if isinstance(obj, IndirectObject):
+            h.update(b'R')
+            h.update(self.indirect(obj))
+        elif isinstance(obj, DictionaryObject):
+            h.update(b'<<')
+            for name in sorted(obj):
+                if name == '/Length':
+                    continue
+                h.update(name.encode('utf-8', 'surrogatepass'))
+                self.feed(h, dict.__getitem__(obj, name))
+            h.update(b'>>')
+            if isinstance(obj, StreamObject):
+                h.update(b'stream%d:' % len(obj._data))
+                h.update(obj._data)
+        elif isinstance(obj, ArrayObject):
+            h.update(b'[')
+            for item in obj:
+                self.feed(h, item)
+            h.update(b']')
+        else:
+            h.update(type(obj).__name__.encode())
+            h.update(repr(obj).encode('utf-8', 'surrogatepass'))
+            h.update(b'\0')
+
+
+def _merge_duplicates(scan):
+    """Point every reference to a duplicate image at its first copy; returns the number merged."""
+    from PyPDF2.generic import IndirectObject, NameObject
+
+    digester = Digester()
+    canonical = {}
+    replacements = {}
+    for key in sorted(scan.images):
+        h = hashlib.blake2b(digest_size=16)
+        digester.feed(h, scan.images[key])
+        first = canonical.setdefault(h.digest(), key)
+        if first != key:
+            replacements[key] = first
+    if not replacements:
+        return 0
+
+    for xobjects in scan.xobject_dicts:
+        for name in list(xobjects):
+            ref = dict.__getitem__(xobjects, name)
+            if isinstance(ref, IndirectObject):
+                target = replacements.get((ref.idnum, ref.generation))
+                if target is not None:
+                    xobjects[NameObject(name)] = IndirectObject(target[0], target[1], ref.pdf)
+
+    # The merged image is drawn wherever any of its copies was
+    for key, first in replacements.items():
+        sizes = [size for size in (scan.placed_size(key), scan.placed_size(first)) if size]
+        if sizes:
+            scan.placed[first] = [max(size[0] for size in sizes), max(size[1] for size in sizes)]
+        del scan.images[key]
+    return len(replacements)
+
+
+def _png_chunk(tag, body):
+    return struct.pack('>I', len(body)) + tag + body + struct.pack('>I', zlib.crc32(tag + body))
+
+
+def _png_from_predicted(data, width, height, mode):
+    """
+    Wrap Flate data with PNG predictors (rows prefixed by a filter byte) in a
+    PNG file, which is the same encoding, so Pillow decodes it natively.
+    """
+    color_type = 2 if mode == 'RGB' else 0
+    header = struct.pack('>IIBBBBB', width, height, 8, color_type, 0, 0, 0)
+    return (b'\x89PNG\r\n\x1a\n' + _png_chunk(b'IHDR', header) + _png_chunk(b'IDAT', data)
+            + _png_chunk(b'IEND', b''))
+
+
+def _predicted_from_png(png):
+    """The Flate data (PNG predictors) of a PNG file's IDAT chunks."""
+    parts = []
+    position = 8
+    while position < len(png):
+        length, tag = struct.unpack('>I4s', png[position:position + 8])
+        if tag == b'IDAT':
+            parts.append(png[position + 8:position + 8 + length])
+        position += 12 + length
+    return b''.join(parts)
+
+
+_ASCII85_DIGITS = bytes(range(33, 118))
+_ASCII85_TABLE = bytes.maketrans(_ASCII85_DIGITS, bytes(range(85)))
+_WHITESPACE = b' \t\n\r\x0b\x0c\x00'
+
+
+def _ascii85_decode(data):
+    """
+    Decode ASCII85 stream data (PDF flavour: no <~ opener, ~> end marker).
+
+    base64.a85decode loops over the groups in Python, which takes seconds for a
+    large image. Here each group's value is computed in its own 8-byte lane of
+    five big integers (one per digit position), so the work happens in C.
+    """
+    end = data.rfind(b'~>')
+    data = bytes(data if end == -1 else data[:end]).translate(None, _WHITESPACE).replace(b'z', b'!!!!!')
+    if data.translate(None, _ASCII85_DIGITS):
+        raise ValueError('Invalid ASCII85 data')
+    padding = -len(data) % 5
+    digits = (data + b'u' * padding).translate(_ASCII85_TABLE)
+    groups = len(digits) // 5
+
+    value = 0
+    lanes = bytearray(8 * groups)
+    for position in range(5):
+        lanes[7::8] = digits[position::5]
+        value += int.from_bytes(lanes, 'big') * 85 ** (4 - position)
+    packed = value.to_bytes(8 * groups, 'big')
+    if any(packed[offset::8].count(0) != groups for offset in range(4)):
+        raise ValueError('Invalid ASCII85 data: group over 2**32')
+    out = bytearray(4 * groups)
+    for offset in range(4):
+        out[offset::4] = packed[4 + offset::8]
+    return bytes(out[:len(out) - padding])
+
+
+def _image_mode(stream):
+    """Pillow mode ('RGB' or 'L') of an image's colour space, or None if it isn't one of those."""
+    from PyPDF2.generic import ArrayObject
+
+    colorspace = stream.get('/ColorSpace')
+    if colorspace is None:
+        return None
+    colorspace = colorspace.get_object()
+    if isinstance(colorspace, ArrayObject) and colorspace:
+        family = colorspace[0]
+        if family == '/ICCBased' and len(colorspace) > 1:
+            return {3: 'RGB', 1: 'L'}.get(colorspace[1].get_object().get('/N'))
+        return _COLORSPACE_MODES.get(family)
+    return _COLORSPACE_MODES.get(colorspace)
+
+
+def image_spec(key, stream, placed, dpi, quality, mode=None):
+    """
+    Plain description of an image for load_image (safe to use off the main
+    thread), or None if it can't be decoded. mode overrides the colour space
+    (soft masks have none).
+    """
+    from PyPDF2.generic import ArrayObject
+
+    if stream.get('/ImageMask') or stream.get('/BitsPerComponent') != 8:
+        return None
+    mask = stream.get('/Mask')
+    if mask is not None and isinstance(mask.get_object(), ArrayObject):
+        # Colour-key masking needs exact colours
+        return None
+    smask = stream.get('/SMask')
+    if smask is not None and '/Matte' in smask.get_object():
+        # A pre-blended soft mask must keep the image's dimensions
+        return None
+    mode = mode or _image_mode(stream)
+    if mode is None:
+        return None
+    decode = stream.get('/Decode')
+    if decode is not None and [float(n) for n in decode.get_object()] != [0.0, 1.0] * len(mode):
+        # Inverted or remapped samples; only the default mapping is decoded
+        return None
+
+    filters = stream.get('/Filter')
+    filters = () if filters is None else filters.get_object()
+    if not isinstance(filters, ArrayObject):
+        filters = (filters,)
+    filters = tuple(filters)
+    ascii85 = filters[:1] == ('/ASCII85Decode',)
+    if ascii85:
+        filters = filters[1:]
+    if filters == ('/DCTDecode',):
+        kind = 'jpeg'
+    elif filters == ('/FlateDecode',):
+        parms = stream.get('/DecodeParms')
+        parms = {} if parms is None else parms.get_object()
+        if isinstance(parms, ArrayObject):
+            parms = parms[0].get_object() if parms else {}
+        predictor = parms.get('/Predictor', 1)
+        if predictor == 1:
+            kind = 'flate'
+        elif (predictor >= 10 and parms.get('/Colors', 1) == len(mode)
+              and parms.get('/BitsPerComponent', 8) == 8 and parms.get('/Columns', 1) == stream['/Width']):
+            kind = 'png'
+        else:
+            return None
+    elif not filters:
+        kind = 'raw'
+    else:
+        return None
+
+    width, height = int(stream['/Width']), int(stream['/Height'])
+    scale = 1.0
+    if placed:
+        # Enough pixels for the target DPI along the more demanding axis
+        scale = min(1.0, max(placed[0] * dpi / 72 / width, placed[1] * dpi / 72 / height))
+    if scale > MIN_SCALE:
+        scale = 1.0
+    size = (max(1, math.ceil(width * scale)), max(1, math.ceil(height * scale)))
+    return {'key': key, 'data': stream._data, 'ascii85': ascii85, 'kind': kind, 'mode': mode, 'width': width,
+            'height': height, 'size': size, 'quality': quality}
+
+
+def stream_data(spec):
+    """An image_spec's stream data with any ASCII85 layer removed."""
+    return _ascii85_decode(spec['data']) if spec['ascii85'] else spec['data']
+
+
+def load_image(spec):
+    """
+    Decode an image_spec into a Pillow image, not yet resampled (a JPEG may
+    already be reduced towards spec['size'] while decoding). Returns None for a
+    JPEG whose colour mode doesn't match its dictionary.
+    """
+    from PIL import Image
+
+    mode, size = spec['mode'], spec['size']
+    data = stream_data(spec)
+    if spec['kind'] == 'jpeg':
+        image = Image.open(io.BytesIO(data))
+        if image.mode != mode:
+            return None
+        # Let the JPEG decoder scale down by up to 8x while decoding
+        image.draft(mode, size)
+    elif spec['kind'] == 'png':
+        image = Image.open(io.BytesIO(_png_from_predicted(data, spec['width'], spec['height'], mode)))
+    else:
+        raw = zlib.decompress(data) if spec['kind'] == 'flate' else data
+        image = Image.frombytes(mode, (spec['width'], spec['height']), raw)
+    image.load()
+    return image
+
+
+def is_line_art(spec, image):
+    """Few colours: line work or a scanned drawing, which JPEG would smear."""
+    return spec['kind'] != 'jpeg' and image.getcolors(LOSSLESS_MAX_COLORS) is not None
+
+
+def resample(image, size):
+    """The image resized to size (width, height) in pixels."""
+    from PIL import Image
+
+    if image.size != size:
+        image = image.resize(size, Image.LANCZOS, reducing_gap=3.0)
+    return image
+
+
+def _recompress(spec):
+    """Worker: resample and re-encode one image; returns the replacement, or None to keep the original."""
+    try:
+        mode, size = spec['mode'], spec['size']
+        image = load_image(spec)
+        if image is None:
+            return None
+        lossless = is_line_art(spec, image)
+        image = resample(image, size)
+        out = io.BytesIO()
+        if lossless:
+            image.save(out, format='PNG', compress_level=6)
+            data = _predicted_from_png(out.getvalue())
+            result = {'filter': '/FlateDecode', 'parms': {'/Predictor': 15, '/Colors': len(mode),
+                                                          '/BitsPerComponent': 8, '/Columns': size[0]}}
+        else:
+            image.save(out, format='JPEG', quality=spec['quality'])
+            data = out.getvalue()
+            result = {'filter': '/DCTDecode', 'parms': None}
+    except Exception as e:
+        print(f'Image {spec["key"][0]} kept as is: {e}')
+        return None
+    if len(data) >= len(spec['data']):
+        return None
+    result.update(key=spec['key'], data=data, width=size[0], height=size[1])
+    return result
+
+
+def _apply(stream, result):
+    """Replace an image stream's data and dictionary with a _recompress result."""
+    from PyPDF2.generic import DictionaryObject, NameObject, NumberObject
+
+    stream._data = result['data']
+    if getattr(stream, 'decoded_self', None) is not None:
+        stream.decoded_self = None
+    stream[NameObject('/Filter')] = NameObject(result['filter'])
+    stream[NameObject('/Width')] = NumberObject(result['width'])
+    stream[NameObject('/Height')] = NumberObject(result['height'])
+    stream[NameObject('/BitsPerComponent')] = NumberObject(8)
+    if result['parms']:
+        stream[NameObject('/DecodeParms')] = DictionaryObject(
+            {NameObject(name): NumberObject(value) for name, value in result['parms'].items()})
+    else:
+        stream.pop('/DecodeParms', None)
+
+
+def compress_pdf(pdf_bytes, dpi, quality, progress=None):
+    """
+    Compress a PDF's images for the given target DPI and JPEG quality.
+    Returns (buffer, report); buffer is the input itself when compression
+    doesn't make it smaller. progress(images_done, images_total) is called
+    as images are recompressed.
+    """
+    from PyPDF2 import PdfReader, PdfWriter
+
+    with timed('parse'):
+        reader = PdfReader(io.BytesIO(pdf_bytes))
+        if reader.is_encrypted:
+            raise ValueError('Encrypted PDFs are not supported')
+        # The page limit, for page trees admission control couldn't see
+        admission.check_pages(declared_page_count(reader))
+        page_count = len(reader.pages)
+
+    with timed('scan'):
+        scan = ImageScan()
+        for page in reader.pages:
+            scan.scan_page(page)
+        image_count = len(scan.images)
+
+    with timed('dedupe'):
+        duplicates = _merge_duplicates(scan)
+
+    with timed('images'):
+        specs = [spec for spec in (image_spec(key, stream, scan.placed_size(key), dpi, quality)
+                                   for key, stream in sorted(scan.images.items()))
+                 # Re-encoding a JPEG at the same size loses quality for little gain
+                 if spec and not (spec['kind'] == 'jpeg' and spec['size'] == (spec['width'], spec['height']))]
+        recompressed = 0
+        if len(specs) > 1 and pool_size() > 1:
+            from concurrent.futures import as_completed
+            results = (future.result() for future in as_completed([get_pool().submit(_recompress, spec)
+                                                                    for spec in specs]))
+        else:
+            results = map(_recompress, specs)
+        for done, result in enumerate(results, 1):
+            if result is not None:
+                _apply(scan.images[result['key']], result)
+                recompressed += 1
+            if progress:
+                progress(done, len(specs))
+
+    with timed('write'):
+        writer = PdfWriter()
+        # Copies the pages with their outline and named destinations
+        writer.append(reader)
+        if reader.metadata:
+            writer.add_metadata({name: value for name, value in reader.metadata.items() if isinstance(value, str)})
+        out = io.BytesIO()
+        writer.write(out)
+        buffer = out.getbuffer()
+
+    unchanged = len(buffer) >= len(pdf_bytes)
+    if unchanged:
+        buffer = pdf_bytes
+    return buffer, {
+        'page_count': page_count,
+        'images': image_count,
+        'duplicates_merged': duplicates,
+        'images_recompressed': recompressed,
+        'original_bytes': len(pdf_bytes),
+        'compressed_bytes': len(buffer),
+        'ratio': round(len(buffer) / len(pdf_bytes), 4) if pdf_bytes else 1.0,
+        'unchanged': unchanged,
+        'dpi': dpi,
+        'quality': quality,
+    }
@@ -0,0 +1,362 @@
+"""
+Per-page PDF text extraction, fanned out across a process pool for large documents.
+
+Each worker attaches to the input bytes through shared memory, parses its own
+PdfReader and extracts a contiguous slice of pages; slices are reassembled in
+page order. Short documents (and platforms without working multiprocessing,
+e.g. AWS Lambda which has no /dev/shm) stay on the serial path.
+
+PageStructure turns page texts into paragraphs and headings, as the PDF to
+DOCX converter and the NDJSON page stream present them, and skips pages found
+in the page cache. load_page_range reads only some pages of a PdfReader (for
+previews), skipping the rest of the page tree by its /Count entries.
+
+Configuration (environment):
+    PDF_EXTRACT_WORKERS      pool size (default: available cores)
+    PDF_PARALLEL_MIN_PAGES   page count below which extraction is serial (default 24)
+"""
+
+import os
+import io
+import threading
+from _metrics import timed, timed_iter
+from _page_cache import page_cache, page_fingerprints
+
+PARALLEL_MIN_PAGES = int(os.environ.get('PDF_PARALLEL_MIN_PAGES', 24))
+
+# Pages per worker slice never drops below this, so small jobs don't pay
+# the fixed cost of parsing the document in many processes.
+MIN_PAGES_PER_SLICE = 8
+
+# Page attributes a page inherits from its ancestors in the page tree
+_INHERITABLE = ('/Resources', '/MediaBox', '/CropBox', '/Rotate')
+
+_pool = None
+_pool_lock = threading.Lock()
+_pool_broken = False
+
+
+def _reset_pool():
+    # The parent's pool (and its management thread) doesn't exist in a forked
+    # child; an isolated conversion worker starts its own pool when it needs one
+    global _pool, _pool_lock, _pool_broken
+    _pool = None
+    _pool_lock = threading.Lock()
+    _pool_broken = False
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_pool)
+
+
+def shutdown_pool():
+    """Stop the pool's worker processes, if this process started any."""
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+def available_cores():
+    """Number of cores this process may run on."""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def pool_size():
+    return int(os.environ.get('PDF_EXTRACT_WORKERS', 0)) or available_cores()
+
+
+def _get_pool():
+    """Create the shared process pool on first use; None if unavailable."""
+    global _pool, _pool_broken
+    if _pool is not None or _pool_broken:
+        return _pool
+    with _pool_lock:
+        if _pool is None and not _pool_broken:
+            try:
+                from concurrent.futures import ProcessPoolExecutor
+                _pool = ProcessPoolExecutor(max_workers=pool_size())
+            except (ImportError, NotImplementedError, OSError) as e:
+                print(f'Process pool unavailable, extracting serially: {e}')
+                _pool_broken = True
+    return _pool
+
+
+def _extract_slice(shm_name, size, pages):
+    """Worker: parse the shared PDF bytes and extract the given page indices."""
+    from multiprocessing import shared_memory
+
+    # Pool workers share the parent's resource tracker, so attaching here does
+    # not take ownership; the parent unlinks the segment when the job is done.
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        data = bytes(shm.buf[:size])
+    finally:
+        shm.close()
+
+    from PyPDF2 import PdfReader
+    reader = PdfReader(io.BytesIO(data))
+    # Only the part of the page tree holding this slice is read
+    load_page_range(reader, pages[0], pages[-1] + 1)
+    return [reader.pages[i].extract_text() or '' for i in pages]
+
+
+def _slices(pages, workers):
+    """Split a sequence of page indices into at most `workers` contiguous slices."""
+    page_count = len(pages)
+    count = max(1, min(workers, page_count // MIN_PAGES_PER_SLICE))
+    step, extra = divmod(page_count, count)
+    slices = []
+    start = 0
+    for i in range(count):
+        stop = start + step + (1 if i < extra else 0)
+        slices.append(pages[start:stop])
+        start = stop
+    return slices
+
+
+def extract_serial(reader, progress=None):
+    """Extract text from every page of an open PdfReader on the calling thread."""
+    page_count = len(reader.pages)
+    texts = []
+    for page in reader.pages:
+        texts.append(page.extract_text() or '')
+        if progress:
+            progress(len(texts), page_count)
+    return texts
+
+
+def extract_parallel(pdf_bytes, page_count, workers=None, progress=None):
+    """
+    Extract text from all pages on the process pool.
+    Returns a list of page texts in page order, or None if the pool is unavailable.
+    """
+    pool = _get_pool()
+    if pool is None:
+        return None
+    return list(_iter_parallel(pool, pdf_bytes, range(page_count), workers, progress))
+
+
+def _iter_parallel(pool, pdf_bytes, pages, workers=None, progress=None):
+    """Yield the texts of pages (indices, ascending) in order as each worker slice completes."""
+    from multiprocessing import shared_memory
+
+    slices = _slices(pages, workers or pool_size())
+    shm = shared_memory.SharedMemory(create=True, size=max(1, len(pdf_bytes)))
+    futures = []
+    try:
+        shm.buf[:len(pdf_bytes)] = pdf_bytes
+        futures = [
+            pool.submit(_extract_slice, shm.name, len(pdf_bytes), pages_slice)
+            for pages_slice in slices
+        ]
+        done = 0
+        for future, pages_slice in zip(futures, slices):
+            texts = future.result()
+            done += len(pages_slice)
+            if progress:
+                progress(done, len(pages))
+            yield from texts
+    finally:
+        # A consumer that stops early leaves later slices unwanted
+        for future in futures:
+            future.cancel()
+        shm.close()
+        shm.unlink()
+
+
+def iter_page_texts(pdf_bytes, reader=None, progress=None, pages=None):
+    """
+    Yield the text of every page, in page order, as pages are extracted.
+    pages limits this to those page indices (ascending), e.g. the pages
+    missing from the page cache; progress then counts those pages only.
+    Uses the process pool when at least PARALLEL_MIN_PAGES pages are to be
+    extracted and more than one core is available, a slice at a time.
+    progress(pages_done, pages_total) is called as pages complete.
+    """
+    if reader is None:
+        from PyPDF2 import PdfReader
+        reader = PdfReader(io.BytesIO(pdf_bytes))
+    if pages is None:
+        pages = range(len(reader.pages))
+    page_count = len(pages)
+    done = 0
+
+    if page_count >= PARALLEL_MIN_PAGES and pool_size() > 1:
+        pool = _get_pool()
+        if pool is not None:
+            try:
+                for text in _iter_parallel(pool, pdf_bytes, pages, progress=progress):
+                    yield text
+                    done += 1
+            except (OSError, RuntimeError) as e:
+                # BrokenProcessPool is a RuntimeError; carry on serially rather than fail the request
+                print(f'Parallel extraction failed, continuing serially after {done} of {page_count} pages: {e}')
+
+    for position in range(done, page_count):
+        text = reader.pages[pages[position]].extract_text() or ''
+        if progress:
+            progress(position + 1, page_count)
+        yield text
+
+
+def extract_page_texts(pdf_bytes, reader=None, progress=None):
+    """
+    Extract the text of every page, in page order (see iter_page_texts).
+    Returns (texts, reader).
+    """
+    if reader is None:
+        from PyPDF2 import PdfReader
+        reader = PdfReader(io.BytesIO(pdf_bytes))
+    return list(iter_page_texts(pdf_bytes, reader, progress)), reader
+
+
+class _LoadedPages:
+    """Stand-in for a PdfReader's flattened page list that holds only the loaded pages."""
+
+    def __init__(self, page_count, pages):
+        self._page_count = page_count
+        self._pages = pages
+
+    def __len__(self):
+        return self._page_count
+
+    def __getitem__(self, page_num):
+        if page_num < 0:
+            page_num += self._page_count
+        try:
+            return self._pages[page_num]
+        except KeyError:
+            raise IndexError(f'page {page_num + 1} was not loaded') from None
+
+
+def _walk_page_range(reader, first, last):
+    """{page index: PageObject} for pages first..last-1 (0-based), walking only the tree nodes that hold them."""
+    from PyPDF2 import PageObject
+    from PyPDF2.generic import IndirectObject, NameObject
+
+    pages = {}
+    index = 0
+    # (node reference, inherited attributes), depth first in document order
+    stack = [(reader.trailer['/Root'].raw_get('/Pages'), {})]
+    while stack and index < last:
+        reference, inherited = stack.pop()
+        node = reference.get_object() if isinstance(reference, IndirectObject) else reference
+        if node.get('/Type', '/Pages' if '/Kids' in node else '/Page') == '/Pages':
+            count = int(node['/Count'])
+            if index + count <= first:
+                # The whole subtree lies before the range
+                index += count
+                continue
+            inherited = dict(inherited)
+            for name in _INHERITABLE:
+                if name in node:
+                    inherited[name] = node[name]
+            stack.extend((kid, inherited) for kid in reversed(node['/Kids']))
+            continue
+        if index >= first:
+            for name, value in inherited.items():
+                if name not in node:
+                    node[NameObject(name)] = value
+            page = PageObject(reader, reference if isinstance(reference, IndirectObject) else None)
+            page.update(node)
+            pages[index] = page
+        index += 1
+    return pages
+
+
+def declared_page_count(reader):
+    """Page count from the page tree root's /Count, without reading the tree; None if unreadable."""
+    try:
+        return int(reader.trailer['/Root']['/Pages']['/Count'])
+    except Exception:
+        return None
+
+
+def load_page_range(reader, first, last):
+    """
+    Load pages first..last-1 (0-based) of an open PdfReader without reading the
+    rest of the page tree, and return the document's page count (from the root
+    /Count). Afterwards reader.pages has the full length but only those pages
+    can be read. A page tree whose counts don't add up is read in full.
+    """
+    if reader.flattened_pages is not None:
+        return len(reader.pages)
+    page_count = declared_page_count(reader)
+    if page_count is None:
+        return len(reader.pages)
+    try:
+        pages = _walk_page_range(reader, first, min(last, page_count))
+    except Exception as e:
+        print(f'Page tree not walkable, reading every page: {e}')
+        return len(reader.pages)
+    if sorted(pages) != list(range(first, min(last, page_count))):
+        return len(reader.pages)
+    reader.flattened_pages = _LoadedPages(page_count, pages)
+    return page_count
+
+
+def page_blocks(text):
+    """Paragraphs of one page's text, as a tuple of (heading level or 0, text)."""
+    blocks = []
+
+    # Split text into paragraphs (by double newline or single newline)
+    for para_text in text.split('\n'):
+        para_text = para_text.strip()
+        if para_text:
+            # Detect if it might be a heading (short, possibly all caps or title case)
+            is_heading = (
+                len(para_text) < 100 and
+                (para_text.isupper() or para_text.istitle()) and
+                not para_text.endswith('.')
+            )
+            blocks.append((2 if is_heading else 0, para_text))
+    return tuple(blocks)
+
+
+class PageStructure:
+    """
+    Paragraph structure (see page_blocks) of every page of an open PdfReader,
+    or of the page indices in pages (e.g. a preview's range); page_count is how
+    many pages that is. Pages found in the page cache (api/_page_cache.py) are
+    not extracted again; reused is how many were found.
+    """
+
+    def __init__(self, pdf_bytes, reader, pages=None):
+        self.pdf_bytes = pdf_bytes
+        self.reader = reader
+        self.pages = range(len(reader.pages)) if pages is None else pages
+        self.page_count = len(self.pages)
+        if page_cache.enabled:
+            with timed('fingerprint'):
+                self._keys = page_fingerprints(reader, None if pages is None else self.pages)
+            self._cached = page_cache.get_many(self._keys)
+        else:
+            self._keys = None
+            self._cached = [None] * self.page_count
+        self._missing = [self.pages[position] for position, blocks in enumerate(self._cached) if blocks is None]
+        self.reused = self.page_count - len(self._missing)
+
+    def iter_blocks(self, progress=None):
+        """
+        Yield the blocks of every page (of pages) in page order, extracting missing pages
+        as they are reached. progress(pages_done, pages_total) counts reused
+        pages as done from the start.
+        """
+        reused, page_count = self.reused, self.page_count
+        if progress and reused:
+            progress(reused, page_count)
+        extract_progress = (lambda done, total: progress(reused + done, page_count)) if progress else None
+
+        page_texts = timed_iter('extract', iter_page_texts(self.pdf_bytes, self.reader, extract_progress,
+                                                           pages=self._missing))
+        for position, blocks in enumerate(self._cached):
+            if blocks is None:
+                blocks = page_blocks(next(page_texts))
+                if self._keys is not None:
+                    page_cache.put(self._keys[position], blocks)
+            yield blocks
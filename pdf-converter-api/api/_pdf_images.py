@@ -0,0 +1,189 @@
+"""
+Page images for the PDF to DOCX converter.
+
+The pages are scanned for the images they draw, directly or through form
+XObjects, and the size each one is drawn at (see api/_pdf_compress.py).
+Identical images, e.g. a title-block logo on every sheet, become one DOCX media
+part, sized for their largest placement. Each is resampled to the target DPI
+and encoded on the image thread pool: PNG for images with few colours (line
+work, scanned drawings) or a soft mask, JPEG otherwise. A JPEG that needs no
+resampling is embedded as it is.
+
+Images are prepared in document order until the per-document byte budget is
+spent; the rest are left out without being decoded, so the output size and the
+time spent on images stay bounded whatever the PDF holds. Images the
+compressor can't decode (CMYK, indexed, 1-bit, JPX/JBIG2/CCITT) and images
+drawn smaller than MIN_DRAWN_POINTS are left out too.
+
+Configuration (environment):
+    PDF_DOCX_IMAGE_DPI        resolution at the drawn size (default 150)
+    PDF_DOCX_IMAGE_QUALITY    JPEG quality (default 80)
+    PDF_DOCX_IMAGE_BUDGET     image bytes per document, 0 leaves images out (default 16 MB)
+    COMPRESS_WORKERS          image threads, shared with /api/compress-pdf
+"""
+
+import io
+import os
+import hashlib
+from collections import deque
+from _metrics import timed
+from _pdf_compress import (Digester, ImageScan, get_pool, image_spec, is_line_art, load_image, pool_size, resample,
+                           stream_data)
+
+IMAGE_DPI = int(os.environ.get('PDF_DOCX_IMAGE_DPI', 150))
+IMAGE_QUALITY = int(os.environ.get('PDF_DOCX_IMAGE_QUALITY', 80))
+IMAGE_BUDGET = int(os.environ.get('PDF_DOCX_IMAGE_BUDGET', 16 * 1024 * 1024))
+
+# Images drawn smaller than this (points, either side) are rules and spacers, not pictures
+MIN_DRAWN_POINTS = 4
+
+
+def _encode(spec):
+    """Worker: (file bytes, extension) of one image for the DOCX, or None to leave it out."""
+    from PIL import Image
+
+    try:
+        size, smask = spec['size'], spec['smask']
+        if spec['kind'] == 'jpeg' and smask is None and size == (spec['width'], spec['height']):
+            data = stream_data(spec)
+            with Image.open(io.BytesIO(data)) as image:
+                if image.mode == spec['mode']:
+                    return data, 'jpg'
+
+        image = load_image(spec)
+        if image is None:
+            return None
+        lossless = is_line_art(spec, image)
+        image = resample(image, size)
+        if smask is not None:
+            mask = load_image(smask)
+            if mask is None:
+                return None
+            image.putalpha(resample(mask, size))
+            lossless = True
+
+        out = io.BytesIO()
+        if lossless:
+            image.save(out, format='PNG', compress_level=6)
+            return out.getvalue(), 'png'
+        image.save(out, format='JPEG', quality=spec['quality'])
+        return out.getvalue(), 'jpg'
+    except Exception as e:
+        print(f'Image {spec["key"][0]} left out of the DOCX: {e}')
+        return None
+
+
+def _encoded_in_order(specs):
+    """
+    Yield (spec, _encode(spec)) in order. On the pool, at most twice its size
+    run ahead, and whatever hasn't started is cancelled when the caller stops.
+    """
+    if len(specs) < 2 or pool_size() < 2:
+        for spec in specs:
+            yield spec, _encode(spec)
+        return
+
+    pool = get_pool()
+    ahead = 2 * pool_size()
+    pending = deque()
+    try:
+        for spec in specs:
+            pending.append((spec, pool.submit(_encode, spec)))
+            if len(pending) >= ahead:
+                spec, future = pending.popleft()
+                yield spec, future.result()
+        while pending:
+            spec, future = pending.popleft()
+            yield spec, future.result()
+    finally:
+        for _, future in pending:
+            future.cancel()
+
+
+def _spec(key, stream, placed, dpi, quality):
+    """image_spec with the soft mask's spec under 'smask', or None if either can't be decoded."""
+    spec = image_spec(key, stream, placed, dpi, quality)
+    if spec is None:
+        return None
+    spec['smask'] = None
+    smask = stream.get('/SMask')
+    if smask is not None:
+        spec['smask'] = image_spec(key, smask.get_object(), placed, dpi, quality, mode='L')
+        if spec['smask'] is None:
+            return None
+    return spec
+
+
+class PageImages:
+    """
+    The images of a PDF's pages (or of the page indices in pages), encoded for
+    the DOCX: media is [(file bytes, extension)], one entry per distinct image
+    in order of first appearance; pages holds, per page, [(media index, width,
+    height)] with the size drawn in points, in drawing order.
+    """
+
+    def __init__(self, reader, dpi=IMAGE_DPI, quality=IMAGE_QUALITY, budget=IMAGE_BUDGET, pages=None):
+        if pages is None:
+            pages = range(len(reader.pages))
+        self.media = []
+        self.pages = [[] for _ in pages]
+        # Distinct images drawn, and how many of those were left out
+        self.found = 0
+        self.left_out = 0
+        if budget <= 0:
+            return
+
+        with timed('scan'):
+            scan = ImageScan()
+            drawn = []
+            for page_num in pages:
+                try:
+                    drawn.append(scan.scan_page(reader.pages[page_num]))
+                except Exception as e:
+                    # Images are a bonus: a page whose resources can't be read keeps its text
+                    print(f'Images of page {page_num + 1} left out of the DOCX: {e}')
+                    drawn.append([])
+
+        with timed('images'):
+            # Duplicates (same data, dictionary and soft mask) share the first copy's key
+            digester = Digester()
+            first_keys = {}
+            canonical = {}
+            placed = {}
+            for placements in drawn:
+                for key, width, height in placements:
+                    if width < MIN_DRAWN_POINTS or height < MIN_DRAWN_POINTS:
+                        continue
+                    if key not in canonical:
+                        h = hashlib.blake2b(digest_size=16)
+                        digester.feed(h, scan.images[key])
+                        canonical[key] = first_keys.setdefault(h.digest(), key)
+                    size = placed.setdefault(canonical[key], [0.0, 0.0])
+                    size[0] = max(size[0], width)
+                    size[1] = max(size[1], height)
+            self.found = len(placed)
+
+            specs = [spec for spec in (_spec(key, scan.images[key], size, dpi, quality)
+                                       for key, size in placed.items()) if spec]
+            indexes = {}
+            spent = 0
+            encoded = _encoded_in_order(specs)
+            try:
+                for spec, result in encoded:
+                    if result is None:
+                        continue
+                    if spent + len(result[0]) > budget:
+                        print(f'Image budget of {budget} bytes spent; later images left out of the DOCX')
+                        break
+                    spent += len(result[0])
+                    indexes[spec['key']] = len(self.media)
+                    self.media.append(result)
+            finally:
+                encoded.close()
+            self.left_out = self.found - len(self.media)
+
+        for position, placements in enumerate(drawn):
+            for key, width, height in placements:
+                index = indexes.get(canonical.get(key))
+                if index is not None and width >= MIN_DRAWN_POINTS and height >= MIN_DRAWN_POINTS:
+                    self.pages[position].append((index, width, height))
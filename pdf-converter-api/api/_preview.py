@@ -0,0 +1,95 @@
+"""
+Preview conversions: the first pages of a document only.
+
+The DOCX preview (services/docxPreviewService.ts) and the DocumentTranslate
+panel show a few pages, so converting the whole document is wasted work. A
+request with `pages` (a 1-based page or range, "3" or "1-5") and/or
+`max_pages` (N: the first N pages, or N pages from the start of `pages`)
+converts only those pages. pdf-to-docx reads only the page tree nodes leading
+to them (see load_page_range in api/_pdf_extract.py); docx-to-pdf stops
+laying out after the last one, so its previews always start at page 1. Either
+way the time a preview takes follows the pages converted, not the document.
+A range starting past the document's last page is rejected with 400.
+
+The result says what it holds, as X-Preview-Pages (the pages converted),
+X-Truncated (true when the document has other pages) and X-Total-Pages (the
+document's page count, when it is known without converting everything), and
+as a `preview` object in JSON responses and job results. Previews are cached
+apart from full conversions and are always converted locally.
+
+Configuration (environment):
+    PREVIEW_MAX_PAGES   most pages one preview converts; longer ranges are cut (default 20)
+
+No external dependencies — uses Python stdlib only.
+"""
+
+import os
+
+PREVIEW_MAX_PAGES = int(os.environ.get('PREVIEW_MAX_PAGES', 20))
+
+
+class PreviewError(ValueError):
+    """The requested pages aren't in the document; answered with 400 like malformed options."""
+
+
+def read_preview(params, from_start=False):
+    """
+    The (first, last) pages (1-based, inclusive) a request asks to preview, or
+    None for a full conversion. Raises ValueError for malformed options, and
+    for ranges not starting at page 1 when from_start is set.
+    """
+    pages = params.get('pages')
+    max_pages = params.get('max_pages')
+    if pages in (None, '') and max_pages in (None, ''):
+        return None
+
+    first, last = 1, None
+    if pages not in (None, ''):
+        start, _, end = str(pages).partition('-')
+        try:
+            first = int(start)
+            last = int(end) if end else first
+        except ValueError:
+            raise ValueError(f'Invalid pages: {pages} (expected a page or a range like 1-5)')
+        if first < 1 or last < first:
+            raise ValueError(f'Invalid pages: {pages} (pages count from 1)')
+    if max_pages not in (None, ''):
+        try:
+            max_pages = int(max_pages)
+        except (TypeError, ValueError):
+            raise ValueError('max_pages must be an integer')
+        if max_pages < 1:
+            raise ValueError('max_pages must be at least 1')
+        last = first + max_pages - 1 if last is None else min(last, first + max_pages - 1)
+    if from_start and first != 1:
+        raise ValueError('Previews of this conversion start at page 1')
+    return first, min(last, first + PREVIEW_MAX_PAGES - 1)
+
+
+def preview_engine(engine):
+    """The engine for a preview: previews are local (iLovePDF converts whole documents)."""
+    if engine == 'ilovepdf':
+        raise ValueError('Previews are converted locally; use engine local or auto')
+    return 'local'
+
+
+def preview_details(first, last, total_pages, truncated):
+    """
+    A converter's details (see register_local in api/_engines.py) for a preview
+    of pages first..last (last < first: none) of a document of total_pages
+    (None if unknown); truncated: the document has other pages.
+    """
+    return {'preview': {'pages': f'{first}-{last}' if last >= first else None,
+                        'total_pages': total_pages, 'truncated': truncated}}
+
+
+def preview_headers(preview):
+    """Response headers for a conversion's preview details (None: a full conversion)."""
+    if preview is None:
+        return {}
+    headers = {'X-Truncated': 'true' if preview['truncated'] else 'false'}
+    if preview['pages'] is not None:
+        headers['X-Preview-Pages'] = preview['pages']
+    if preview['total_pages'] is not None:
+        headers['X-Total-Pages'] = str(preview['total_pages'])
+    return headers
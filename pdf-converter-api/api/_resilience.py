@@ -0,0 +1,206 @@
+"""
+Deadlines, retries, hedged calls and a circuit breaker for upstream requests.
+
+- Budget splits one overall time budget across the named steps of a request;
+  each step gets its weight's share of whatever time is left when it starts.
+- call_with_retries retries transient failures with exponential backoff and
+  full jitter, never sleeping past the step deadline.
+- hedged_call starts a second, identical call if the first hasn't answered
+  after a delay and returns whichever succeeds first.
+- CircuitBreaker fails fast while the recent failure ratio is too high and
+  lets a single trial call through after a cooldown.
+
+No external dependencies — uses Python stdlib only.
+"""
+
+import time
+import queue
+import random
+import threading
+from collections import deque
+
+BACKOFF_BASE_SECONDS = 0.25
+BACKOFF_CAP_SECONDS = 4.0
+
+
+class DeadlineExceeded(Exception):
+    """Raised when a step's deadline passes before it could complete."""
+
+
+class Budget:
+    """
+    Overall deadline for a multi-step request, shared out between its steps.
+    weights is an ordered mapping (or sequence of pairs) of step name -> weight.
+    """
+
+    def __init__(self, seconds, weights):
+        self.deadline = time.monotonic() + seconds
+        self._weights = dict(weights)
+        self._steps = list(self._weights)
+
+    def remaining(self):
+        return max(0.0, self.deadline - time.monotonic())
+
+    def step_deadline(self, step):
+        """
+        Absolute deadline for a step starting now: its weight's share of the
+        remaining time among this and the later steps, so time a fast step
+        didn't use carries over to the slow ones.
+        """
+        later = self._steps[self._steps.index(step):]
+        share = self._weights[step] / sum(self._weights[name] for name in later)
+        return time.monotonic() + self.remaining() * share
+
+
+def call_with_retries(fn, deadline, retries, is_retryable, on_retry=None):
+    """
+    Call fn(timeout) until it succeeds, a non-retryable error is raised or
+    `retries` retries are used up. timeout is the time left until deadline.
+    """
+    attempt = 0
+    while True:
+        timeout = deadline - time.monotonic()
+        if timeout <= 0:
+            raise DeadlineExceeded('deadline exceeded')
+        try:
+            return fn(timeout)
+        except Exception as e:
+            if attempt >= retries or not is_retryable(e):
+                raise
+            delay = random.uniform(0, min(BACKOFF_CAP_SECONDS, BACKOFF_BASE_SECONDS * 2 ** attempt))
+            if time.monotonic() + delay >= deadline:
+                raise
+            if on_retry:
+                on_retry(e)
+            time.sleep(delay)
+            attempt += 1
+
+
+def hedged_call(fn, hedge_after, discard, on_hedge=None):
+    """
+    Run fn(); if it hasn't returned within hedge_after seconds, run a second
+    fn() concurrently. Returns the first successful result (or raises the last
+    error); a late result from the other attempt is passed to discard().
+    on_hedge(won) reports whether a hedge was launched and produced the result.
+    """
+    results = queue.Queue()
+
+    def attempt(number):
+        try:
+            results.put((number, None, fn()))
+        except Exception as e:
+            results.put((number, e, None))
+
+    threading.Thread(target=attempt, args=(1,), daemon=True).start()
+    launched = 1
+    try:
+        number, error, value = results.get(timeout=hedge_after)
+    except queue.Empty:
+        threading.Thread(target=attempt, args=(2,), daemon=True).start()
+        launched = 2
+        number, error, value = results.get()
+    outstanding = launched - 1
+    if error is not None and outstanding:
+        number, error, value = results.get()
+        outstanding -= 1
+
+    if outstanding:
+        def discard_late():
+            _, late_error, late_value = results.get()
+            if late_error is None:
+                discard(late_value)
+        threading.Thread(target=discard_late, daemon=True).start()
+    if on_hedge and launched == 2:
+        on_hedge(number == 2 and error is None)
+    if error is not None:
+        raise error
+    return value
+
+
+class CircuitBreaker:
+    """
+    Closed: calls pass and outcomes are recorded over a sliding time window.
+    Opens when at least min_calls were made in the window and the failure ratio
+    reaches failure_ratio. Open: allow() is False until cooldown_seconds pass,
+    then one trial call is let through (half-open); its outcome closes or
+    re-opens the breaker.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_ratio=0.5, min_calls=10, window_seconds=60.0, cooldown_seconds=30.0):
+        self.failure_ratio = failure_ratio
+        self.min_calls = min_calls
+        self.window_seconds = window_seconds
+        self.cooldown_seconds = cooldown_seconds
+        self.state = self.CLOSED
+        self._events = deque()
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        self._trial_started = 0.0
+        self._lock = threading.Lock()
+        self._stats = {'opened': 0, 'rejected': 0}
+
+    def _prune(self, now):
+        while self._events and now - self._events[0][0] > self.window_seconds:
+            _, failed = self._events.popleft()
+            self._failures -= failed
+
+    def is_open(self):
+        """True while calls are being rejected (open and still cooling down)."""
+        with self._lock:
+            return self.state == self.OPEN and time.monotonic() - self._opened_at < self.cooldown_seconds
+
+    def allow(self):
+        """True if a call may go out now."""
+        with self._lock:
+            if self.state == self.OPEN and time.monotonic() - self._opened_at >= self.cooldown_seconds:
+                self.state = self.HALF_OPEN
+                self._trial_in_flight = False
+            if self.state == self.CLOSED:
+                return True
+            # A trial that never reported back doesn't block the breaker forever
+            if self.state == self.HALF_OPEN and (not self._trial_in_flight or
+                                                 time.monotonic() - self._trial_started >= self.cooldown_seconds):
+                self._trial_in_flight = True
+                self._trial_started = time.monotonic()
+                return True
+            self._stats['rejected'] += 1
+            return False
+
+    def record(self, ok):
+        """Record the outcome of one call."""
+        now = time.monotonic()
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                if ok:
+                    self.state = self.CLOSED
+                    self._events.clear()
+                    self._failures = 0
+                else:
+                    self._open(now)
+                return
+            if self.state == self.OPEN:
+                return
+            self._events.append((now, not ok))
+            self._failures += not ok
+            self._prune(now)
+            calls = len(self._events)
+            if calls >= self.min_calls and self._failures / calls >= self.failure_ratio:
+                self._open(now)
+
+    def _open(self, now):
+        self.state = self.OPEN
+        self._opened_at = now
+        self._trial_in_flight = False
+        self._stats['opened'] += 1
+
+    def stats(self):
+        with self._lock:
+            self._prune(time.monotonic())
+            calls = len(self._events)
+            return dict(self._stats, state=self.state, window_calls=calls,
+                        window_failure_ratio=round(self._failures / calls, 3) if calls else 0.0)
@@ -0,0 +1,432 @@
+"""
+Request/response transport shared by the conversion endpoints.
+
+Two transports are supported on the same route:
+- JSON: {"<field>": "<base64>"} in, {"success": true, "<field>": "<base64>"} out
+- Binary: raw document body (or multipart/form-data) in, raw document out
+
+The request transport is chosen by Content-Type, the response transport by Accept.
+No external dependencies — uses Python stdlib only.
+"""
+
+import base64
+import json
+from email.message import Message
+from http.client import HTTPException
+from urllib.parse import urlparse, parse_qsl
+from _auth import send_cors_headers
+from _metrics import timed
+
+PDF_MIME = 'application/pdf'
+DOCX_MIME = 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
+OCTET_STREAM = 'application/octet-stream'
+
+# Responses are written in slices so a large document never has to be copied
+# into the socket buffer in one piece.
+WRITE_CHUNK_BYTES = 256 * 1024
+# Raw bytes per slice when base64-encoding a stream; a multiple of 3
+BASE64_CHUNK_BYTES = WRITE_CHUNK_BYTES // 4 * 3
+# Streams of unknown length are buffered in memory up to this size, then on disk
+SPOOL_MEMORY_BYTES = 4 * 1024 * 1024
+
+# Response headers the browser is allowed to read
+EXPOSE_HEADERS = 'Content-Disposition, Content-Length, ETag, X-Cache, Location, X-Batch-Files, X-Engine, X-Engine-Reason, Retry-After, Server-Timing, X-Pages-Reused, X-Original-Size, X-Compressed-Size, X-Compression-Ratio, X-Preview-Pages, X-Total-Pages, X-Truncated'
+
+
+def _header_params(value):
+    """Parse a header like 'multipart/form-data; boundary=x' into (value, params)."""
+    msg = Message()
+    msg['content-type'] = value
+    params = msg.get_params() or []
+    main = params[0][0].lower() if params else ''
+    return main, {k.lower(): v for k, v in params[1:]}
+
+
+def _parse_multipart_parts(body, content_type):
+    """
+    Minimal multipart/form-data parser.
+    Returns (files, fields): files is a list of (filename, bytes) for every part
+    with a filename, in order; fields maps the other part names to their text.
+    """
+    _, params = _header_params(content_type)
+    boundary = params.get('boundary')
+    if not boundary:
+        raise ValueError('Missing multipart boundary')
+
+    delimiter = b'--' + boundary.encode('latin-1')
+    files = []
+    fields = {}
+
+    pos = body.find(delimiter)
+    while pos != -1:
+        start = pos + len(delimiter)
+        if body[start:start + 2] == b'--':
+            break
+        header_end = body.find(b'\r\n\r\n', start)
+        if header_end == -1:
+            break
+        part_end = body.find(b'\r\n' + delimiter, header_end + 4)
+        if part_end == -1:
+            break
+
+        disposition = ''
+        for line in body[start:header_end].decode('latin-1').split('\r\n'):
+            name, _, value = line.partition(':')
+            if name.strip().lower() == 'content-disposition':
+                disposition = value.strip()
+        _, disp_params = _header_params(disposition)
+
+        if 'filename' in disp_params:
+            files.append((disp_params['filename'], body[header_end + 4:part_end]))
+        elif 'name' in disp_params:
+            fields[disp_params['name']] = body[header_end + 4:part_end].decode('utf-8')
+
+        pos = part_end + 2
+
+    return files, fields
+
+
+def _parse_multipart(body, content_type):
+    """Returns (file_bytes, fields) where file_bytes is the first part with a filename."""
+    files, fields = _parse_multipart_parts(body, content_type)
+    if not files:
+        raise ValueError('No file part in multipart body')
+    return files[0][1], fields
+
+
+def is_json_request(handler):
+    """True when the request uses the JSON/base64 transport."""
+    content_type, _ = _header_params(handler.headers.get('Content-Type', ''))
+    return content_type in ('', 'application/json', 'text/plain')
+
+
+def read_document(handler, field):
+    """
+    Read the uploaded document from the request body.
+    Returns (document_bytes, params) or raises ValueError.
+
+    params holds the remaining JSON fields, multipart form fields or query
+    string parameters, so conversion options work with either transport.
+    """
+    content_length = int(handler.headers.get('Content-Length', 0))
+    with timed('read'):
+        body = handler.rfile.read(content_length)
+    content_type = handler.headers.get('Content-Type', '')
+    query = dict(parse_qsl(urlparse(handler.path).query))
+
+    with timed('decode'):
+        if is_json_request(handler):
+            request_data = json.loads(body)
+            del body
+            if field not in request_data:
+                raise ValueError(f'Missing {field} field')
+            encoded = request_data.pop(field)
+            if ',' in encoded[:100]:
+                # Tolerate data URLs as well as bare base64
+                encoded = encoded.split(',', 1)[1]
+            query.update(request_data)
+            return base64.b64decode(encoded), query
+
+        main_type, _ = _header_params(content_type)
+        if main_type == 'multipart/form-data':
+            document, fields = _parse_multipart(body, content_type)
+            query.update(fields)
+            return document, query
+
+        if not body:
+            raise ValueError('Empty request body')
+        return body, query
+
+
+def read_documents(handler, fields):
+    """
+    Read several uploaded documents from one request body.
+    Returns ([(filename, document_bytes), ...], params) or raises ValueError.
+
+    JSON bodies carry {"files": [{"filename": ..., "<field>": "<base64>"}, ...]}
+    plus options, where <field> is any of fields; multipart bodies carry one
+    part per file plus form fields.
+    """
+    content_length = int(handler.headers.get('Content-Length', 0))
+    with timed('read'):
+        body = handler.rfile.read(content_length)
+    content_type = handler.headers.get('Content-Type', '')
+    query = dict(parse_qsl(urlparse(handler.path).query))
+
+    with timed('decode'):
+        if is_json_request(handler):
+            request_data = json.loads(body)
+            del body
+            entries = request_data.pop('files', None)
+            if not isinstance(entries, list) or not entries:
+                raise ValueError('Missing files list')
+            documents = []
+            for i, entry in enumerate(entries):
+                encoded = next((entry[field] for field in fields if entry.get(field)), None) if isinstance(entry, dict) else None
+                if not encoded:
+                    raise ValueError(f'Missing {" or ".join(fields)} for file {i}')
+                if ',' in encoded[:100]:
+                    encoded = encoded.split(',', 1)[1]
+                documents.append((entry.get('filename') or f'document-{i + 1}', base64.b64decode(encoded)))
+            query.update(request_data)
+            return documents, query
+
+        main_type, _ = _header_params(content_type)
+        if main_type != 'multipart/form-data':
+            raise ValueError('Expected application/json or multipart/form-data')
+        documents, fields = _parse_multipart_parts(body, content_type)
+        if not documents:
+            raise ValueError('No file parts in multipart body')
+        query.update(fields)
+        return documents, query
+
+
+def _parse_accept(value):
+    """Parse an Accept header into {media_type: q}."""
+    prefs = {}
+    for item in value.split(','):
+        parts = item.strip().split(';')
+        media = parts[0].strip().lower()
+        if not media:
+            continue
+        q = 1.0
+        for param in parts[1:]:
+            key, _, val = param.strip().partition('=')
+            if key.strip() == 'q':
+                try:
+                    q = float(val)
+                except ValueError:
+                    q = 0.0
+        prefs[media] = q
+    return prefs
+
+
+def wants_binary(handler, mime):
+    """
+    True when the client's Accept header prefers the raw document over JSON.
+    A missing Accept header or */* keeps the JSON contract for existing callers.
+    """
+    prefs = _parse_accept(handler.headers.get('Accept', ''))
+    binary_q = max(prefs.get(mime, 0.0), prefs.get(OCTET_STREAM, 0.0))
+    json_q = prefs.get('application/json', 0.0)
+    return binary_q > 0 and binary_q >= json_q
+
+
+def base64_decoded_size(encoded, start=0):
+    """Decoded length of padded base64 text (from offset start) without decoding it."""
+    padding = 2 if encoded.endswith('==') else 1 if encoded.endswith('=') else 0
+    return (len(encoded) - start) // 4 * 3 - padding
+
+
+def iter_base64_decoded(encoded, start=0, chunk_size=WRITE_CHUNK_BYTES):
+    """Decode base64 text in slices, yielding about chunk_size bytes at a time."""
+    step = chunk_size // 3 * 4
+    for offset in range(start, len(encoded), step):
+        yield base64.b64decode(encoded[offset:offset + step])
+
+
+def write_chunked(wfile, data):
+    """Write a bytes-like object to the socket in slices without copying it."""
+    view = memoryview(data)
+    for offset in range(0, len(view), WRITE_CHUNK_BYTES):
+        wfile.write(view[offset:offset + WRITE_CHUNK_BYTES])
+
+
+def send_binary(handler, origin, data, mime, filename, extra_headers=None):
+    """Send a document as a raw binary response with Content-Length."""
+    handler.send_response(200)
+    handler.send_header('Content-Type', mime)
+    handler.send_header('Content-Length', str(len(data)))
+    handler.send_header('Content-Disposition', f'attachment; filename="{filename}"')
+    for name, value in (extra_headers or {}).items():
+        handler.send_header(name, value)
+    send_cors_headers(handler, origin)
+    handler.send_header('Access-Control-Expose-Headers', EXPOSE_HEADERS)
+    handler.end_headers()
+    write_chunked(handler.wfile, data)
+
+
+def send_json(handler, origin, response, status=200, extra_headers=None):
+    """Send a JSON response with Content-Length."""
+    payload = json.dumps(response).encode('utf-8')
+    handler.send_response(status)
+    handler.send_header('Content-Type', 'application/json')
+    handler.send_header('Content-Length', str(len(payload)))
+    for name, value in (extra_headers or {}).items():
+        handler.send_header(name, value)
+    send_cors_headers(handler, origin)
+    handler.send_header('Access-Control-Expose-Headers', EXPOSE_HEADERS)
+    handler.end_headers()
+    write_chunked(handler.wfile, payload)
+
+
+def etag_matches(handler, etag):
+    """True when the request's If-None-Match header lists etag (or '*')."""
+    header = handler.headers.get('If-None-Match', '')
+    if not header:
+        return False
+    candidates = [tag.strip() for tag in header.split(',')]
+    return '*' in candidates or etag in candidates or f'W/{etag}' in candidates
+
+
+def send_not_modified(handler, origin, etag):
+    """Send a 304 response for a matching If-None-Match."""
+    handler.send_response(304)
+    handler.send_header('ETag', etag)
+    send_cors_headers(handler, origin)
+    handler.send_header('Access-Control-Expose-Headers', EXPOSE_HEADERS)
+    handler.end_headers()
+
+
+def send_document(handler, origin, data, mime, filename, field, message, extra_headers=None, data_url=False,
+                  extra_fields=None):
+    """
+    Send a converted document using the transport negotiated via Accept:
+    raw bytes for binary clients, {"success", field, "message"} JSON otherwise.
+    With data_url the JSON field holds a data: URL (the iLovePDF proxy contract).
+    extra_fields are added to the JSON response only.
+    """
+    if wants_binary(handler, mime):
+        send_binary(handler, origin, data, mime, filename, extra_headers)
+        return
+
+    with timed('encode'):
+        encoded = base64.b64encode(data).decode('ascii')
+    response = {
+        'success': True,
+        field: f'data:{mime};base64,{encoded}' if data_url else encoded,
+        'message': message
+    }
+    response.update(extra_fields or {})
+    send_json(handler, origin, response, extra_headers=extra_headers)
+
+
+def _copy_stream(source, length, write, chunk_size):
+    """Pass exactly length bytes from source.read() to write() in chunk_size pieces."""
+    remaining = length
+    while remaining:
+        chunk = source.read(min(chunk_size, remaining))
+        if not chunk:
+            raise ConnectionError(f'Stream ended {remaining} bytes early')
+        remaining -= len(chunk)
+        write(chunk)
+
+
+def send_document_stream(handler, origin, stream, length, mime, filename, field, message=None, data_url=False,
+                         extra_headers=None):
+    """
+    Relay a document from a readable stream using the transport negotiated via
+    Accept, base64-encoding on the fly for JSON clients, so memory use is bounded
+    by the chunk size rather than the document size. A stream of unknown length
+    is spooled (to disk past SPOOL_MEMORY_BYTES) first to get a Content-Length.
+    """
+    if length is None:
+        import tempfile
+
+        spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MEMORY_BYTES)
+        for chunk in iter(lambda: stream.read(WRITE_CHUNK_BYTES), b''):
+            spool.write(chunk)
+        length = spool.tell()
+        spool.seek(0)
+        stream = spool
+
+    handler.send_response(200)
+    if wants_binary(handler, mime):
+        handler.send_header('Content-Type', mime)
+        handler.send_header('Content-Length', str(length))
+        handler.send_header('Content-Disposition', f'attachment; filename="{filename}"')
+        head = tail = b''
+    else:
+        # Same bytes json.dumps would produce for {"success", field[, "message"]}
+        head = ('{"success": true, ' + json.dumps(field) + ': "'
+                + (f'data:{mime};base64,' if data_url else '')).encode('ascii')
+        tail = ('"' + (', "message": ' + json.dumps(message) if message else '') + '}').encode('ascii')
+        handler.send_header('Content-Type', 'application/json')
+        handler.send_header('Content-Length', str(len(head) + (length + 2) // 3 * 4 + len(tail)))
+    for name, value in (extra_headers or {}).items():
+        handler.send_header(name, value)
+    send_cors_headers(handler, origin)
+    handler.send_header('Access-Control-Expose-Headers', EXPOSE_HEADERS)
+    handler.end_headers()
+
+    try:
+        if head:
+            handler.wfile.write(head)
+            # Multiples of 3 bytes encode without padding, so chunks concatenate
+            _copy_stream(stream, length, lambda chunk: handler.wfile.write(base64.b64encode(chunk)),
+                         BASE64_CHUNK_BYTES)
+            handler.wfile.write(tail)
+        else:
+            _copy_stream(stream, length, handler.wfile.write, WRITE_CHUNK_BYTES)
+    except (OSError, HTTPException) as e:
+        # The status line is already out; dropping the connection is the only
+        # way left to tell the client the body is incomplete.
+        handler.close_connection = True
+        handler.log_error('Document stream aborted: %r', e)
+
+
+class ChunkedWriter:
+    """
+    File-like writer sending HTTP/1.1 chunked transfer encoding. Small writes
+    are collected into chunks of up to WRITE_CHUNK_BYTES; flush() sends what
+    is buffered right away.
+    """
+
+    def __init__(self, wfile):
+        self._wfile = wfile
+        self._buffer = bytearray()
+
+    def write(self, data):
+        self._buffer += data
+        if len(self._buffer) >= WRITE_CHUNK_BYTES:
+            self.flush()
+        return len(data)
+
+    def flush(self):
+        if self._buffer:
+            self._wfile.write(b'%x\r\n' % len(self._buffer) + bytes(self._buffer) + b'\r\n')
+            self._buffer.clear()
+        self._wfile.flush()
+
+    def close(self):
+        self.flush()
+        self._wfile.write(b'0\r\n\r\n')
+        self._wfile.flush()
+
+
+class _UnframedWriter:
+    """HTTP/1.0 fallback: the body ends when the connection closes."""
+
+    def __init__(self, wfile):
+        self._wfile = wfile
+
+    def write(self, data):
+        self._wfile.write(data)
+        return len(data)
+
+    def flush(self):
+        self._wfile.flush()
+
+    def close(self):
+        self._wfile.flush()
+
+
+def start_stream(handler, origin, content_type, extra_headers=None):
+    """
+    Send 200 headers for a body of unknown length and return a file-like writer
+    for it. Call close() on the writer to finish the response.
+    """
+    handler.send_response(200)
+    handler.send_header('Content-Type', content_type)
+    for name, value in (extra_headers or {}).items():
+        handler.send_header(name, value)
+    send_cors_headers(handler, origin)
+    handler.send_header('Access-Control-Expose-Headers', EXPOSE_HEADERS)
+    if handler.request_version == 'HTTP/1.1':
+        handler.send_header('Transfer-Encoding', 'chunked')
+        handler.end_headers()
+        return ChunkedWriter(handler.wfile)
+    handler.send_header('Connection', 'close')
+    handler.close_connection = True
+    handler.end_headers()
+    return _UnframedWriter(handler.wfile)
@@ -0,0 +1,110 @@
+"""
+Batch Conversion API Endpoint
+Converts several documents in one request and streams the results back as a ZIP.
+
+POST /api/batch
+    JSON: {"direction": "pdf-to-docx" | "docx-to-pdf", "engine": "local" | "ilovepdf",
+           "public_key": "...", "files": [{"filename": "a.pdf", "pdf_base64": "..."}, ...]}
+    or multipart/form-data with one part per file plus direction/engine/public_key fields
+    (options may also be passed in the query string).
+
+The response is application/zip, written as files finish converting: one entry
+per converted file plus manifest.json with per-file status and errors.
+A local batch holds an admission slot per file in flight (503 with Retry-After
+when none is free), and files over the admission work limits fail individually.
+"""
+
+from http.server import BaseHTTPRequestHandler
+from _admission import AdmissionError, send_rejected
+from _auth import authenticate_request, check_payload_size, send_unauthorized, send_payload_too_large, get_cors_origin, send_cors_headers
+from _batch import (BATCH_MAX_FILES, DIRECTIONS, acquire_slots, convert_local, convert_ilovepdf, release_slots,
+                    unique_names, write_zip)
+from _metrics import instrumented, note_error
+from _transport import read_documents, send_json, start_stream
+
+ENGINES = ('local', 'ilovepdf')
+
+
+class handler(BaseHTTPRequestHandler):
+    @instrumented('batch')
+    def do_POST(self):
+        # Auth check
+        authed, result = authenticate_request(self)
+        if not authed:
+            send_unauthorized(self, result)
+            return
+
+        # Payload size check
+        size_ok, size_result = check_payload_size(self)
+        if not size_ok:
+            send_payload_too_large(self)
+            return
+
+        origin = get_cors_origin(self)
+
+        try:
+            documents, params = read_documents(self, ('pdf_base64', 'docx_base64'))
+        except ValueError as e:
+            send_json(self, origin, {'success': False, 'error': str(e)}, status=400)
+            return
+
+        direction = params.get('direction', 'pdf-to-docx')
+        if direction not in DIRECTIONS:
+            send_json(self, origin, {'success': False, 'error': f'Unknown direction: {direction}'}, status=400)
+            return
+
+        engine = params.get('engine', 'local')
+        if engine not in ENGINES:
+            send_json(self, origin, {'success': False, 'error': f'Unknown engine: {engine}'}, status=400)
+            return
+        if len(documents) > BATCH_MAX_FILES:
+            send_json(self, origin, {'success': False, 'error': f'Too many files (max {BATCH_MAX_FILES})'}, status=400)
+            return
+        public_key = params.get('public_key')
+        if engine == 'ilovepdf' and not public_key:
+            send_json(self, origin, {'success': False, 'error': 'Missing public_key'}, status=400)
+            return
+
+        slots = 0
+        if engine == 'local':
+            try:
+                slots = acquire_slots()
+            except AdmissionError as e:
+                note_error(e)
+                send_rejected(self, origin, e)
+                return
+        try:
+            self._send_batch(origin, direction, engine, public_key, documents, slots)
+        finally:
+            release_slots(slots)
+
+    def _send_batch(self, origin, direction, engine, public_key, documents, slots):
+        input_ext, output_ext = DIRECTIONS[direction]
+        output_names = unique_names([filename for filename, _ in documents], output_ext)
+        if engine == 'ilovepdf':
+            # iLovePDF names its outputs after the inputs, so those must be unique too
+            upstream_names = unique_names([filename for filename, _ in documents], input_ext)
+            results = convert_ilovepdf(direction, [(name, data) for name, (_, data) in zip(upstream_names, documents)], public_key)
+        else:
+            results = convert_local(direction, documents, slots)
+
+        writer = start_stream(self, origin, 'application/zip', {
+            'Content-Disposition': 'attachment; filename="converted.zip"',
+            'X-Batch-Files': str(len(documents)),
+        })
+        try:
+            write_zip(writer, documents, output_names, results)
+            writer.close()
+        except Exception as e:
+            # Headers are already sent; a dropped connection marks the archive incomplete
+            self.close_connection = True
+            self.log_error('Batch stream aborted: %r', e)
+
+    def do_OPTIONS(self):
+        origin = get_cors_origin(self)
+        self.send_response(200)
+        send_cors_headers(self, origin)
+        self.send_header('Access-Control-Allow-Methods', 'POST, OPTIONS')
+        self.send_header('Access-Control-Allow-Headers', 'Content-Type, Authorization')
+        self.send_header('Content-Length', '0')
+        self.end_headers()
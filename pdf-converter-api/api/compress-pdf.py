@@ -0,0 +1,142 @@
+"""
+PDF Compression API Endpoint
+Shrinks a PDF by downsampling its images to a target resolution, recompressing
+them on a thread pool and merging duplicate images (see api/_pdf_compress.py).
+
+POST /api/compress-pdf
+    JSON {"pdf_base64": ..., "level": "light" | "balanced" | "aggressive",
+          "dpi": 150, "quality": 75} (dpi and quality override the level),
+    or a raw application/pdf (or multipart) body with the options in the query string.
+
+Returns JSON or the raw PDF depending on the Accept header. The JSON response
+carries a "compression" report (sizes, ratio = compressed / original, image
+counts); binary responses carry X-Original-Size, X-Compressed-Size and
+X-Compression-Ratio. Stage timings are in Server-Timing. Results are cached
+per input and options (see api/_cache.py). Compression passes admission
+control (see api/_admission.py): 413 when the document is over the work limits,
+503 with Retry-After when every slot is busy.
+"""
+
+from http.server import BaseHTTPRequestHandler
+import importlib
+from _admission import AdmissionError, admission, send_rejected
+from _auth import authenticate_request, check_payload_size, send_unauthorized, send_payload_too_large, get_cors_origin, send_cors_headers, jwt_cache_stats
+from _cache import conversion_cache
+from _metrics import instrumented, note_error, note_pages, timed
+from _pdf_compress import LEVELS, compress_pdf, resolve_options
+from _transport import PDF_MIME, read_document, send_document, send_json, etag_matches, send_not_modified
+
+
+def warm_up():
+    """Import PyPDF2 and Pillow ahead of the first request."""
+    for name in ('PyPDF2', 'PIL.Image', 'PIL.JpegImagePlugin', 'PIL.PngImagePlugin'):
+        importlib.import_module(name)
+
+
+def _compress(pdf_bytes, dpi, quality, cache_key):
+    """Compress through admission control (or serve from the cache); returns (buffer, report, cache status)."""
+    with timed('cache'):
+        cached = conversion_cache.get(cache_key)
+    if cached is not None:
+        return cached[0], cached[1], 'HIT'
+
+    def convert(data, progress):
+        return compress_pdf(data, dpi, quality, progress)
+
+    buffer, report = admission.run('compress-pdf', pdf_bytes, convert, prepare=warm_up)
+    with timed('cache'):
+        conversion_cache.put(cache_key, buffer, report)
+    return buffer, report, 'MISS'
+
+
+def _success_message(report):
+    saved = report['original_bytes'] - report['compressed_bytes']
+    if saved <= 0:
+        return 'PDF is already compact; returned unchanged'
+    return f'PDF compressed by {saved * 100 / report["original_bytes"]:.0f}% ({report["original_bytes"]} -> {report["compressed_bytes"]} bytes)'
+
+
+class handler(BaseHTTPRequestHandler):
+    @instrumented('compress-pdf')
+    def do_POST(self):
+        # Auth check
+        authed, result = authenticate_request(self)
+        if not authed:
+            send_unauthorized(self, result)
+            return
+
+        # Payload size check
+        size_ok, size_result = check_payload_size(self)
+        if not size_ok:
+            send_payload_too_large(self)
+            return
+
+        origin = get_cors_origin(self)
+
+        try:
+            # Read request body (JSON/base64, raw PDF or multipart) and options
+            try:
+                pdf_bytes, params = read_document(self, 'pdf_base64')
+                dpi, quality = resolve_options(params)
+            except ValueError as e:
+                send_json(self, origin, {'success': False, 'error': str(e)}, status=400)
+                return
+
+            # Content-addressed cache lookup (input hash + options)
+            cache_key = conversion_cache.key('compress-pdf', pdf_bytes, {'dpi': dpi, 'quality': quality})
+            etag = f'"{cache_key}"'
+            if etag_matches(self, etag):
+                send_not_modified(self, origin, etag)
+                return
+
+            buffer, report, cache_status = _compress(pdf_bytes, dpi, quality, cache_key)
+            del pdf_bytes
+            note_pages(report['page_count'])
+
+            send_document(
+                self, origin, buffer, PDF_MIME, 'compressed.pdf', 'pdf_base64', _success_message(report),
+                extra_headers={
+                    'ETag': etag,
+                    'X-Cache': cache_status,
+                    'X-Original-Size': str(report['original_bytes']),
+                    'X-Compressed-Size': str(report['compressed_bytes']),
+                    'X-Compression-Ratio': str(report['ratio']),
+                },
+                extra_fields={'compression': report},
+            )
+
+        except AdmissionError as e:
+            # Over the work limits (413) or no conversion slot free (503 + Retry-After)
+            note_error(e)
+            send_rejected(self, origin, e)
+
+        except Exception as e:
+            note_error(e)
+            send_json(self, origin, {
+                'success': False,
+                'error': str(e),
+                'message': 'Failed to compress PDF'
+            }, status=500)
+
+    @instrumented('compress-pdf')
+    def do_GET(self):
+        # Compression levels, admission counters and the verified-token cache counters
+        authed, result = authenticate_request(self)
+        if not authed:
+            send_unauthorized(self, result)
+            return
+        send_json(self, get_cors_origin(self), {
+            'success': True,
+            'levels': {name: {'dpi': dpi, 'quality': quality} for name, (dpi, quality) in LEVELS.items()},
+            'admission': admission.stats(),
+            'jwt_cache': jwt_cache_stats(),
+        })
+
+    def do_OPTIONS(self):
+        origin = get_cors_origin(self)
+        self.send_response(200)
+        send_cors_headers(self, origin)
+        self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
+        self.send_header('Access-Control-Allow-Headers', 'Content-Type, Authorization, Accept, If-None-Match')
+        self.send_header('Content-Length', '0')
+        self.end_headers()
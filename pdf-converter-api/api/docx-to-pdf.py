@@ -1,22 +1,329 @@
 """
 DOCX to PDF Conversion API Endpoint
 Converts DOCX files to PDF format using python-docx and reportlab
+
+Accepts either JSON {"docx_base64": ...} or a raw DOCX (or multipart) body,
+and returns JSON or the raw PDF depending on the Accept header.
+With `Prefer: respond-async` it returns 202 and a job id instead (see api/jobs.py).
+The engine option (auto, local or ilovepdf) picks the converter; auto routes each
+document between the local converter and iLovePDF (see api/_engines.py).
+Local conversions pass admission control (see api/_admission.py): 413 when the
+document is over the work limits, 503 with Retry-After when every slot is busy.
+The reader option (stream or python-docx) picks how the local converter reads
+the DOCX; stream is the low-memory reader in api/_docx_reader.py.
+Inline pictures are pre-scaled to the size they are placed at, through a
+per-process image cache (see api/_docx_images.py). Text the built-in fonts
+can't draw uses the registered TrueType fonts (see api/_fonts.py).
+With `max_pages` (or `pages` from 1) only the first pages are laid out, as a
+preview (see api/_preview.py); layout stops when the last one is full.
 """
 
 from http.server import BaseHTTPRequestHandler
-import json
-import base64
+import importlib
 import io
-from docx import Document
-from reportlab.lib.pagesizes import letter
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.lib.units import inch
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
-from reportlab.lib import colors
-from _auth import authenticate_request, check_payload_size, send_unauthorized, send_payload_too_large, get_cors_origin, send_cors_headers
+import sys
+import zipfile
+import threading
+from _admission import AdmissionError, admission, register_worker_state, send_rejected
+from _auth import authenticate_request, check_payload_size, send_unauthorized, send_payload_too_large, get_cors_origin, send_cors_headers, jwt_cache_stats
+from _cache import conversion_cache
+from _docx_images import image_cache, scaled_image
+from _docx_reader import (DOCX_READER, DOCX_READERS, UnsupportedDocx, iter_docx_blocks, paragraph_fonts,
+                          paragraph_pictures, saved_page_count)
+from _engines import DEFAULT_ENGINE, ENGINES, ConversionJob, register_local, router
+from _fonts import font_registry
+from _metrics import instrumented, note_error, note_pages, timed, timed_iter
+from _jobs import wants_async, submit_job, send_job_accepted
+from _preview import preview_details, preview_engine, preview_headers, read_preview
+from _transport import PDF_MIME, read_document, send_document, send_json, etag_matches, send_not_modified
+
+
+# python-docx and reportlab are imported on first conversion rather than at module
+# load, so CORS preflights and rejected requests never pay for them on a cold start.
+_shared_styles = None
+_shared_styles_lock = threading.Lock()
+
+
+def _get_shared_styles():
+    """
+    Return (styles, table_style, paragraph_gap, table_gap), built once per
+    process and shared read-only; the gaps are Spacers reused for every block.
+    """
+    global _shared_styles
+    if _shared_styles is None:
+        with _shared_styles_lock:
+            if _shared_styles is None:
+                from reportlab.lib import colors
+                from reportlab.lib.styles import getSampleStyleSheet
+                from reportlab.lib.units import inch
+                from reportlab.platypus import Spacer, TableStyle
+
+                class SharedSpacer(Spacer):
+                    # platypus marks a flowable that didn't fit at the bottom of a frame
+                    # as postponed and fails if it doesn't fit a second time, which one
+                    # instance placed many times would trip over. A spacer always fits
+                    # an empty frame, so the mark is not needed.
+                    def __setattr__(self, name, value):
+                        if name != '_postponed':
+                            super().__setattr__(name, value)
+
+                table_style = TableStyle([
+                    ('GRID', (0, 0), (-1, -1), 0.5, colors.grey),
+                    ('BACKGROUND', (0, 0), (-1, 0), colors.lightgrey),
+                    ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+                    ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+                    ('FONTSIZE', (0, 0), (-1, -1), 10),
+                    ('BOTTOMPADDING', (0, 0), (-1, -1), 6),
+                    ('TOPPADDING', (0, 0), (-1, -1), 6),
+                ])
+                _shared_styles = (getSampleStyleSheet(), table_style,
+                                  SharedSpacer(1, 0.1*inch), SharedSpacer(1, 0.2*inch))
+    return _shared_styles
+
+
+def warm_up():
+    """Import heavy modules, build the shared styles and load the fonts ahead of the first request."""
+    for name in ('docx', 'reportlab.platypus', 'PIL.Image'):
+        importlib.import_module(name)
+    _get_shared_styles()
+    font_registry.load()
+
+
+class _LazyStory:
+    """
+    The list operations platypus' build() performs on its story (len, indexing,
+    slicing, del, insert), served from an iterator of flowables that is read a
+    few items ahead, so the whole document never exists as one flowable list.
+    close() ends the story early; cut then tells whether anything was left.
+    """
+
+    # Read-ahead for len(); keepWithNext chains (a heading and its spacer) must fit
+    LOOKAHEAD = 16
+
+    def __init__(self, flowables):
+        self._source = iter(flowables)
+        self._buffer = []
+        self._exhausted = False
+        self._closed = False
+        self.cut = False
+
+    def close(self):
+        """Drop the rest of the story, so build() finishes after the current page."""
+        if not self._buffer and not self._exhausted:
+            self._fill(1)
+        self.cut = self.cut or bool(self._buffer)
+        self._buffer = []
+        self._exhausted = self._closed = True
+
+    def _fill(self, count):
+        while len(self._buffer) < count and not self._exhausted:
+            try:
+                self._buffer.append(next(self._source))
+            except StopIteration:
+                self._exhausted = True
+
+    def _fill_for(self, index):
+        stop = index.stop if isinstance(index, slice) else (index + 1 if index >= 0 else None)
+        self._fill(sys.maxsize if stop is None or stop < 0 else stop)
+
+    def __len__(self):
+        self._fill(self.LOOKAHEAD)
+        return len(self._buffer)
+
+    def __getitem__(self, index):
+        self._fill_for(index)
+        return self._buffer[index]
+
+    def __setitem__(self, index, value):
+        self._fill_for(index)
+        self._buffer[index] = value
+
+    def __delitem__(self, index):
+        self._fill_for(index)
+        del self._buffer[index]
+
+    def insert(self, index, value):
+        if self._closed:
+            # A flowable that didn't fit on the last page
+            self.cut = True
+            return
+        self._buffer.insert(index, value)
+
+
+def _iter_blocks(doc):
+    """
+    Walk the document body once, in order, yielding
+    ('paragraph', text, style_name, fonts), ('table', rows) and, after the
+    paragraph holding it, ('image', data, width, height) per picture.
+    """
+    from docx.table import Table as DocxTable
+
+    related = doc.part.related_parts
+    for item in doc.iter_inner_content():
+        if isinstance(item, DocxTable):
+            yield 'table', [[cell.text for cell in row.cells] for row in item.rows]
+        else:
+            yield 'paragraph', item.text, item.style.name, paragraph_fonts(item._p)
+            for rel_id, width, height in paragraph_pictures(item._p):
+                try:
+                    data = related[rel_id].blob
+                except KeyError:
+                    continue
+                yield 'image', data, width, height
+
+
+def _fit(width, height, max_width, max_height):
+    """A picture's size, scaled down (keeping its aspect ratio) to fit max_width x max_height."""
+    scale = min(1.0, max_width / width, max_height / height)
+    return width * scale, height * scale
+
+
+def _iter_flowables(blocks, max_width, max_height):
+    """Turn body blocks into flowables as they are read; pictures are fitted to max_width x max_height."""
+    from reportlab.platypus import Image, Paragraph, Table
+
+    styles, table_style, paragraph_gap, table_gap = _get_shared_styles()
+    font_registry.load()
+    heading_style = styles['Heading1']
+    normal_style = styles['Normal']
+
+    for block in blocks:
+        if block[0] == 'paragraph':
+            _, text, style_name, fonts = block
+            if text.strip():
+                # Determine style based on paragraph formatting
+                heading = style_name.startswith('Heading')
+                markup = font_registry.markup(text, fonts, bold=heading)
+                yield Paragraph(text if markup is None else markup, heading_style if heading else normal_style)
+                yield paragraph_gap
+        elif block[0] == 'image':
+            _, data, width, height = block
+            if width <= 0 or height <= 0:
+                continue
+            width, height = _fit(width, height, max_width, max_height)
+            with timed('images'):
+                data = scaled_image(data, width, height)
+            if data is not None:
+                yield Image(io.BytesIO(data), width, height)
+                yield paragraph_gap
+        else:
+            table_data = block[1]
+            if table_data:
+                t = Table(table_data)
+                t.setStyle(table_style)
+                # Cells the built-in font can't draw get a registered font
+                cell_fonts = [('FONTNAME', (column, row), (column, row), font)
+                              for row, cells in enumerate(table_data)
+                              for column, font in enumerate(map(font_registry.font_for, cells)) if font]
+                if cell_fonts:
+                    t.setStyle(cell_fonts)
+                yield t
+                yield table_gap
+
+
+def convert_docx_to_pdf(docx_bytes, progress=None, reader=None, preview=None):
+    """
+    Convert DOCX bytes to PDF.
+    Returns (pdf_buffer, page_count); pdf_buffer is a bytes-like view.
+    progress(pages_done, None) is called as pages are laid out.
+    reader is 'stream' or 'python-docx' (default DOCX_READER); documents the
+    streaming reader doesn't cover are converted again with python-docx.
+    preview (1, last) lays out only the first `last` pages and returns
+    (pdf_buffer, page_count, details) with preview_details (api/_preview.py).
+    """
+    max_pages = preview[1] if preview is not None else None
+    rendered = None
+    if (reader or DOCX_READER) == 'stream':
+        try:
+            rendered = _render(iter_docx_blocks(docx_bytes), progress, max_pages)
+        except UnsupportedDocx as e:
+            print(f'Streaming DOCX reader fell back to python-docx: {e}')
+
+    if rendered is None:
+        from docx import Document
+
+        # Parse DOCX (BytesIO shares the bytes buffer, no copy)
+        with timed('docx_parse'):
+            doc = Document(io.BytesIO(docx_bytes))
+        rendered = _render(_iter_blocks(doc), progress, max_pages)
+
+    pdf_buffer, page_count, cut = rendered
+    if preview is None:
+        return pdf_buffer, page_count
+    total_pages = page_count
+    if cut:
+        # The rest isn't laid out: only Word's own count (if saved, and plausible) is known
+        try:
+            with zipfile.ZipFile(io.BytesIO(docx_bytes)) as archive:
+                saved = saved_page_count(archive)
+        except zipfile.BadZipFile:
+            saved = None
+        total_pages = saved if saved is not None and saved > page_count else None
+    return pdf_buffer, page_count, preview_details(1, page_count, total_pages, cut)
+
+
+def _render(blocks, progress, max_pages=None):
+    """
+    Lay out body blocks into a PDF, stopping after max_pages pages if set.
+    Returns (pdf_buffer, page_count, cut); cut tells whether content was left out.
+    """
+    from reportlab.lib.pagesizes import letter
+    from reportlab.lib.units import inch
+    from reportlab.platypus import SimpleDocTemplate
+
+    pdf_stream = io.BytesIO()
+
+    # Create PDF
+    pdf_doc = SimpleDocTemplate(
+        pdf_stream,
+        pagesize=letter,
+        rightMargin=0.75*inch,
+        leftMargin=0.75*inch,
+        topMargin=0.75*inch,
+        bottomMargin=0.75*inch
+    )
+
+    # Build PDF (the page callbacks report layout progress; total is unknown upfront).
+    # Paragraphs and tables are laid out in document order as the body is walked.
+    def on_page(canvas, document):
+        if progress:
+            progress(document.page, None)
+
+    # Reading the DOCX and pre-scaling pictures happen inside the layout loop;
+    # docx_read and images are subtracted from layout
+    frame_padding = 2 * 6
+    flowables = _iter_flowables(timed_iter('docx_read', blocks),
+                                pdf_doc.width - frame_padding, pdf_doc.height - frame_padding)
+    story = _LazyStory(flowables)
+    if max_pages:
+        # Ending the story once the last page is full stops reading and layout there
+        def after_page():
+            if pdf_doc.page >= max_pages:
+                story.close()
+
+        pdf_doc.afterPage = after_page
+    with timed('layout'):
+        pdf_doc.build(story, onFirstPage=on_page, onLaterPages=on_page)
+
+    return pdf_stream.getbuffer(), pdf_doc.page, story.cut
+
+
+def _success_message(preview=None):
+    if preview is not None and preview['truncated']:
+        pages = f'pages {preview["pages"]}' if preview['pages'] is not None else 'no pages'
+        total = f' of {preview["total_pages"]}' if preview['total_pages'] is not None else ''
+        return f'DOCX preview converted to PDF ({pages}{total})'
+    return 'DOCX successfully converted to PDF'
+
+
+register_local('docx-to-pdf', convert_docx_to_pdf, warm_up, keeps_images=True)
+# Pictures pre-scaled and font subsets made in an isolated worker stay cached in the parent
+register_worker_state('image_cache', image_cache.changes_since_fork, image_cache.merge)
+register_worker_state('font_subsets', font_registry.changes_since_fork, font_registry.merge)
 
 
 class handler(BaseHTTPRequestHandler):
+    @instrumented('docx-to-pdf')
     def do_POST(self):
         # Auth check
         authed, result = authenticate_request(self)
@@ -33,119 +340,116 @@ class handler(BaseHTTPRequestHandler):
         origin = get_cors_origin(self)
 
         try:
-            # Read request body
-            content_length = int(self.headers['Content-Length'])
-            post_data = self.rfile.read(content_length)
+            # Read request body (JSON/base64, raw DOCX or multipart)
+            try:
+                docx_bytes, params = read_document(self, 'docx_base64')
+            except ValueError as e:
+                send_json(self, origin, {'success': False, 'error': str(e)}, status=400)
+                return
 
-            # Parse JSON request
-            request_data = json.loads(post_data.decode('utf-8'))
+            # Converter engine: auto routes between local and iLovePDF per document
+            engine = params.get('engine', DEFAULT_ENGINE)
+            if engine not in ENGINES:
+                send_json(self, origin, {'success': False, 'error': f'Unknown engine: {engine}'}, status=400)
+                return
+            # Preview: the first pages only, converted locally
+            try:
+                preview = read_preview(params, from_start=True)
+                if preview is not None:
+                    engine = preview_engine(engine)
+            except ValueError as e:
+                send_json(self, origin, {'success': False, 'error': str(e)}, status=400)
+                return
+            options = {'preview': preview} if preview is not None else {}
 
-            # Extract base64 DOCX data
-            if 'docx_base64' not in request_data:
-                self.send_error(400, 'Missing docx_base64 field')
+            # Content-addressed cache lookup (input hash + options). The cache holds
+            # local results, so iLovePDF's are keyed (and tagged) apart from them
+            key_options = dict(options, engine=engine) if engine == 'ilovepdf' else options
+            cache_key = conversion_cache.key('docx-to-pdf', docx_bytes, key_options)
+            etag = f'"{cache_key}"'
+            if etag_matches(self, etag):
+                send_not_modified(self, origin, etag)
+                return
+            # DOCX reader for the local converter (the output is the same either way)
+            reader = params.get('reader', DOCX_READER)
+            if reader not in DOCX_READERS:
+                send_json(self, origin, {'success': False, 'error': f'Unknown reader: {reader}'}, status=400)
+                return
+            conversion = ConversionJob('docx-to-pdf', docx_bytes, cache_key, params.get('public_key'),
+                                       options=dict(options, reader=reader))
+            if engine == 'ilovepdf' and not conversion.public_key:
+                send_json(self, origin, {'success': False, 'error': 'Missing public_key'}, status=400)
                 return
 
-            docx_base64 = request_data['docx_base64']
+            # Async mode: queue the conversion and return a job id right away
+            if wants_async(self, params):
+                def run_job(progress):
+                    pdf_buffer, page_count, decision = router.convert(conversion, engine, progress)
+                    meta = {'page_count': page_count, 'message': _success_message(decision.get('preview'))}
+                    if 'preview' in decision:
+                        meta['preview'] = decision['preview']
+                    return pdf_buffer, meta
 
-            # Decode base64 to bytes
-            docx_bytes = base64.b64decode(docx_base64)
+                job = submit_job('docx-to-pdf', result.get('sub'), run_job, PDF_MIME, 'document.pdf', 'pdf_base64')
+                send_job_accepted(self, origin, job)
+                return
 
-            # Create in-memory file objects
-            docx_stream = io.BytesIO(docx_bytes)
-            pdf_stream = io.BytesIO()
+            pdf_buffer, page_count, decision = router.convert(conversion, engine)
+            # Let the input go before the response is sent
+            del docx_bytes
+            conversion.data = None
+            note_pages(page_count)
 
-            # Parse DOCX
-            doc = Document(docx_stream)
+            headers = {'ETag': etag, 'X-Cache': decision['cache'], 'X-Engine': decision['engine'],
+                       'X-Engine-Reason': decision['reason']}
+            preview = decision.get('preview')
+            headers.update(preview_headers(preview))
 
-            # Create PDF
-            pdf_doc = SimpleDocTemplate(
-                pdf_stream,
-                pagesize=letter,
-                rightMargin=0.75*inch,
-                leftMargin=0.75*inch,
-                topMargin=0.75*inch,
-                bottomMargin=0.75*inch
+            # Send response (binary or JSON depending on Accept)
+            send_document(
+                self, origin, pdf_buffer, PDF_MIME, 'document.pdf', 'pdf_base64',
+                _success_message(preview), extra_headers=headers,
+                extra_fields={'preview': preview} if preview is not None else None
             )
 
-            # Build content
-            styles = getSampleStyleSheet()
-            story = []
-
-            # Process paragraphs
-            for para in doc.paragraphs:
-                if para.text.strip():
-                    # Determine style based on paragraph formatting
-                    if para.style.name.startswith('Heading'):
-                        style = styles['Heading1']
-                    else:
-                        style = styles['Normal']
-
-                    # Create paragraph
-                    p = Paragraph(para.text, style)
-                    story.append(p)
-                    story.append(Spacer(1, 0.1*inch))
-
-            # Process tables
-            for table in doc.tables:
-                table_data = []
-                for row in table.rows:
-                    row_data = [cell.text for cell in row.cells]
-                    table_data.append(row_data)
-
-                if table_data:
-                    t = Table(table_data)
-                    t.setStyle(TableStyle([
-                        ('GRID', (0, 0), (-1, -1), 0.5, colors.grey),
-                        ('BACKGROUND', (0, 0), (-1, 0), colors.lightgrey),
-                        ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-                        ('VALIGN', (0, 0), (-1, -1), 'TOP'),
-                        ('FONTSIZE', (0, 0), (-1, -1), 10),
-                        ('BOTTOMPADDING', (0, 0), (-1, -1), 6),
-                        ('TOPPADDING', (0, 0), (-1, -1), 6),
-                    ]))
-                    story.append(t)
-                    story.append(Spacer(1, 0.2*inch))
-
-            # Build PDF
-            pdf_doc.build(story)
-
-            # Get PDF bytes and encode to base64
-            pdf_stream.seek(0)
-            pdf_bytes = pdf_stream.read()
-            pdf_base64 = base64.b64encode(pdf_bytes).decode('utf-8')
-
-            # Send response
-            self.send_response(200)
-            self.send_header('Content-Type', 'application/json')
-            send_cors_headers(self, origin)
-            self.end_headers()
-
-            response = {
-                'success': True,
-                'pdf_base64': pdf_base64,
-                'message': 'DOCX successfully converted to PDF'
-            }
-
-            self.wfile.write(json.dumps(response).encode('utf-8'))
+        except AdmissionError as e:
+            # Over the work limits (413) or no conversion slot free (503 + Retry-After)
+            note_error(e)
+            send_rejected(self, origin, e)
 
         except Exception as e:
-            self.send_response(500)
-            self.send_header('Content-Type', 'application/json')
-            send_cors_headers(self, origin)
-            self.end_headers()
-
-            error_response = {
+            note_error(e)
+            send_json(self, origin, {
                 'success': False,
                 'error': str(e),
                 'message': 'Failed to convert DOCX to PDF'
-            }
+            }, status=500)
 
-            self.wfile.write(json.dumps(error_response).encode('utf-8'))
+    @instrumented('docx-to-pdf')
+    def do_GET(self):
+        # Cache statistics (hit/miss/eviction counters) for sizing the result,
+        # image and font subset caches, engine routing decisions with
+        # per-engine latency histograms, admission counters (slots, queue,
+        # rejections) and the verified-token cache counters
+        authed, result = authenticate_request(self)
+        if not authed:
+            send_unauthorized(self, result)
+            return
+        send_json(self, get_cors_origin(self), {
+            'success': True,
+            'cache': conversion_cache.stats(),
+            'image_cache': image_cache.stats(),
+            'fonts': font_registry.stats(),
+            'engines': router.report(),
+            'admission': admission.stats(),
+            'jwt_cache': jwt_cache_stats(),
+        })
 
     def do_OPTIONS(self):
         origin = get_cors_origin(self)
         self.send_response(200)
         send_cors_headers(self, origin)
-        self.send_header('Access-Control-Allow-Methods', 'POST, OPTIONS')
-        self.send_header('Access-Control-Allow-Headers', 'Content-Type, Authorization')
+        self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
+        self.send_header('Access-Control-Allow-Headers', 'Content-Type, Authorization, Accept, If-None-Match, Prefer')
+        self.send_header('Content-Length', '0')
         self.end_headers()
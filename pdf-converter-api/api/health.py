@@ -19,22 +19,28 @@ def _get_cors_origin(handler):
 class handler(BaseHTTPRequestHandler):
     def do_GET(self):
         origin = _get_cors_origin(self)
-        self.send_response(200)
-        self.send_header('Content-Type', 'application/json')
-        self.send_header('Access-Control-Allow-Origin', origin)
-        self.end_headers()
-
         response = {
             'status': 'healthy',
             'service': 'PDF Converter API',
             'endpoints': [
                 '/api/pdf-to-docx',
+                '/api/pdf-pages',
                 '/api/docx-to-pdf',
+                '/api/compress-pdf',
+                '/api/batch',
+                '/api/jobs',
+                '/api/metrics',
                 '/api/health'
             ]
         }
 
-        self.wfile.write(json.dumps(response).encode('utf-8'))
+        body = json.dumps(response).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Access-Control-Allow-Origin', origin)
+        self.end_headers()
+        self.wfile.write(body)
 
     def do_OPTIONS(self):
         origin = _get_cors_origin(self)
@@ -42,4 +48,5 @@ class handler(BaseHTTPRequestHandler):
         self.send_header('Access-Control-Allow-Origin', origin)
         self.send_header('Access-Control-Allow-Methods', 'GET, OPTIONS')
         self.send_header('Access-Control-Allow-Headers', 'Content-Type, Authorization')
+        self.send_header('Content-Length', '0')
         self.end_headers()
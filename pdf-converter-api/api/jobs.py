@@ -0,0 +1,94 @@
+"""
+Conversion Job Status API Endpoint
+Poll an async conversion job and fetch its result once it is done.
+
+GET /api/jobs?id=<job_id>            -> status and progress (pages done / total)
+GET /api/jobs?id=<job_id>&result=1   -> converted document (JSON or binary via Accept)
+DELETE /api/jobs?id=<job_id>         -> discard the job and its result
+"""
+
+from http.server import BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qsl
+from _auth import authenticate_request, send_unauthorized, get_cors_origin, send_cors_headers
+from _jobs import get_job_store, job_status, STATUS_DONE, STATUS_ERROR
+from _metrics import instrumented
+from _preview import preview_headers
+from _transport import send_document, send_json
+
+
+class handler(BaseHTTPRequestHandler):
+    def _load_job(self):
+        """Authenticate and look up the job; sends the error response and returns None on failure."""
+        authed, result = authenticate_request(self)
+        if not authed:
+            send_unauthorized(self, result)
+            return None, None
+
+        origin = get_cors_origin(self)
+        params = dict(parse_qsl(urlparse(self.path).query))
+        job_id = params.get('id')
+        if not job_id:
+            send_json(self, origin, {'success': False, 'error': 'Missing id parameter'}, status=400)
+            return None, None
+
+        store = get_job_store()
+        store.purge_expired()
+        job = store.get(job_id)
+        # Jobs are only visible to the user who submitted them
+        if job is None or job['owner'] != result.get('sub'):
+            send_json(self, origin, {'success': False, 'error': 'Job not found or expired'}, status=404)
+            return None, None
+
+        return job, params
+
+    @instrumented('jobs')
+    def do_GET(self):
+        job, params = self._load_job()
+        if job is None:
+            return
+
+        origin = get_cors_origin(self)
+        if not params.get('result'):
+            response = job_status(job)
+            response['success'] = job['status'] != STATUS_ERROR
+            send_json(self, origin, response)
+            return
+
+        if job['status'] != STATUS_DONE:
+            response = job_status(job)
+            response['success'] = False
+            response['error'] = job['error'] or f'Job is {job["status"]}'
+            send_json(self, origin, response, status=500 if job['status'] == STATUS_ERROR else 409)
+            return
+
+        stored = get_job_store().get_result(job['id'])
+        if stored is None:
+            send_json(self, origin, {'success': False, 'error': 'Job result expired'}, status=404)
+            return
+
+        data, meta = stored
+        # Previews are flagged as in the synchronous response
+        preview = meta.get('preview')
+        send_document(
+            self, origin, data, meta['mime'], meta['filename'], meta['field'],
+            meta.get('message', 'Conversion complete'), data_url=meta.get('data_url', False),
+            extra_headers=preview_headers(preview) or None,
+            extra_fields={'preview': preview} if preview is not None else None
+        )
+
+    @instrumented('jobs')
+    def do_DELETE(self):
+        job, _ = self._load_job()
+        if job is None:
+            return
+        get_job_store().delete(job['id'])
+        send_json(self, get_cors_origin(self), {'success': True, 'job_id': job['id']})
+
+    def do_OPTIONS(self):
+        origin = get_cors_origin(self)
+        self.send_response(200)
+        send_cors_headers(self, origin)
+        self.send_header('Access-Control-Allow-Methods', 'GET, DELETE, OPTIONS')
+        self.send_header('Access-Control-Allow-Headers', 'Content-Type, Authorization, Accept')
+        self.send_header('Content-Length', '0')
+        self.end_headers()
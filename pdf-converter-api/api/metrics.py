@@ -0,0 +1,75 @@
+"""
+Metrics Endpoint
+Per-stage timing histograms and request/error counters of this process in the
+Prometheus text format (see api/_metrics.py).
+
+GET /api/metrics
+    Authorization: Bearer <JWT>, like the other statistics endpoints, or
+    Bearer <METRICS_TOKEN> for a Prometheus scraper, which has no app JWT.
+    Addresses in METRICS_ALLOW_IPS need no token.
+
+Metrics are per process: on the self-hosted server (server.py) they cover every
+route; on serverless platforms each function instance reports its own.
+
+Configuration (environment):
+    METRICS_TOKEN       static bearer token accepted for scraping (default unset)
+    METRICS_ALLOW_IPS   comma-separated addresses or networks (e.g. 10.0.0.0/8) allowed without
+                        a token, matched against the peer address (default unset)
+"""
+
+import os
+import hmac
+import ipaddress
+from http.server import BaseHTTPRequestHandler
+from _auth import authenticate_request, send_unauthorized, get_cors_origin, send_cors_headers
+from _metrics import render
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+METRICS_ALLOW_IPS = [ipaddress.ip_network(value.strip(), strict=False)
+                     for value in os.environ.get('METRICS_ALLOW_IPS', '').split(',') if value.strip()]
+
+
+def _scraper_allowed(handler):
+    """True for the METRICS_TOKEN bearer token or a peer in METRICS_ALLOW_IPS."""
+    if METRICS_TOKEN:
+        expected = f'Bearer {METRICS_TOKEN}'.encode('utf-8')
+        if hmac.compare_digest(handler.headers.get('Authorization', '').encode('utf-8'), expected):
+            return True
+    if METRICS_ALLOW_IPS:
+        try:
+            address = ipaddress.ip_address(handler.client_address[0])
+        except ValueError:
+            return False
+        # IPv4 peers of a dual-stack socket show up as ::ffff:a.b.c.d
+        address = getattr(address, 'ipv4_mapped', None) or address
+        return any(address in network for network in METRICS_ALLOW_IPS)
+    return False
+
+
+class handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if not _scraper_allowed(self):
+            authed, result = authenticate_request(self)
+            if not authed:
+                send_unauthorized(self, result)
+                return
+
+        body = render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Cache-Control', 'no-store')
+        send_cors_headers(self, get_cors_origin(self))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_OPTIONS(self):
+        origin = get_cors_origin(self)
+        self.send_response(200)
+        send_cors_headers(self, origin)
+        self.send_header('Access-Control-Allow-Methods', 'GET, OPTIONS')
+        self.send_header('Access-Control-Allow-Headers', 'Content-Type, Authorization')
+        self.send_header('Content-Length', '0')
+        self.end_headers()
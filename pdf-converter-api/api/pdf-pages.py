@@ -0,0 +1,158 @@
+"""
+PDF Page Stream API Endpoint
+Extracts the text of a PDF page by page and streams it back as NDJSON, so a
+client can start on page 1 while later pages are still being extracted.
+
+POST /api/pdf-pages
+    JSON {"pdf_base64": ...}, a raw application/pdf body or multipart (see api/_transport.py)
+
+The response is application/x-ndjson with chunked transfer encoding, one JSON
+record per line:
+
+    {"type": "document", "page_count": 3, "pages_reused": 0}
+    {"type": "page", "page": 1, "paragraphs": [{"text": "Site Plan", "heading": true}, ...]}
+    ...
+    {"type": "end", "page_count": 3}
+
+Paragraphs and headings are the ones the DOCX converter would write (see
+api/_pdf_extract.py), and pages in the page cache are reused. Each page record
+is flushed as soon as its page is extracted and nothing is kept after that,
+so memory does not grow with the page count. A failure after the first record
+is reported as {"type": "error", "page": <page being extracted>, "error": ...}
+as the last line.
+The stream holds an admission slot (see api/_admission.py) while it runs,
+in the request's own process: 413 when the document is over the work limits,
+503 with Retry-After when every slot is busy.
+"""
+
+from http.server import BaseHTTPRequestHandler
+import importlib
+import io
+import json
+from _admission import AdmissionError, admission, send_rejected
+from _auth import authenticate_request, check_payload_size, send_unauthorized, send_payload_too_large, get_cors_origin, send_cors_headers
+from _metrics import instrumented, note_error, note_pages, note_pages_reused, timed
+from _pdf_extract import PageStructure, declared_page_count
+from _transport import read_document, send_json, start_stream
+
+NDJSON_MIME = 'application/x-ndjson'
+
+
+def warm_up():
+    """Import PyPDF2 ahead of the first request."""
+    importlib.import_module('PyPDF2')
+
+
+def _record(record):
+    return json.dumps(record).encode('utf-8') + b'\n'
+
+
+def page_record(page_num, blocks):
+    """NDJSON record of one page (page_num counts from 0)."""
+    return _record({
+        'type': 'page',
+        'page': page_num + 1,
+        'paragraphs': [{'text': text, 'heading': level > 0} for level, text in blocks],
+    })
+
+
+class handler(BaseHTTPRequestHandler):
+    @instrumented('pdf-pages')
+    def do_POST(self):
+        # Auth check
+        authed, result = authenticate_request(self)
+        if not authed:
+            send_unauthorized(self, result)
+            return
+
+        # Payload size check
+        size_ok, size_result = check_payload_size(self)
+        if not size_ok:
+            send_payload_too_large(self)
+            return
+
+        origin = get_cors_origin(self)
+
+        try:
+            pdf_bytes, params = read_document(self, 'pdf_base64')
+        except ValueError as e:
+            send_json(self, origin, {'success': False, 'error': str(e)}, status=400)
+            return
+
+        try:
+            with timed('estimate'):
+                admission.check('pdf-to-docx', pdf_bytes)
+            # Records go out as they are produced, so the stream can't run in
+            # an isolated worker; it holds a slot in this process instead
+            with admission.slot():
+                self._send_pages(origin, pdf_bytes)
+        except AdmissionError as e:
+            # Over the work limits (413) or no conversion slot free (503 + Retry-After)
+            note_error(e)
+            send_rejected(self, origin, e)
+
+    def _send_pages(self, origin, pdf_bytes):
+        from PyPDF2 import PdfReader
+
+        try:
+            with timed('parse'):
+                reader = PdfReader(io.BytesIO(pdf_bytes))
+                admission.check_pages(declared_page_count(reader))
+            pages = PageStructure(pdf_bytes, reader)
+        except AdmissionError:
+            raise
+        except Exception as e:
+            note_error(e)
+            send_json(self, origin, {
+                'success': False,
+                'error': str(e),
+                'message': 'Failed to read PDF'
+            }, status=500)
+            return
+        note_pages(pages.page_count)
+        note_pages_reused(pages.reused)
+
+        writer = start_stream(self, origin, NDJSON_MIME, {
+            'Cache-Control': 'no-store',
+            'X-Pages-Reused': str(pages.reused),
+            # Reverse proxies (nginx) would otherwise buffer the stream
+            'X-Accel-Buffering': 'no',
+        })
+        page_blocks = pages.iter_blocks()
+        try:
+            with timed('send'):
+                writer.write(_record({'type': 'document', 'page_count': pages.page_count,
+                                      'pages_reused': pages.reused}))
+                writer.flush()
+            for page_num in range(pages.page_count + 1):
+                try:
+                    blocks = next(page_blocks)
+                except StopIteration:
+                    record = {'type': 'end', 'page_count': pages.page_count}
+                    break
+                except Exception as e:
+                    # The status line is already out; the error goes in the stream
+                    note_error(e)
+                    record = {'type': 'error', 'page': page_num + 1, 'error': str(e)}
+                    break
+                with timed('send'):
+                    writer.write(page_record(page_num, blocks))
+                    writer.flush()
+            with timed('send'):
+                writer.write(_record(record))
+                writer.close()
+        except OSError as e:
+            # Client gone; closing page_blocks stops extraction of the remaining pages
+            self.close_connection = True
+            self.log_error('Page stream aborted: %r', e)
+        finally:
+            page_blocks.close()
+
+    def do_OPTIONS(self):
+        origin = get_cors_origin(self)
+        self.send_response(200)
+        send_cors_headers(self, origin)
+        self.send_header('Access-Control-Allow-Methods', 'POST, OPTIONS')
+        self.send_header('Access-Control-Allow-Headers', 'Content-Type, Authorization')
+        self.send_header('Content-Length', '0')
+        self.end_headers()
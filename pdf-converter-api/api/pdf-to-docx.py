@@ -1,20 +1,160 @@
 """
 PDF to DOCX Conversion API Endpoint
 Extracts text from PDF and creates DOCX (lightweight approach for Vercel)
+The DOCX is written directly into a zip stream as pages are extracted (see api/_docx_writer.py).
+Page images follow each page's text, downsampled and deduplicated within a
+per-document byte budget (see api/_pdf_images.py).
+
+Accepts either JSON {"pdf_base64": ...} or a raw application/pdf (or multipart) body,
+and returns JSON or the raw DOCX depending on the Accept header.
+With `Prefer: respond-async` it returns 202 and a job id instead (see api/jobs.py).
+The engine option (auto, local or ilovepdf) picks the converter; auto routes each
+document between the local converter and iLovePDF (see api/_engines.py).
+Local conversions pass admission control (see api/_admission.py): 413 when the
+document is over the work limits, 503 with Retry-After when every slot is busy.
+Pages unchanged since an earlier upload are served from the page cache (see
+api/_page_cache.py); X-Pages-Reused reports how many.
+With `pages` and/or `max_pages` only those pages are converted, as a preview
+(see api/_preview.py); the rest of the page tree is never read.
 """
 
 from http.server import BaseHTTPRequestHandler
-import json
-import base64
+import importlib
 import io
-from PyPDF2 import PdfReader
-from docx import Document
-from docx.shared import Pt, Inches
-from docx.enum.text import WD_ALIGN_PARAGRAPH
-from _auth import authenticate_request, check_payload_size, send_unauthorized, send_payload_too_large, get_cors_origin, send_cors_headers
+import threading
+from _admission import AdmissionError, admission, register_worker_state, send_rejected
+from _auth import authenticate_request, check_payload_size, send_unauthorized, send_payload_too_large, get_cors_origin, send_cors_headers, jwt_cache_stats
+from _cache import conversion_cache
+from _engines import DEFAULT_ENGINE, ENGINES, ConversionJob, register_local, router
+from _metrics import instrumented, note_error, note_pages, note_pages_reused, request_pages_reused, timed
+from _jobs import wants_async, submit_job, send_job_accepted
+from _docx_writer import EMU_PER_POINT, DocxTemplate, DocxWriter
+from _page_cache import page_cache
+from _pdf_extract import PageStructure, declared_page_count, load_page_range
+from _pdf_images import IMAGE_BUDGET, PageImages
+from _preview import PreviewError, preview_details, preview_engine, preview_headers, read_preview
+from _transport import DOCX_MIME, read_document, send_document, send_json, etag_matches, send_not_modified
+
+
+# PyPDF2 and python-docx are imported on first conversion rather than at module
+# load, so CORS preflights and rejected requests never pay for them on a cold start.
+_docx_template = None
+_docx_template_lock = threading.Lock()
+
+
+def _get_template():
+    """Return the output template (an empty DOCX with the default font set), built once per process."""
+    global _docx_template
+    if _docx_template is None:
+        with _docx_template_lock:
+            if _docx_template is None:
+                from docx import Document
+                from docx.shared import Pt
+
+                template = Document()
+
+                # Set default font
+                style = template.styles['Normal']
+                font = style.font
+                font.name = 'Calibri'
+                font.size = Pt(11)
+
+                _docx_template = DocxTemplate(template)
+    return _docx_template
+
+
+def warm_up():
+    """Import heavy modules and build the shared template ahead of the first request."""
+    for name in ('PyPDF2', 'PIL.Image', 'PIL.JpegImagePlugin', 'PIL.PngImagePlugin'):
+        importlib.import_module(name)
+    _get_template()
+
+
+def convert_pdf_to_docx(pdf_bytes, progress=None, image_budget=IMAGE_BUDGET, preview=None):
+    """
+    Convert PDF bytes to DOCX.
+    Returns (docx_buffer, page_count); docx_buffer is a bytes-like view.
+    progress(pages_done, pages_total) is called as pages are extracted.
+    Pages found in the page cache (api/_page_cache.py) are not extracted again.
+    Page images are added after each page's text, up to image_budget bytes of
+    them (see api/_pdf_images.py).
+    preview (first, last), 1-based, converts only those pages and returns
+    (docx_buffer, page_count, details) with preview_details (api/_preview.py);
+    PreviewError if first is past the last page.
+    """
+    from PyPDF2 import PdfReader
+
+    # Read PDF using PyPDF2 (BytesIO shares the bytes buffer, no copy)
+    with timed('parse'):
+        pdf_reader = PdfReader(io.BytesIO(pdf_bytes))
+        # The page limit, for page trees admission control couldn't see (object streams)
+        admission.check_pages(declared_page_count(pdf_reader))
+        selection = None
+        if preview is not None:
+            # Only the page tree nodes leading to the previewed pages are read
+            first, last = preview
+            total_pages = load_page_range(pdf_reader, first - 1, last)
+            if first > total_pages:
+                raise PreviewError(f'Invalid pages: page {first} is past the end of the document ({total_pages} pages)')
+            selection = range(first - 1, min(last, total_pages))
+    page_count = len(pdf_reader.pages) if selection is None else len(selection)
+
+    # Page structures of unchanged pages (e.g. from an earlier revision of the document) are reused
+    pages = PageStructure(pdf_bytes, pdf_reader, pages=selection)
+    note_pages_reused(pages.reused)
+
+    # Images are encoded up front (thread pool, within the byte budget), one media part each
+    images = PageImages(pdf_reader, budget=image_budget, pages=selection)
+
+    # The DOCX body is written straight into the zip stream as pages are extracted
+    # (process pool for large documents, in page order); the write stage excludes extraction
+    template = _get_template()
+    docx_stream = io.BytesIO()
+    with timed('write'), DocxWriter(template, docx_stream, images.media) as doc:
+        for page_num, blocks in enumerate(pages.iter_blocks(progress)):
+            pictures = images.pages[page_num]
+            # Add the content of each page
+            if blocks or pictures:
+                if page_num > 0:
+                    # Add page break for subsequent pages
+                    doc.page_break()
+
+                for level, para_text in blocks:
+                    if level:
+                        # Add as heading
+                        doc.heading(para_text, level=level)
+                    else:
+                        # Add as normal paragraph
+                        doc.paragraph(para_text)
+
+                # Images at their drawn size, scaled down to fit the text area
+                for index, width, height in pictures:
+                    doc.picture(index, *template.fit(width * EMU_PER_POINT, height * EMU_PER_POINT))
+
+    if selection is None:
+        return docx_stream.getbuffer(), page_count
+    return docx_stream.getbuffer(), page_count, preview_details(first, first + page_count - 1, total_pages,
+                                                                page_count < total_pages)
+
+
+def _success_message(page_count, preview=None):
+    if page_count is None:
+        # iLovePDF doesn't report a page count
+        return 'PDF successfully converted to DOCX'
+    if preview is not None and preview['truncated']:
+        pages = f'pages {preview["pages"]}' if preview['pages'] is not None else 'no pages'
+        total = f' of {preview["total_pages"]}' if preview['total_pages'] is not None else ''
+        return f'PDF preview converted to DOCX ({pages}{total})'
+    return f'PDF successfully converted to DOCX ({page_count} pages)'
+
+
+register_local('pdf-to-docx', convert_pdf_to_docx, warm_up, keeps_images=IMAGE_BUDGET > 0)
+# Pages extracted in an isolated worker are cached in the parent too
+register_worker_state('page_cache', page_cache.changes_since_fork, page_cache.merge)
 
 
 class handler(BaseHTTPRequestHandler):
+    @instrumented('pdf-to-docx')
     def do_POST(self):
         # Auth check
         authed, result = authenticate_request(self)
@@ -31,110 +171,116 @@ class handler(BaseHTTPRequestHandler):
         origin = get_cors_origin(self)
 
         try:
-            # Read request body
-            content_length = int(self.headers['Content-Length'])
-            post_data = self.rfile.read(content_length)
+            # Read request body (JSON/base64, raw PDF or multipart)
+            try:
+                pdf_bytes, params = read_document(self, 'pdf_base64')
+            except ValueError as e:
+                send_json(self, origin, {'success': False, 'error': str(e)}, status=400)
+                return
+
+            # Converter engine: auto routes between local and iLovePDF per document
+            engine = params.get('engine', DEFAULT_ENGINE)
+            if engine not in ENGINES:
+                send_json(self, origin, {'success': False, 'error': f'Unknown engine: {engine}'}, status=400)
+                return
+            # Preview: only the requested pages, converted locally
+            try:
+                preview = read_preview(params)
+                if preview is not None:
+                    engine = preview_engine(engine)
+            except ValueError as e:
+                send_json(self, origin, {'success': False, 'error': str(e)}, status=400)
+                return
+            options = {'preview': preview} if preview is not None else {}
 
-            # Parse JSON request
-            request_data = json.loads(post_data.decode('utf-8'))
+            # Content-addressed cache lookup (input hash + options). The cache holds
+            # local results, so iLovePDF's are keyed (and tagged) apart from them
+            key_options = dict(options, engine=engine) if engine == 'ilovepdf' else options
+            cache_key = conversion_cache.key('pdf-to-docx', pdf_bytes, key_options)
+            etag = f'"{cache_key}"'
+            if etag_matches(self, etag):
+                send_not_modified(self, origin, etag)
+                return
 
-            # Extract base64 PDF data
-            if 'pdf_base64' not in request_data:
-                self.send_error(400, 'Missing pdf_base64 field')
+            conversion = ConversionJob('pdf-to-docx', pdf_bytes, cache_key, params.get('public_key'), options=options)
+            if engine == 'ilovepdf' and not conversion.public_key:
+                send_json(self, origin, {'success': False, 'error': 'Missing public_key'}, status=400)
                 return
 
-            pdf_base64 = request_data['pdf_base64']
-
-            # Decode base64 to bytes
-            pdf_bytes = base64.b64decode(pdf_base64)
-
-            # Create in-memory file objects
-            pdf_stream = io.BytesIO(pdf_bytes)
-
-            # Read PDF using PyPDF2
-            pdf_reader = PdfReader(pdf_stream)
-
-            # Create new DOCX document
-            doc = Document()
-
-            # Set default font
-            style = doc.styles['Normal']
-            font = style.font
-            font.name = 'Calibri'
-            font.size = Pt(11)
-
-            # Extract text from each page
-            for page_num, page in enumerate(pdf_reader.pages):
-                # Extract text
-                text = page.extract_text()
-
-                if text.strip():
-                    # Add page content
-                    if page_num > 0:
-                        # Add page break for subsequent pages
-                        doc.add_page_break()
-
-                    # Split text into paragraphs (by double newline or single newline)
-                    paragraphs = text.split('\n')
-
-                    for para_text in paragraphs:
-                        para_text = para_text.strip()
-                        if para_text:
-                            # Detect if it might be a heading (short, possibly all caps or title case)
-                            is_heading = (
-                                len(para_text) < 100 and
-                                (para_text.isupper() or para_text.istitle()) and
-                                not para_text.endswith('.')
-                            )
-
-                            if is_heading:
-                                # Add as heading
-                                para = doc.add_heading(para_text, level=2)
-                            else:
-                                # Add as normal paragraph
-                                para = doc.add_paragraph(para_text)
-
-            # Save DOCX to bytes
-            docx_stream = io.BytesIO()
-            doc.save(docx_stream)
-
-            # Get DOCX bytes and encode to base64
-            docx_stream.seek(0)
-            docx_bytes = docx_stream.read()
-            docx_base64 = base64.b64encode(docx_bytes).decode('utf-8')
-
-            # Send response
-            self.send_response(200)
-            self.send_header('Content-Type', 'application/json')
-            send_cors_headers(self, origin)
-            self.end_headers()
-
-            response = {
-                'success': True,
-                'docx_base64': docx_base64,
-                'message': f'PDF successfully converted to DOCX ({len(pdf_reader.pages)} pages)'
-            }
-
-            self.wfile.write(json.dumps(response).encode('utf-8'))
+            # Async mode: queue the conversion and return a job id right away
+            if wants_async(self, params):
+                def run_job(progress):
+                    docx_buffer, page_count, decision = router.convert(conversion, engine, progress)
+                    meta = {'page_count': page_count, 'message': _success_message(page_count, decision.get('preview'))}
+                    if 'preview' in decision:
+                        meta['preview'] = decision['preview']
+                    return docx_buffer, meta
 
-        except Exception as e:
-            self.send_response(500)
-            self.send_header('Content-Type', 'application/json')
-            send_cors_headers(self, origin)
-            self.end_headers()
+                job = submit_job('pdf-to-docx', result.get('sub'), run_job, DOCX_MIME, 'document.docx', 'docx_base64')
+                send_job_accepted(self, origin, job)
+                return
 
-            error_response = {
+            docx_buffer, page_count, decision = router.convert(conversion, engine)
+            # Let the input go before the response is sent
+            del pdf_bytes
+            conversion.data = None
+            note_pages(page_count)
+            headers = {'ETag': etag, 'X-Cache': decision['cache'], 'X-Engine': decision['engine'],
+                       'X-Engine-Reason': decision['reason']}
+            pages_reused = request_pages_reused()
+            if pages_reused is not None:
+                headers['X-Pages-Reused'] = str(pages_reused)
+            preview = decision.get('preview')
+            headers.update(preview_headers(preview))
+
+            # Send response (binary or JSON depending on Accept)
+            send_document(
+                self, origin, docx_buffer, DOCX_MIME, 'document.docx', 'docx_base64',
+                _success_message(page_count, preview), extra_headers=headers,
+                extra_fields={'preview': preview} if preview is not None else None
+            )
+
+        except PreviewError as e:
+            # Preview pages past the end of the document
+            send_json(self, origin, {'success': False, 'error': str(e)}, status=400)
+
+        except AdmissionError as e:
+            # Over the work limits (413) or no conversion slot free (503 + Retry-After)
+            note_error(e)
+            send_rejected(self, origin, e)
+
+        except Exception as e:
+            note_error(e)
+            send_json(self, origin, {
                 'success': False,
                 'error': str(e),
                 'message': 'Failed to convert PDF to DOCX'
-            }
+            }, status=500)
 
-            self.wfile.write(json.dumps(error_response).encode('utf-8'))
+    @instrumented('pdf-to-docx')
+    def do_GET(self):
+        # Cache statistics (hit/miss/eviction counters) for sizing the result and
+        # page caches, engine routing decisions with per-engine latency
+        # histograms, admission counters (slots, queue, rejections) and the
+        # verified-token cache counters
+        authed, result = authenticate_request(self)
+        if not authed:
+            send_unauthorized(self, result)
+            return
+        send_json(self, get_cors_origin(self), {
+            'success': True,
+            'cache': conversion_cache.stats(),
+            'page_cache': page_cache.stats(),
+            'engines': router.report(),
+            'admission': admission.stats(),
+            'jwt_cache': jwt_cache_stats(),
+        })
 
     def do_OPTIONS(self):
         origin = get_cors_origin(self)
         self.send_response(200)
         send_cors_headers(self, origin)
-        self.send_header('Access-Control-Allow-Methods', 'POST, OPTIONS')
-        self.send_header('Access-Control-Allow-Headers', 'Content-Type, Authorization')
+        self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
+        self.send_header('Access-Control-Allow-Headers', 'Content-Type, Authorization, Accept, If-None-Match, Prefer')
+        self.send_header('Content-Length', '0')
         self.end_headers()
@@ -0,0 +1,71 @@
+"""
+Micro-benchmark: JWT verification cost per request.
+
+Compares the original per-call implementation (secret encode, HMAC key setup,
+base64url decode and JSON parse on every call) with the current verify_jwt on a
+cache miss (precomputed HMAC state) and a cache hit.
+
+Usage:
+    python bench/bench_auth.py [--iterations 20000]
+"""
+
+import os
+import sys
+import json
+import time
+import hmac
+import hashlib
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'api'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import _auth
+from run import BENCH_SECRET, make_token
+
+
+def reference_verify(token):
+    """verify_jwt as it was before the cache and keyring."""
+    secret = os.environ.get('JWT_SECRET')
+    parts = token.split('.')
+    signing_input = f'{parts[0]}.{parts[1]}'.encode('ascii')
+    expected_sig = hmac.new(secret.encode('utf-8'), signing_input, hashlib.sha256).digest()
+    if not hmac.compare_digest(expected_sig, _auth._base64url_decode(parts[2])):
+        raise ValueError('Invalid JWT signature')
+    payload = json.loads(_auth._base64url_decode(parts[1]).decode('utf-8'))
+    if 'exp' in payload and payload['exp'] < time.time():
+        raise ValueError('JWT expired')
+    return payload
+
+
+def per_call_us(fn, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - start) / iterations * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description='JWT verification micro-benchmark')
+    parser.add_argument('--iterations', type=int, default=20000)
+    args = parser.parse_args()
+
+    os.environ['JWT_SECRET'] = BENCH_SECRET
+    token = make_token()
+
+    def miss():
+        _auth._token_cache.clear()
+        _auth.verify_jwt(token)
+
+    results = [
+        ('before (per-call HMAC setup)', per_call_us(lambda: reference_verify(token), args.iterations)),
+        ('after, cache miss', per_call_us(miss, args.iterations)),
+        ('after, cache hit', per_call_us(lambda: _auth.verify_jwt(token), args.iterations)),
+    ]
+    baseline = results[0][1]
+    for name, us in results:
+        print(f'{name:<30} {us:8.2f} us/request  ({baseline / us:5.1f}x)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+"""
+Benchmark: /api/compress-pdf on a merged drawing set (see corpus.make_drawing_set).
+
+Compresses the set at every level with 1 and with --workers recompression
+threads, reporting output size, ratio, time and the slowest stages. The output
+is checked to have the same pages and page text as the input before reporting.
+
+Usage:
+    python bench/bench_compress.py [--sheets 8] [--workers 4] [--repeat 3]
+"""
+
+import io
+import os
+import sys
+import time
+import argparse
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+API_DIR = os.path.join(BENCH_DIR, '..', 'api')
+sys.path.insert(0, API_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from corpus import make_drawing_set
+
+
+def _page_texts(pdf_bytes):
+    from PyPDF2 import PdfReader
+
+    return [page.extract_text() for page in PdfReader(io.BytesIO(bytes(pdf_bytes))).pages]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sheets', type=int, default=8)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    import _pdf_compress
+    from _metrics import Timings, bind
+
+    pdf = make_drawing_set(args.sheets)
+    expected = _page_texts(pdf)
+    print(f'document: {args.sheets} sheets, {len(pdf)} bytes')
+    print(f'{"level":>10} {"workers":>7} {"bytes":>9} {"ratio":>6} {"images":>6} {"merged":>6} {"time_s":>7}  stages')
+    for level, (dpi, quality) in _pdf_compress.LEVELS.items():
+        for workers in sorted({1, args.workers}):
+            os.environ['COMPRESS_WORKERS'] = str(workers)
+            _pdf_compress._reset_pool()
+            best = None
+            for _ in range(args.repeat):
+                timings = Timings('bench')
+                bind(timings)
+                start = time.perf_counter()
+                buffer, report = _pdf_compress.compress_pdf(pdf, dpi, quality)
+                elapsed = time.perf_counter() - start
+                bind(None)
+                if best is None or elapsed < best[0]:
+                    best = (elapsed, timings.stages)
+
+            if _page_texts(buffer) != expected:
+                sys.exit(f'{level}: compressed pages differ from the input')
+            elapsed, stages = best
+            slowest = ', '.join(f'{name} {seconds:.3f}' for name, seconds in
+                                sorted(stages.items(), key=lambda item: -item[1])[:3])
+            print(f'{level:>10} {workers:>7} {report["compressed_bytes"]:>9} {report["ratio"]:>6.3f} '
+                  f'{report["images_recompressed"]:>6} {report["duplicates_merged"]:>6} {elapsed:>7.3f}  {slowest}')
+
+
+if __name__ == '__main__':
+    main()
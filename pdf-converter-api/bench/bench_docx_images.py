@@ -0,0 +1,97 @@
+"""
+Benchmark: page images in pdf-to-docx on a merged drawing set (see corpus.make_drawing_set).
+
+Converts the set with images left out, with the default image byte budget and
+with a tight one, each with 1 and with --workers image threads, reporting
+output size, media parts, pictures placed, time and the slowest stages. Every
+output is checked to open with python-docx and to have the same text as the
+conversion without images.
+
+Usage:
+    python bench/bench_docx_images.py [--sheets 8] [--workers 4] [--budget 1048576] [--repeat 3]
+"""
+
+import io
+import os
+import sys
+import time
+import zipfile
+import argparse
+import importlib.util
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+API_DIR = os.path.join(BENCH_DIR, '..', 'api')
+sys.path.insert(0, API_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from corpus import make_drawing_set
+
+
+def _load_converter():
+    spec = importlib.util.spec_from_file_location('pdf_to_docx', os.path.join(API_DIR, 'pdf-to-docx.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def _texts(docx_buffer):
+    from docx import Document
+
+    return [paragraph.text for paragraph in Document(io.BytesIO(bytes(docx_buffer))).paragraphs if paragraph.text]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sheets', type=int, default=8)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--budget', type=int, default=1024 * 1024, help='the tight budget, in bytes')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    import _pdf_compress
+    import _pdf_images
+    from _metrics import Timings, bind
+    from _page_cache import page_cache
+
+    module = _load_converter()
+    module.warm_up()
+    # Every run extracts its text again
+    page_cache.max_bytes = 0
+
+    pdf = make_drawing_set(args.sheets)
+    budgets = (('none', 0), ('default', _pdf_images.IMAGE_BUDGET), ('tight', args.budget))
+    expected = None
+    print(f'document: {args.sheets} sheets, {len(pdf)} bytes')
+    print(f'{"budget":>8} {"workers":>7} {"bytes":>9} {"media":>5} {"pictures":>8} {"time_s":>7}  stages')
+    for label, budget in budgets:
+        for workers in sorted({1, args.workers}) if budget else (1,):
+            os.environ['COMPRESS_WORKERS'] = str(workers)
+            _pdf_compress._reset_pool()
+            best = None
+            for _ in range(args.repeat):
+                timings = Timings('bench')
+                bind(timings)
+                start = time.perf_counter()
+                buffer, _ = module.convert_pdf_to_docx(pdf, image_budget=budget)
+                elapsed = time.perf_counter() - start
+                bind(None)
+                if best is None or elapsed < best[0]:
+                    best = (elapsed, timings.stages)
+
+            texts = _texts(buffer)
+            if expected is None:
+                expected = texts
+            elif texts != expected:
+                sys.exit(f'{label}: document text differs from the conversion without images')
+            with zipfile.ZipFile(io.BytesIO(bytes(buffer))) as archive:
+                media = sum(1 for name in archive.namelist() if name.startswith('word/media/'))
+                pictures = archive.read('word/document.xml').count(b'<wp:inline')
+            elapsed, stages = best
+            slowest = ', '.join(f'{name} {seconds:.3f}' for name, seconds in
+                                sorted(stages.items(), key=lambda item: -item[1])[:3])
+            print(f'{label:>8} {workers:>7} {len(buffer):>9} {media:>5} {pictures:>8} '
+                  f'{elapsed:>7.3f}  {slowest}')
+
+
+if __name__ == '__main__':
+    main()
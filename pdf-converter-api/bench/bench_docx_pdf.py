@@ -0,0 +1,145 @@
+"""
+Benchmark: docx-to-pdf layout and DOCX reading.
+
+Variants:
+    reference     the converter before the single-pass walker: paragraphs
+                  first, then every table, each with a fresh Spacer, all
+                  materialised in one story list before layout
+    python-docx   single-pass walker reading the DOCX with python-docx
+    stream        single-pass walker reading the DOCX with the iterparse reader
+
+--stage read times only reading the body blocks (no layout), which isolates
+the reader's own cost. Each variant runs in a fresh child process so peak RSS
+belongs to that run alone.
+
+Usage:
+    python bench/bench_docx_pdf.py [--tables 1000] [--repeat 1] [--stage convert|read]
+"""
+
+import io
+import os
+import sys
+import time
+import argparse
+import resource
+import subprocess
+import importlib.util
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+API_DIR = os.path.join(BENCH_DIR, '..', 'api')
+sys.path.insert(0, API_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+VARIANTS = ('reference', 'python-docx', 'stream')
+STAGES = ('convert', 'read')
+
+
+def _load_converter():
+    spec = importlib.util.spec_from_file_location('docx_to_pdf', os.path.join(API_DIR, 'docx-to-pdf.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def reference_convert(module, docx_bytes):
+    """The previous converter: two passes over the document into a full story list."""
+    from docx import Document
+    from reportlab.lib.pagesizes import letter
+    from reportlab.lib.units import inch
+    from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table
+
+    doc = Document(io.BytesIO(docx_bytes))
+    pdf_stream = io.BytesIO()
+    pdf_doc = SimpleDocTemplate(pdf_stream, pagesize=letter, rightMargin=0.75*inch, leftMargin=0.75*inch,
+                                topMargin=0.75*inch, bottomMargin=0.75*inch)
+    styles, table_style = module._get_shared_styles()[:2]
+    story = []
+    for para in doc.paragraphs:
+        if para.text.strip():
+            style = styles['Heading1'] if para.style.name.startswith('Heading') else styles['Normal']
+            story.append(Paragraph(para.text, style))
+            story.append(Spacer(1, 0.1*inch))
+    for table in doc.tables:
+        table_data = [[cell.text for cell in row.cells] for row in table.rows]
+        if table_data:
+            t = Table(table_data)
+            t.setStyle(table_style)
+            story.append(t)
+            story.append(Spacer(1, 0.2*inch))
+    pdf_doc.build(story)
+    return pdf_stream.getbuffer(), pdf_doc.page
+
+
+def read_blocks(module, variant, docx_bytes):
+    """Read every body block with the variant's reader, keeping none; returns the block count."""
+    from docx import Document
+    from _docx_reader import iter_docx_blocks
+
+    if variant == 'stream':
+        blocks = iter_docx_blocks(docx_bytes)
+    else:
+        blocks = module._iter_blocks(Document(io.BytesIO(docx_bytes)))
+    return sum(1 for _ in blocks)
+
+
+def run_child(variant, stage, path, repeat):
+    """Child process: run the variant and print seconds, pages (blocks when reading) and peak RSS (MB)."""
+    module = _load_converter()
+    module.warm_up()
+    with open(path, 'rb') as f:
+        docx_bytes = f.read()
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        if stage == 'read':
+            pages = read_blocks(module, variant, docx_bytes)
+        elif variant == 'reference':
+            _, pages = reference_convert(module, docx_bytes)
+        else:
+            _, pages = module.convert_docx_to_pdf(docx_bytes, reader=variant)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    # ru_maxrss is in KB on Linux
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f'{best:.3f} {pages} {peak_mb:.1f}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--tables', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=1)
+    parser.add_argument('--stage', choices=STAGES, default='convert')
+    parser.add_argument('--child', choices=VARIANTS, help=argparse.SUPPRESS)
+    parser.add_argument('--input', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.child, args.stage, args.input, args.repeat)
+        return
+
+    import tempfile
+    from corpus import make_docx
+
+    # One table per page-equivalent, with a heading and a paragraph around each
+    docx_bytes = make_docx('tables', args.tables)
+    with tempfile.NamedTemporaryFile(suffix='.docx', delete=False) as f:
+        f.write(docx_bytes)
+    try:
+        print(f'document: {args.tables} tables, {len(docx_bytes) / 1e6:.1f} MB DOCX')
+        unit = 'blocks' if args.stage == 'read' else 'pages'
+        print(f'{"variant":>12} {"seconds":>8} {unit:>6} {"peak_rss_mb":>12}')
+        # The reference path has no separate read stage
+        for variant in VARIANTS[1:] if args.stage == 'read' else VARIANTS:
+            out = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), '--child', variant, '--input', f.name,
+                 '--repeat', str(args.repeat), '--stage', args.stage],
+                check=True, capture_output=True, text=True
+            ).stdout.split()
+            seconds, pages, peak = float(out[0]), int(out[1]), float(out[2])
+            print(f'{variant:>12} {seconds:>8.2f} {pages:>6} {peak:>12.1f}')
+    finally:
+        os.unlink(f.name)
+
+
+if __name__ == '__main__':
+    main()
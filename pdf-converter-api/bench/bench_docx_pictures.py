@@ -0,0 +1,101 @@
+"""
+Benchmark: pictures in docx-to-pdf on a photo report (camera photos and a logo in every section).
+
+Converts the report with pictures embedded at their original resolution, then
+pre-scaled with an empty image cache and with a warm one, reporting PDF size,
+time and the slowest stages. Every PDF is checked to have the same page count.
+
+Usage:
+    python bench/bench_docx_pictures.py [--sections 10] [--repeat 3]
+"""
+
+import io
+import os
+import sys
+import time
+import argparse
+import importlib.util
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+API_DIR = os.path.join(BENCH_DIR, '..', 'api')
+sys.path.insert(0, API_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from corpus import _heading, _image, _photo, _rng, _sentence
+
+
+def _load_converter():
+    spec = importlib.util.spec_from_file_location('docx_to_pdf', os.path.join(API_DIR, 'docx-to-pdf.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def make_photo_report(sections):
+    """A site report: per section a heading, the practice logo, two camera photos (JPEG) and a caption."""
+    from docx import Document
+    from docx.shared import Inches
+
+    rng = _rng('photos', sections)
+    doc = Document()
+    logo = _image(rng, (1200, 400))
+    for section in range(sections):
+        doc.add_heading(_heading(rng, section + 1), level=1)
+        doc.add_picture(io.BytesIO(logo), width=Inches(1.5))
+        for _ in range(2):
+            photo = io.BytesIO()
+            _photo(rng, (3000, 2000)).save(photo, format='JPEG', quality=92)
+            doc.add_picture(io.BytesIO(photo.getvalue()), width=Inches(3))
+        doc.add_paragraph(_sentence(rng))
+    buf = io.BytesIO()
+    doc.save(buf)
+    return buf.getvalue()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sections', type=int, default=10)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    import _docx_images
+    from _docx_images import image_cache
+    from _metrics import Timings, bind
+
+    module = _load_converter()
+    module.warm_up()
+
+    docx = make_photo_report(args.sections)
+    dpi = _docx_images.IMAGE_DPI
+    # A resolution no picture reaches keeps every JPEG and PNG as it is
+    runs = (('original', 10 ** 6, True), ('cold cache', dpi, True), ('warm cache', dpi, False))
+    expected = None
+    print(f'document: {args.sections} sections, {len(docx)} bytes')
+    print(f'{"pictures":>10} {"bytes":>9} {"pages":>5} {"time_s":>7}  stages')
+    for label, run_dpi, cold in runs:
+        _docx_images.IMAGE_DPI = run_dpi
+        best = None
+        for _ in range(args.repeat):
+            if cold:
+                image_cache.clear()
+            timings = Timings('bench')
+            bind(timings)
+            start = time.perf_counter()
+            buffer, page_count = module.convert_docx_to_pdf(docx)
+            elapsed = time.perf_counter() - start
+            bind(None)
+            if best is None or elapsed < best[0]:
+                best = (elapsed, timings.stages)
+
+        if expected is None:
+            expected = page_count
+        elif page_count != expected:
+            sys.exit(f'{label}: {page_count} pages, expected {expected}')
+        elapsed, stages = best
+        slowest = ', '.join(f'{name} {seconds:.3f}' for name, seconds in
+                            sorted(stages.items(), key=lambda item: -item[1])[:3])
+        print(f'{label:>10} {len(buffer):>9} {page_count:>5} {elapsed:>7.3f}  {slowest}')
+
+
+if __name__ == '__main__':
+    main()
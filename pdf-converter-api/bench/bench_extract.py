@@ -0,0 +1,53 @@
+"""
+Benchmark: serial vs process-pool PDF text extraction by page count.
+
+Usage:
+    python bench/bench_extract.py [--pages 10,50,100,200,400] [--workers N] [--repeat 3]
+"""
+
+import os
+import io
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'api'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from PyPDF2 import PdfReader
+import _pdf_extract
+from corpus import make_pdf
+
+
+def best_of(fn, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--pages', default='10,50,100,200,400')
+    parser.add_argument('--workers', type=int, default=_pdf_extract.pool_size())
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    os.environ['PDF_EXTRACT_WORKERS'] = str(args.workers)
+    print(f'cores={_pdf_extract.available_cores()} workers={args.workers}')
+    print(f'{"pages":>6} {"serial_s":>10} {"parallel_s":>11} {"speedup":>8}')
+
+    for pages in [int(p) for p in args.pages.split(',')]:
+        pdf_bytes = make_pdf('text', pages)
+        serial = best_of(lambda: _pdf_extract.extract_serial(PdfReader(io.BytesIO(pdf_bytes))), args.repeat)
+        # Warm the pool once so worker start-up is not counted
+        _pdf_extract.extract_parallel(pdf_bytes, pages, args.workers)
+        parallel = best_of(lambda: _pdf_extract.extract_parallel(pdf_bytes, pages, args.workers), args.repeat)
+        print(f'{pages:>6} {serial:>10.3f} {parallel:>11.3f} {serial / parallel:>7.2f}x')
+
+
+if __name__ == '__main__':
+    main()
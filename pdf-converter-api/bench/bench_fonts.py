@@ -0,0 +1,98 @@
+"""
+Benchmark: TrueType fonts in docx-to-pdf on a translated document (Latin, Cyrillic and Greek).
+
+Converts the document the first time (fonts parsed), again with the fonts
+loaded but no cached subsets, and again with the subsets cached, reporting the
+`fonts` stage and the total time. Uses the default fonts (DejaVu Sans in
+api/fonts) unless DOCX_PDF_FONTS is set.
+
+Usage:
+    python bench/bench_fonts.py [--pages 10] [--repeat 3]
+"""
+
+import io
+import os
+import sys
+import time
+import argparse
+import importlib.util
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+API_DIR = os.path.join(BENCH_DIR, '..', 'api')
+sys.path.insert(0, API_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from corpus import LINES_PER_PAGE, _heading, _rng, _sentence
+
+_CYRILLIC = 'Фасад остекление кронштейн анкер допуск спецификация подрядчик чертёж ревизия'.split()
+_GREEK = 'πρόσοψη υαλοπίνακας αγκύριο ανοχή προδιαγραφή εργολάβος σχέδιο αναθεώρηση'.split()
+
+
+def _load_converter():
+    spec = importlib.util.spec_from_file_location('docx_to_pdf', os.path.join(API_DIR, 'docx-to-pdf.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def make_translated_docx(pages):
+    """Each paragraph in English, then Russian, then Greek words."""
+    from docx import Document
+
+    rng = _rng('translated', pages)
+    doc = Document()
+    for page in range(pages):
+        doc.add_heading(_heading(rng, page + 1) + ' / ' + ' '.join(rng.choice(_CYRILLIC) for _ in range(3)), level=1)
+        for _ in range(LINES_PER_PAGE // 4):
+            doc.add_paragraph(' '.join((_sentence(rng, 8), ' '.join(rng.choice(_CYRILLIC) for _ in range(10)) + '.',
+                                        ' '.join(rng.choice(_GREEK) for _ in range(8)) + '.')))
+    buf = io.BytesIO()
+    doc.save(buf)
+    return buf.getvalue()
+
+
+def _convert(module, docx):
+    from _metrics import Timings, bind
+
+    timings = Timings('bench')
+    bind(timings)
+    start = time.perf_counter()
+    buffer, page_count = module.convert_docx_to_pdf(docx)
+    elapsed = time.perf_counter() - start
+    bind(None)
+    return elapsed, timings.stages.get('fonts', 0.0), len(buffer), page_count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--pages', type=int, default=10)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    from _fonts import font_registry
+
+    module = _load_converter()
+    docx = make_translated_docx(args.pages)
+    print(f'document: {args.pages} pages, {len(docx)} bytes')
+    print(f'{"run":>14} {"bytes":>8} {"pages":>5} {"fonts_s":>8} {"time_s":>7}')
+
+    # The first conversion loads (parses) the fonts
+    elapsed, fonts, size, page_count = _convert(module, docx)
+    print(f'{"first":>14} {size:>8} {page_count:>5} {fonts:>8.3f} {elapsed:>7.3f}')
+    if not font_registry.stats()['families']:
+        sys.exit('no fonts registered: check DOCX_PDF_FONTS')
+
+    for label, cached in (('no subsets', False), ('cached subsets', True)):
+        best = None
+        for _ in range(args.repeat):
+            if not cached:
+                font_registry.clear()
+            result = _convert(module, docx)
+            if best is None or result[0] < best[0]:
+                best = result
+        elapsed, fonts, size, page_count = best
+        print(f'{label:>14} {size:>8} {page_count:>5} {fonts:>8.3f} {elapsed:>7.3f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+"""
+Benchmark: re-converting a revised PDF with and without the page cache.
+
+The original document is converted first (filling the page cache), then a
+revision with `--changed` amended pages is converted with the cache on and
+off. Both conversions of the revision produce the same package parts; the
+benchmark checks that before reporting.
+
+Usage:
+    python bench/bench_page_cache.py [--pages 300] [--kind text] [--changed 0,3,30] [--repeat 3]
+"""
+
+import os
+import sys
+import time
+import argparse
+import importlib.util
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+API_DIR = os.path.join(BENCH_DIR, '..', 'api')
+sys.path.insert(0, API_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from corpus import make_pdf
+from bench_pdf_docx import package_parts
+
+
+def _load_converter():
+    spec = importlib.util.spec_from_file_location('pdf_to_docx', os.path.join(API_DIR, 'pdf-to-docx.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--pages', type=int, default=300)
+    parser.add_argument('--kind', default='text')
+    parser.add_argument('--changed', default='0,3,30')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    from _page_cache import page_cache
+
+    module = _load_converter()
+    module.warm_up()
+    original = make_pdf(args.kind, args.pages)
+    budget = page_cache.max_bytes
+    print(f'document: {args.pages} {args.kind} pages')
+    print(f'{"changed":>8} {"uncached_s":>11} {"cached_s":>9} {"speedup":>8}')
+    for changed in [int(n) for n in args.changed.split(',')]:
+        # Spread the amended pages over the document
+        revised = set(range(0, args.pages, max(1, args.pages // changed))[:changed]) if changed else set()
+        revision = make_pdf(args.kind, args.pages, revised=revised)
+
+        page_cache.max_bytes = 0
+        uncached = None
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            docx_buffer, _ = module.convert_pdf_to_docx(revision)
+            elapsed = time.perf_counter() - start
+            uncached = elapsed if uncached is None else min(uncached, elapsed)
+        expected = package_parts(docx_buffer)
+
+        page_cache.max_bytes = budget
+        cached = None
+        for _ in range(args.repeat):
+            page_cache.clear()
+            module.convert_pdf_to_docx(original)
+            start = time.perf_counter()
+            docx_buffer, _ = module.convert_pdf_to_docx(revision)
+            elapsed = time.perf_counter() - start
+            cached = elapsed if cached is None else min(cached, elapsed)
+
+        if package_parts(docx_buffer) != expected:
+            sys.exit('page cache output differs from a fresh conversion')
+        print(f'{changed:>8} {uncached:>11.3f} {cached:>9.3f} {uncached / cached:>7.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,145 @@
+"""
+Benchmark: pdf-to-docx output, python-docx object model vs the streaming writer.
+
+The reference path is the converter as it was before the streaming writer:
+all page texts extracted first, one python-docx paragraph per line, then
+doc.save(). Both variants produce the same package parts (the writer's
+document.xml is byte-identical); the benchmark checks that before timing.
+The reference path drops images, so page images are left out of both
+(PDF_DOCX_IMAGE_BUDGET=0; see bench/bench_docx_images.py for those).
+Each variant runs in a fresh child process so peak RSS belongs to that
+conversion alone.
+
+Usage:
+    python bench/bench_pdf_docx.py [--pages 300] [--kind text] [--repeat 1]
+"""
+
+import io
+import os
+import sys
+import time
+import argparse
+import resource
+import subprocess
+import importlib.util
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+API_DIR = os.path.join(BENCH_DIR, '..', 'api')
+sys.path.insert(0, API_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+VARIANTS = ('reference', 'streaming')
+
+# Read when the converter is imported; the child processes inherit it
+os.environ['PDF_DOCX_IMAGE_BUDGET'] = '0'
+
+
+def _load_converter():
+    spec = importlib.util.spec_from_file_location('pdf_to_docx', os.path.join(API_DIR, 'pdf-to-docx.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def reference_convert(pdf_bytes):
+    """The previous converter: extract every page, build the python-docx model, save."""
+    from docx import Document
+    from docx.shared import Pt
+    from PyPDF2 import PdfReader
+    from _pdf_extract import extract_page_texts
+
+    page_texts, _ = extract_page_texts(pdf_bytes, PdfReader(io.BytesIO(pdf_bytes)))
+    doc = Document()
+    font = doc.styles['Normal'].font
+    font.name = 'Calibri'
+    font.size = Pt(11)
+    for page_num, text in enumerate(page_texts):
+        if text.strip():
+            if page_num > 0:
+                doc.add_page_break()
+            for para_text in text.split('\n'):
+                para_text = para_text.strip()
+                if para_text:
+                    is_heading = (
+                        len(para_text) < 100 and
+                        (para_text.isupper() or para_text.istitle()) and
+                        not para_text.endswith('.')
+                    )
+                    if is_heading:
+                        doc.add_heading(para_text, level=2)
+                    else:
+                        doc.add_paragraph(para_text)
+    docx_stream = io.BytesIO()
+    doc.save(docx_stream)
+    return docx_stream.getbuffer(), len(page_texts)
+
+
+def package_parts(docx_buffer):
+    """{part name: bytes} of a DOCX, in package order."""
+    import zipfile
+
+    with zipfile.ZipFile(io.BytesIO(docx_buffer)) as archive:
+        return {name: archive.read(name) for name in archive.namelist()}
+
+
+def run_child(variant, path, repeat):
+    """Child process: convert the file and print seconds, pages and peak RSS (MB)."""
+    module = _load_converter()
+    module.warm_up()
+    with open(path, 'rb') as f:
+        pdf_bytes = f.read()
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        if variant == 'reference':
+            _, pages = reference_convert(pdf_bytes)
+        else:
+            _, pages = module.convert_pdf_to_docx(pdf_bytes)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    # ru_maxrss is in KB on Linux
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f'{best:.3f} {pages} {peak_mb:.1f}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--pages', type=int, default=300)
+    parser.add_argument('--kind', default='text')
+    parser.add_argument('--repeat', type=int, default=1)
+    parser.add_argument('--child', choices=VARIANTS, help=argparse.SUPPRESS)
+    parser.add_argument('--input', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.child, args.input, args.repeat)
+        return
+
+    import tempfile
+    from corpus import make_pdf
+
+    pdf_bytes = make_pdf(args.kind, args.pages)
+    expected = package_parts(reference_convert(pdf_bytes)[0])
+    actual = package_parts(_load_converter().convert_pdf_to_docx(pdf_bytes)[0])
+    if list(expected.items()) != list(actual.items()):
+        sys.exit('streaming writer output differs from python-docx')
+
+    with tempfile.NamedTemporaryFile(suffix='.pdf', delete=False) as f:
+        f.write(pdf_bytes)
+    try:
+        print(f'document: {args.pages} {args.kind} pages, {len(pdf_bytes) / 1e6:.1f} MB PDF (outputs match)')
+        print(f'{"variant":>10} {"seconds":>8} {"pages":>6} {"peak_rss_mb":>12}')
+        for variant in VARIANTS:
+            out = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), '--child', variant, '--input', f.name,
+                 '--repeat', str(args.repeat)],
+                check=True, capture_output=True, text=True
+            ).stdout.split()
+            seconds, pages, peak = float(out[0]), int(out[1]), float(out[2])
+            print(f'{variant:>10} {seconds:>8.2f} {pages:>6} {peak:>12.1f}')
+    finally:
+        os.unlink(f.name)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+"""
+Benchmark: preview conversions (the first pages only) against full conversions, by document size.
+
+Generates text PDFs and DOCX of each size in --pages and converts each in full
+and as a preview of its first --preview pages, in both directions, reporting
+the best time of --repeat runs and the preview's flags. Preview output is
+checked to match the start of the full conversion's text.
+
+Usage:
+    python bench/bench_preview.py [--pages 50,200,1000] [--preview 3] [--repeat 3]
+"""
+
+import io
+import os
+import sys
+import time
+import argparse
+import importlib.util
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+API_DIR = os.path.join(BENCH_DIR, '..', 'api')
+sys.path.insert(0, API_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from corpus import make_docx, make_pdf
+
+
+def _load(name):
+    spec = importlib.util.spec_from_file_location(name.replace('-', '_'), os.path.join(API_DIR, name + '.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def _docx_texts(buffer):
+    from docx import Document
+
+    return [paragraph.text for paragraph in Document(io.BytesIO(bytes(buffer))).paragraphs]
+
+
+def _pdf_texts(buffer):
+    from PyPDF2 import PdfReader
+
+    return [page.extract_text() for page in PdfReader(io.BytesIO(bytes(buffer))).pages]
+
+
+def _best(convert, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = convert()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best[0]:
+            best = (elapsed, result)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--pages', default='50,200,1000', help='comma-separated document sizes')
+    parser.add_argument('--preview', type=int, default=3, help='pages per preview')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    from _page_cache import page_cache
+
+    pdf_to_docx = _load('pdf-to-docx')
+    docx_to_pdf = _load('docx-to-pdf')
+    pdf_to_docx.warm_up()
+    docx_to_pdf.warm_up()
+    # Every run extracts its text again
+    page_cache.max_bytes = 0
+    preview = (1, args.preview)
+
+    print(f'{"direction":>11} {"pages":>5} {"full_s":>7} {"preview_s":>9} {"speedup":>7}  preview')
+    for pages in (int(value) for value in args.pages.split(',')):
+        cases = (
+            ('pdf-to-docx', make_pdf('text', pages), pdf_to_docx.convert_pdf_to_docx, _docx_texts),
+            ('docx-to-pdf', make_docx('text', pages), docx_to_pdf.convert_docx_to_pdf, _pdf_texts),
+        )
+        for direction, document, convert, texts in cases:
+            full_s, (full, _) = _best(lambda: convert(document), args.repeat)
+            preview_s, (part, _, details) = _best(lambda: convert(document, preview=preview), args.repeat)
+            part_texts = texts(part)
+            if texts(full)[:len(part_texts)] != part_texts:
+                sys.exit(f'{direction} {pages}: preview differs from the start of the full conversion')
+            print(f'{direction:>11} {pages:>5} {full_s:>7.3f} {preview_s:>9.3f} {full_s / preview_s:>6.0f}x  '
+                  f'{details["preview"]}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,199 @@
+"""
+Benchmark: peak memory of one proxied iLovePDF conversion by document size.
+
+Runs a fake iLovePDF upstream in a child process (its memory is not counted)
+and drives api/ilove-pdf-to-docx.py against it with ILOVEPDF_API_URL. Peak
+Python heap is measured with tracemalloc over the request, excluding the
+request body the client sent. The response goes to a counting sink.
+Parsing the JSON request (raw body plus decoded string) costs about twice
+request_mb in either implementation; everything above that is proxy overhead.
+
+Compares the streaming proxy with the original implementation, which decoded
+the upload, joined the multipart body and base64-encoded the whole download.
+
+Usage:
+    python bench/bench_proxy.py [--sizes 1,4,16] [--transport json|binary]
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import base64
+import argparse
+import tracemalloc
+import subprocess
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, '..', 'api'))
+sys.path.insert(0, BENCH_DIR)
+
+import run  # noqa: E402
+
+MB = 1024 * 1024
+
+
+def serve_upstream():
+    """Child process: fake iLovePDF API; the result has the size of the upload."""
+    from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+    sizes = {}
+
+    class Upstream(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, format, *args):
+            pass
+
+        def _json(self, response):
+            body = json.dumps(response).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_POST(self):
+            length = int(self.headers.get('Content-Length') or 0)
+            if self.path == '/v1/upload':
+                remaining = length
+                while remaining:
+                    remaining -= len(self.rfile.read(min(remaining, 1024 * 1024)))
+                sizes['last'] = length
+                self._json({'server_filename': 'upload'})
+                return
+            self.rfile.read(length)
+            if self.path.startswith('/v1/start/'):
+                self._json({'server': f'127.0.0.1:{self.server.server_address[1]}', 'task': 'bench'})
+            else:
+                self._json({'status': 'TaskSuccess'})
+
+        def do_GET(self):
+            size = sizes.get('last', 0)
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/octet-stream')
+            self.send_header('Content-Length', str(size))
+            self.end_headers()
+            block = bytes(range(256)) * 4096
+            for offset in range(0, size, len(block)):
+                self.wfile.write(block[:size - offset])
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Upstream)
+    print(server.server_address[1], flush=True)
+    server.serve_forever()
+
+
+class _Sink:
+    """Counts response bytes without keeping them (apart from the status line)."""
+
+    def __init__(self):
+        self.size = 0
+        self.head = b''
+
+    def write(self, data):
+        if not self.head:
+            self.head = bytes(data[:64])
+        self.size += len(data)
+
+    def flush(self):
+        pass
+
+
+def call(handler_cls, body, headers):
+    from http.client import HTTPMessage
+
+    h = handler_cls.__new__(handler_cls)
+    h.rfile = io.BytesIO(body)
+    h.wfile = _Sink()
+    h.headers = HTTPMessage()
+    for name, value in headers.items():
+        h.headers[name] = value
+    h.command, h.path, h.request_version = 'POST', '/api/ilove-pdf-to-docx', 'HTTP/1.1'
+    h.requestline = 'POST /api/ilove-pdf-to-docx HTTP/1.1'
+    h.client_address = ('127.0.0.1', 0)
+    h.close_connection = True
+    h.log_message = lambda *args: None
+    h.do_POST()
+    status = int(h.wfile.head.split(b' ', 2)[1])
+    if status != 200:
+        raise RuntimeError(f'proxy returned HTTP {status}')
+    return h.wfile.size
+
+
+def reference_proxy(body):
+    """The original proxy data path: whole-file decode, join, download and encode."""
+    from _http_pool import ilovepdf_pool
+    from _ilovepdf import start_task, process_files, _server_url
+
+    data = json.loads(body)
+    task_data = start_task(data['public_key'], 'pdfdocx')
+    server, task = task_data['server'], task_data['task']
+
+    file_data = base64.b64decode(data['pdf_base64'])
+    boundary = '----WebKitFormBoundary' + os.urandom(16).hex()
+    parts = [f'--{boundary}'.encode(), b'Content-Disposition: form-data; name="task"', b'', task.encode(),
+             f'--{boundary}'.encode(), b'Content-Disposition: form-data; name="file"; filename="document.pdf"',
+             b'Content-Type: application/octet-stream', b'', file_data, f'--{boundary}--'.encode()]
+    _, _, response = ilovepdf_pool.request('POST', f'{_server_url(server)}/v1/upload', body=b'\r\n'.join(parts),
+                                           headers={'Content-Type': f'multipart/form-data; boundary={boundary}'})
+    server_filename = json.loads(response)['server_filename']
+    process_files(server, task, [(server_filename, server_filename)], 'pdfdocx')
+
+    _, _, file_data = ilovepdf_pool.request('GET', f'{_server_url(server)}/v1/download/{task}')
+    encoded = base64.b64encode(file_data).decode('utf-8')
+    docx_base64 = f'data:application/vnd.openxmlformats-officedocument.wordprocessingml.document;base64,{encoded}'
+    return len(json.dumps({'success': True, 'docx_base64': docx_base64}).encode())
+
+
+def measure(fn):
+    """Run fn() and return (result, peak_mb above the heap size before the call, seconds)."""
+    tracemalloc.reset_peak()
+    before = tracemalloc.get_traced_memory()[0]
+    start = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - start
+    return result, (tracemalloc.get_traced_memory()[1] - before) / MB, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', default='1,4,16', help='document sizes in MB (JSON requests must stay under MAX_PAYLOAD_BYTES)')
+    parser.add_argument('--transport', choices=('json', 'binary'), default='json')
+    parser.add_argument('--upstream', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.upstream:
+        serve_upstream()
+        return
+
+    upstream = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--upstream'], stdout=subprocess.PIPE)
+    try:
+        port = int(upstream.stdout.readline())
+        os.environ['ILOVEPDF_API_URL'] = f'http://127.0.0.1:{port}'
+        os.environ['JWT_SECRET'] = run.BENCH_SECRET
+        handler_cls = run.load_handler('ilove-pdf-to-docx')
+
+        headers = {'Authorization': f'Bearer {run.make_token()}', 'Content-Type': 'application/json'}
+        if args.transport == 'binary':
+            headers['Accept'] = 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
+
+        tracemalloc.start()
+        print(f'{"size_mb":>8} {"request_mb":>11} {"reference_peak_mb":>18} {"streaming_peak_mb":>18} '
+              f'{"reference_s":>12} {"streaming_s":>12}')
+        for size in (int(s) for s in args.sizes.split(',')):
+            document = os.urandom(size * MB)
+            body = json.dumps({'public_key': 'bench', 'pdf_base64': base64.b64encode(document).decode('ascii')}).encode()
+            del document
+            headers['Content-Length'] = str(len(body))
+
+            _, reference_peak, reference_s = measure(lambda: reference_proxy(body))
+            _, streaming_peak, streaming_s = measure(lambda: call(handler_cls, body, headers))
+            print(f'{size:>8} {len(body) / MB:>11.1f} {reference_peak:>18.1f} {streaming_peak:>18.1f} '
+                  f'{reference_s:>12.3f} {streaming_s:>12.3f}')
+    finally:
+        upstream.terminate()
+
+
+if __name__ == '__main__':
+    main()
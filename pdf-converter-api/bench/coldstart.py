@@ -0,0 +1,150 @@
+"""
+Cold-start profile of the converter endpoints.
+
+Runs each endpoint in a fresh interpreter under `python -X importtime` and
+reports, per phase, wall time and the import time spent in it:
+module load, CORS preflight, auth-rejected POST, first and second conversion.
+The top-level imports of each phase are listed so regressions (e.g. a heavy
+module creeping back into module load) are easy to spot.
+
+Usage:
+    python bench/coldstart.py [--endpoints pdf-to-docx,docx-to-pdf] [--top 8]
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+
+import run  # noqa: E402
+
+HEAVY_MODULES = ('PyPDF2', 'docx', 'lxml', 'reportlab', 'PIL')
+PHASE_MARKER = '# coldstart phase: '
+
+
+def _heavy_loaded():
+    return [name for name in HEAVY_MODULES if name in sys.modules]
+
+
+def child(endpoint):
+    """Runs under -X importtime; marks phases on stderr and prints timings as JSON."""
+    os.environ['JWT_SECRET'] = run.BENCH_SECRET
+    os.environ['CONVERSION_CACHE_MAX_BYTES'] = '0'
+    sys.path.insert(0, run.API_DIR)
+
+    fmt = run.DIRECTIONS[endpoint][0]
+    with open(run.corpus_path('text-1', fmt), 'rb') as f:
+        document = f.read()
+
+    phases = []
+
+    def phase(name, fn):
+        sys.stderr.write(f'{PHASE_MARKER}{name}\n')
+        sys.stderr.flush()
+        start = time.perf_counter()
+        fn()
+        phases.append({'phase': name, 'wall_ms': round((time.perf_counter() - start) * 1000, 2),
+                       'heavy_loaded': _heavy_loaded()})
+
+    state = {}
+    path = f'/api/{endpoint}'
+
+    def load():
+        state['handler'] = run.load_handler(endpoint)
+        state['call'] = run.direct_caller(state['handler'], path)
+
+    def options():
+        from http.client import HTTPMessage
+
+        h = state['handler'].__new__(state['handler'])
+        h.wfile = io.BytesIO()
+        h.headers = HTTPMessage()
+        h.command, h.path, h.request_version, h.requestline = 'OPTIONS', path, 'HTTP/1.1', f'OPTIONS {path} HTTP/1.1'
+        h.client_address = ('127.0.0.1', 0)
+        h.log_message = lambda *args: None
+        h.do_OPTIONS()
+
+    def rejected():
+        status, _ = state['call'](b'{}', {'Content-Type': 'application/json', 'Content-Length': '2'})
+        assert status == 401, status
+
+    def convert():
+        body, headers = run.build_request(endpoint, document, 'binary')
+        status, _ = state['call'](body, headers)
+        assert status == 200, status
+
+    phase('module load', load)
+    phase('OPTIONS', options)
+    phase('auth rejected', rejected)
+    phase('first conversion', convert)
+    phase('second conversion', convert)
+    print(json.dumps(phases))
+
+
+def parse_importtime(stderr):
+    """Split -X importtime output by phase; returns {phase: [(cumulative_us, name), ...]}."""
+    phases = {'interpreter': []}
+    current = 'interpreter'
+    for line in stderr.splitlines():
+        if line.startswith(PHASE_MARKER):
+            current = line[len(PHASE_MARKER):]
+            phases[current] = []
+            continue
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        fields = line[len('import time:'):].split('|')
+        cumulative_us, name = fields[1], fields[2]
+        # Nested imports are indented past the single separator space and are
+        # already included in their parent's cumulative time
+        if not name[1:].startswith(' '):
+            phases[current].append((int(cumulative_us), name.strip()))
+    return phases
+
+
+def profile(endpoint, top):
+    # Make sure the corpus file exists before the profiled interpreter starts
+    run.corpus_path('text-1', run.DIRECTIONS[endpoint][0])
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', os.path.abspath(__file__), '--child', endpoint],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True
+    )
+    results = json.loads(proc.stdout.decode('utf-8').strip().splitlines()[-1])
+    imports = parse_importtime(proc.stderr.decode('utf-8'))
+
+    print(f'\n{endpoint}')
+    print(f'  {"phase":<18} {"wall_ms":>9} {"import_ms":>10}  heavy modules loaded')
+    for result in results:
+        entries = imports.get(result['phase'], [])
+        import_ms = sum(us for us, _ in entries) / 1000
+        print(f'  {result["phase"]:<18} {result["wall_ms"]:>9.1f} {import_ms:>10.1f}  '
+              f'{", ".join(result["heavy_loaded"]) or "-"}')
+    for result in results:
+        entries = sorted(imports.get(result['phase'], []), reverse=True)[:top]
+        if entries:
+            listed = ', '.join(f'{name} {us / 1000:.1f}' for us, name in entries)
+            print(f'  top imports in {result["phase"]} (ms): {listed}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Profile converter cold starts')
+    parser.add_argument('--endpoints', default=','.join(run.DIRECTIONS))
+    parser.add_argument('--top', type=int, default=8)
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.child)
+        return
+
+    for endpoint in args.endpoints.split(','):
+        profile(endpoint, args.top)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,257 @@
+"""
+Synthetic, reproducible PDF/DOCX corpus for the benchmarks.
+
+Documents are generated with reportlab and python-docx (already dependencies)
+from a fixed seed, so the same kind and size always yield the same content.
+
+Kinds:
+    text      plain body paragraphs
+    tables    one table per page-equivalent plus a few paragraphs
+    headings  alternating short headings and short paragraphs
+    images    one generated raster image per page plus a caption
+
+Usage:
+    python bench/corpus.py --out bench/corpus --kinds text,tables --pages 1,10,100
+"""
+
+import io
+import os
+import random
+import argparse
+import datetime
+
+KINDS = ('text', 'tables', 'headings', 'images')
+DEFAULT_PAGES = (1, 10, 50)
+
+# Roughly how much DOCX content fills one letter page
+LINES_PER_PAGE = 40
+HEADINGS_PER_PAGE = 12
+TABLE_ROWS_PER_PAGE = 18
+
+_WORDS = (
+    'concrete steel facade glazing mullion transom parapet soffit cladding membrane '
+    'insulation substrate anchor bracket tolerance specification contractor submittal '
+    'mock-up sealant joint movement thermal acoustic fire rating load deflection '
+    'elevation section detail schedule finish coordination drawing revision'
+).split()
+
+_FIXED_DATE = datetime.datetime(2024, 1, 1)
+
+
+def _rng(kind, pages):
+    return random.Random(f'{kind}:{pages}')
+
+
+def _sentence(rng, words=12):
+    text = ' '.join(rng.choice(_WORDS) for _ in range(words))
+    return text[0].upper() + text[1:] + '.'
+
+
+def _heading(rng, number):
+    return f'{number} ' + ' '.join(rng.choice(_WORDS) for _ in range(3)).upper()
+
+
+def _image(rng, size=(480, 320)):
+    """A deterministic, moderately compressible RGB image (PNG bytes)."""
+    from PIL import Image, ImageDraw
+
+    img = Image.new('RGB', size, (245, 245, 240))
+    draw = ImageDraw.Draw(img)
+    for _ in range(40):
+        x0, y0 = rng.randrange(size[0]), rng.randrange(size[1])
+        x1, y1 = x0 + rng.randrange(20, 160), y0 + rng.randrange(20, 120)
+        color = tuple(rng.randrange(60, 230) for _ in range(3))
+        draw.rectangle([x0, y0, x1, y1], outline=color, width=2)
+    buf = io.BytesIO()
+    img.save(buf, format='PNG')
+    return buf.getvalue()
+
+
+def make_pdf(kind='text', pages=10, revised=()):
+    """
+    Generate a PDF of the given kind with exactly `pages` pages.
+    Pages whose index is in `revised` carry an extra revision note; every other
+    page is identical to the unrevised document's.
+    """
+    from reportlab.lib.pagesizes import letter
+    from reportlab.lib.utils import ImageReader
+    from reportlab.pdfgen import canvas
+
+    rng = _rng(kind, pages)
+    buf = io.BytesIO()
+    c = canvas.Canvas(buf, pagesize=letter, invariant=1)
+    width, height = letter
+    image = ImageReader(io.BytesIO(_image(rng))) if kind == 'images' else None
+
+    for page in range(pages):
+        y = height - 72
+        c.setFont('Helvetica-Bold', 13)
+        c.drawString(72, y, _heading(rng, page + 1))
+        y -= 24
+        c.setFont('Helvetica', 10)
+
+        if kind == 'images':
+            c.drawImage(image, 72, y - 320, width=480, height=320)
+            y -= 340
+            c.drawString(72, y, f'Figure {page + 1}. ' + _sentence(rng, 8))
+        elif kind == 'tables':
+            for row in range(TABLE_ROWS_PER_PAGE):
+                for col in range(4):
+                    c.rect(72 + col * 117, y - 4, 117, 16)
+                    c.drawString(76 + col * 117, y, ' '.join(rng.choice(_WORDS) for _ in range(2)))
+                y -= 16
+            y -= 12
+            c.drawString(72, y, _sentence(rng))
+        elif kind == 'headings':
+            for i in range(HEADINGS_PER_PAGE):
+                c.setFont('Helvetica-Bold', 11)
+                c.drawString(72, y, _heading(rng, f'{page + 1}.{i + 1}'))
+                c.setFont('Helvetica', 10)
+                c.drawString(72, y - 14, _sentence(rng, 10))
+                y -= 48
+        else:
+            for _ in range(LINES_PER_PAGE):
+                c.drawString(72, y, _sentence(rng, 13))
+                y -= 15
+        if page in revised:
+            c.drawString(72, 40, f'Revision B: page {page + 1} amended.')
+        c.showPage()
+
+    c.save()
+    return buf.getvalue()
+
+
+def _photo(rng, size):
+    """A deterministic photo-like RGB image (smooth noise, compresses poorly)."""
+    from PIL import Image, ImageFilter
+
+    small = (size[0] // 8, size[1] // 8)
+    bands = [Image.frombytes('L', small, bytes(rng.randrange(256) for _ in range(small[0] * small[1])))
+             for _ in range(3)]
+    image = Image.merge('RGB', bands).resize(size, Image.BICUBIC)
+    return image.filter(ImageFilter.GaussianBlur(1))
+
+
+def _line_art(rng, size):
+    """A deterministic scanned-drawing-like image: black lines on white."""
+    from PIL import Image, ImageDraw
+
+    image = Image.new('L', size, 255)
+    draw = ImageDraw.Draw(image)
+    for _ in range(120):
+        x0, y0 = rng.randrange(size[0]), rng.randrange(size[1])
+        if rng.random() < 0.5:
+            draw.line([x0, y0, x0 + rng.randrange(-size[0] // 3, size[0] // 3), y0], fill=0, width=3)
+        else:
+            draw.line([x0, y0, x0, y0 + rng.randrange(-size[1] // 3, size[1] // 3)], fill=0, width=3)
+    return image
+
+
+def make_drawing_set(sheets=4):
+    """
+    A merged sheet set: each sheet is its own PDF with a site photo (JPEG),
+    a scanned detail (line art) and the practice logo, concatenated page by
+    page, so every sheet carries its own copy of the logo as in real merged
+    sets. Rendered far above print resolution, as exports often are.
+    """
+    from PyPDF2 import PdfReader, PdfWriter
+    from reportlab.lib.pagesizes import landscape, A3
+    from reportlab.lib.utils import ImageReader
+    from reportlab.pdfgen import canvas
+
+    rng = _rng('drawings', sheets)
+    logo = io.BytesIO(_image(rng, (600, 200)))
+    writer = PdfWriter()
+    # PdfWriter maps objects by id(reader), so every reader must outlive the write
+    readers = []
+    width, height = landscape(A3)
+    for sheet in range(sheets):
+        photo = io.BytesIO()
+        _photo(rng, (2400, 1600)).save(photo, format='JPEG', quality=92)
+        photo.seek(0)
+        detail = io.BytesIO()
+        _line_art(rng, (3000, 2000)).save(detail, format='PNG')
+        detail.seek(0)
+        logo.seek(0)
+
+        buf = io.BytesIO()
+        c = canvas.Canvas(buf, pagesize=(width, height), invariant=1)
+        c.setFont('Helvetica-Bold', 14)
+        c.drawString(40, height - 40, f'A-{101 + sheet} ' + _heading(rng, sheet + 1))
+        c.drawImage(ImageReader(photo), 40, height - 400, width=480, height=320)
+        c.drawImage(ImageReader(detail), 560, height - 400, width=540, height=360)
+        c.drawImage(ImageReader(logo), width - 220, 30, width=180, height=60)
+        c.setFont('Helvetica', 9)
+        c.drawString(40, 40, _sentence(rng))
+        c.showPage()
+        c.save()
+        readers.append(PdfReader(io.BytesIO(buf.getvalue())))
+        writer.add_page(readers[-1].pages[0])
+    out = io.BytesIO()
+    writer.write(out)
+    return out.getvalue()
+
+
+def make_docx(kind='text', pages=10):
+    """Generate a DOCX of the given kind sized to roughly `pages` pages."""
+    from docx import Document
+    from docx.shared import Inches
+
+    rng = _rng(kind, pages)
+    doc = Document()
+    doc.core_properties.created = _FIXED_DATE
+    doc.core_properties.modified = _FIXED_DATE
+    image = _image(rng) if kind == 'images' else None
+
+    for page in range(pages):
+        doc.add_heading(_heading(rng, page + 1), level=1)
+        if kind == 'images':
+            doc.add_picture(io.BytesIO(image), width=Inches(5))
+            doc.add_paragraph(f'Figure {page + 1}. ' + _sentence(rng, 8))
+        elif kind == 'tables':
+            table = doc.add_table(rows=TABLE_ROWS_PER_PAGE, cols=4)
+            for row in table.rows:
+                for cell in row.cells:
+                    cell.text = ' '.join(rng.choice(_WORDS) for _ in range(2))
+            doc.add_paragraph(_sentence(rng))
+        elif kind == 'headings':
+            for i in range(HEADINGS_PER_PAGE):
+                doc.add_heading(_heading(rng, f'{page + 1}.{i + 1}'), level=2)
+                doc.add_paragraph(_sentence(rng, 10))
+        else:
+            for _ in range(LINES_PER_PAGE // 4):
+                doc.add_paragraph(' '.join(_sentence(rng, 13) for _ in range(4)))
+
+    buf = io.BytesIO()
+    doc.save(buf)
+    return buf.getvalue()
+
+
+def corpus(kinds=KINDS, pages=DEFAULT_PAGES, formats=('pdf', 'docx')):
+    """Yield (name, format, bytes) for every kind/size/format combination."""
+    for kind in kinds:
+        for count in pages:
+            if 'pdf' in formats:
+                yield f'{kind}-{count}', 'pdf', make_pdf(kind, count)
+            if 'docx' in formats:
+                yield f'{kind}-{count}', 'docx', make_docx(kind, count)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Write the synthetic benchmark corpus to disk')
+    parser.add_argument('--out', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'corpus'))
+    parser.add_argument('--kinds', default=','.join(KINDS))
+    parser.add_argument('--pages', default=','.join(str(p) for p in DEFAULT_PAGES))
+    args = parser.parse_args()
+
+    os.makedirs(args.out, exist_ok=True)
+    pages = [int(p) for p in args.pages.split(',')]
+    for name, fmt, data in corpus(args.kinds.split(','), pages):
+        path = os.path.join(args.out, f'{name}.{fmt}')
+        with open(path, 'wb') as f:
+            f.write(data)
+        print(f'{path} ({len(data)} bytes)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,305 @@
+"""
+Converter benchmark suite.
+
+Drives the `handler` classes of api/pdf-to-docx.py and api/docx-to-pdf.py over
+the synthetic corpus (see corpus.py), either directly (do_POST on an in-memory
+request) or over a local HTTP socket (server.py with keep-alive). Each case runs
+in a fresh child process so peak RSS is attributable to that case alone.
+
+Reports per case: throughput (docs/s, MB/s), p50/p95/p99 latency and peak RSS.
+
+Usage:
+    python bench/run.py [--directions pdf-to-docx,docx-to-pdf] [--modes direct,http]
+                        [--kinds text,tables,headings,images] [--pages 1,10,50]
+                        [--repeat 5] [--transport json|binary]
+                        [--save-baseline bench/baseline.json]
+                        [--compare bench/baseline.json --tolerance 0.15]
+
+Exits with status 1 when --compare finds a regression beyond the tolerance.
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import base64
+import hashlib
+import hmac
+import argparse
+import subprocess
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+API_DIR = os.path.join(ROOT_DIR, 'api')
+
+DIRECTIONS = {
+    # direction: (input format, JSON field, input MIME, output MIME)
+    'pdf-to-docx': ('pdf', 'pdf_base64', 'application/pdf',
+                    'application/vnd.openxmlformats-officedocument.wordprocessingml.document'),
+    'docx-to-pdf': ('docx', 'docx_base64',
+                    'application/vnd.openxmlformats-officedocument.wordprocessingml.document', 'application/pdf'),
+}
+MODES = ('direct', 'http')
+BENCH_SECRET = 'bench-secret'
+
+# Metrics compared against a baseline; higher is worse for all of them
+COMPARED_METRICS = ('p50_ms', 'p95_ms', 'peak_rss_mb')
+
+
+def _b64url(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+
+def make_token(secret=BENCH_SECRET):
+    """Mint an HS256 JWT accepted by api/_auth.py."""
+    header = _b64url(json.dumps({'alg': 'HS256', 'typ': 'JWT'}).encode())
+    payload = _b64url(json.dumps({'sub': 'bench', 'exp': int(time.time()) + 3600}).encode())
+    signing_input = f'{header}.{payload}'.encode('ascii')
+    signature = hmac.new(secret.encode('utf-8'), signing_input, hashlib.sha256).digest()
+    return f'{header}.{payload}.{_b64url(signature)}'
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, int(round(pct / 100.0 * len(sorted_values) + 0.5)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is kilobytes on Linux, bytes on macOS
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def corpus_path(name, fmt):
+    """Generate (once) and return the on-disk corpus file for a case."""
+    import corpus
+
+    directory = os.path.join(BENCH_DIR, 'corpus')
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f'{name}.{fmt}')
+    if not os.path.exists(path):
+        kind, pages = name.rsplit('-', 1)
+        make = corpus.make_pdf if fmt == 'pdf' else corpus.make_docx
+        with open(path, 'wb') as f:
+            f.write(make(kind, int(pages)))
+    return path
+
+
+def build_request(direction, document, transport):
+    _, field, in_mime, out_mime = DIRECTIONS[direction]
+    headers = {'Authorization': f'Bearer {make_token()}'}
+    if transport == 'binary':
+        headers.update({'Content-Type': in_mime, 'Accept': out_mime})
+        body = document
+    else:
+        headers['Content-Type'] = 'application/json'
+        body = json.dumps({field: base64.b64encode(document).decode('ascii')}).encode('utf-8')
+    headers['Content-Length'] = str(len(body))
+    return body, headers
+
+
+def load_handler(direction):
+    import importlib.util
+
+    spec = importlib.util.spec_from_file_location(direction.replace('-', '_'), os.path.join(API_DIR, f'{direction}.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.handler
+
+
+def direct_caller(handler_cls, path):
+    """Call do_POST on an in-memory request; returns call(body, headers) -> (status, response_bytes)."""
+    from http.client import HTTPMessage
+
+    class QuietHandler(handler_cls):
+        def log_message(self, format, *args):
+            pass
+
+    def call(body, headers):
+        h = QuietHandler.__new__(QuietHandler)
+        h.rfile = io.BytesIO(body)
+        h.wfile = io.BytesIO()
+        h.headers = HTTPMessage()
+        for name, value in headers.items():
+            h.headers[name] = value
+        h.command, h.path, h.request_version = 'POST', path, 'HTTP/1.1'
+        h.requestline = f'POST {path} HTTP/1.1'
+        h.client_address = ('127.0.0.1', 0)
+        h.close_connection = True
+        h.do_POST()
+        response = h.wfile.getvalue()
+        status = int(response.split(b' ', 2)[1])
+        return status, response
+
+    return call
+
+
+def http_caller(handler_cls, path):
+    """Serve the handler via server.py on an ephemeral port; returns a keep-alive caller."""
+    import threading
+    import http.client
+
+    sys.path.insert(0, ROOT_DIR)
+    import server
+
+    class QuietDispatcher(server.Dispatcher):
+        def log_message(self, format, *args):
+            pass
+
+    QuietDispatcher.routes = {path: type('Mounted', (QuietDispatcher, handler_cls), {})}
+    httpd = server.PooledHTTPServer(('127.0.0.1', 0), QuietDispatcher, threads=4, workers=1)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    conn = http.client.HTTPConnection('127.0.0.1', httpd.server_address[1], timeout=600)
+
+    def call(body, headers):
+        conn.request('POST', path, body=body, headers=headers)
+        response = conn.getresponse()
+        return response.status, response.read()
+
+    return call
+
+
+def run_case(direction, mode, name, repeat, transport):
+    """Child process: run one case and return its metrics."""
+    os.environ['JWT_SECRET'] = BENCH_SECRET
+    # Measure conversions, not cache hits
+    os.environ['CONVERSION_CACHE_MAX_BYTES'] = '0'
+    os.environ.pop('CONVERSION_CACHE_DIR', None)
+    sys.path.insert(0, API_DIR)
+
+    fmt = DIRECTIONS[direction][0]
+    with open(corpus_path(name, fmt), 'rb') as f:
+        document = f.read()
+
+    handler_cls = load_handler(direction)
+    path = f'/api/{direction}'
+    call = (direct_caller if mode == 'direct' else http_caller)(handler_cls, path)
+
+    latencies = []
+    output_bytes = 0
+    first_ms = None
+    for i in range(repeat + 1):
+        body, headers = build_request(direction, document, transport)
+        start = time.perf_counter()
+        status, response = call(body, headers)
+        elapsed = (time.perf_counter() - start) * 1000
+        if status != 200:
+            raise RuntimeError(f'{direction} {name}: HTTP {status}: {response[:200]!r}')
+        if i == 0:
+            # First call includes lazy imports and warm-up; reported separately
+            first_ms = elapsed
+            continue
+        latencies.append(elapsed)
+        output_bytes = len(response)
+
+    latencies.sort()
+    total_s = sum(latencies) / 1000
+    return {
+        'direction': direction,
+        'mode': mode,
+        'case': name,
+        'transport': transport,
+        'runs': len(latencies),
+        'input_bytes': len(document),
+        'output_bytes': output_bytes,
+        'first_ms': round(first_ms, 1),
+        'p50_ms': round(percentile(latencies, 50), 1),
+        'p95_ms': round(percentile(latencies, 95), 1),
+        'p99_ms': round(percentile(latencies, 99), 1),
+        'docs_per_s': round(len(latencies) / total_s, 2) if total_s else 0.0,
+        'mb_per_s': round(len(latencies) * len(document) / (1024 * 1024) / total_s, 2) if total_s else 0.0,
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+def case_key(result):
+    return f'{result["direction"]}/{result["mode"]}/{result["case"]}'
+
+
+def compare(results, baseline, tolerance):
+    """Return a list of (key, metric, old, new) regressions beyond tolerance."""
+    previous = {case_key(r): r for r in baseline.get('results', [])}
+    regressions = []
+    for result in results:
+        old = previous.get(case_key(result))
+        if old is None:
+            continue
+        for metric in COMPARED_METRICS:
+            before, after = old.get(metric), result.get(metric)
+            if before and after and after > before * (1 + tolerance):
+                regressions.append((case_key(result), metric, before, after))
+    return regressions
+
+
+def print_table(results):
+    columns = ('direction', 'mode', 'case', 'first_ms', 'p50_ms', 'p95_ms', 'p99_ms',
+               'docs_per_s', 'mb_per_s', 'peak_rss_mb')
+    widths = [max(len(c), *(len(str(r.get(c))) for r in results)) for c in columns]
+    print('  '.join(c.rjust(w) for c, w in zip(columns, widths)))
+    for r in results:
+        print('  '.join(str(r.get(c)).rjust(w) for c, w in zip(columns, widths)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the local converters')
+    parser.add_argument('--directions', default=','.join(DIRECTIONS))
+    parser.add_argument('--modes', default=','.join(MODES))
+    parser.add_argument('--kinds', default='text,tables,headings,images')
+    parser.add_argument('--pages', default='1,10,50')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--transport', choices=('json', 'binary'), default='json')
+    parser.add_argument('--save-baseline', metavar='PATH')
+    parser.add_argument('--compare', metavar='PATH')
+    parser.add_argument('--tolerance', type=float, default=0.15)
+    parser.add_argument('--case', nargs=3, metavar=('DIRECTION', 'MODE', 'NAME'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    sys.path.insert(0, BENCH_DIR)
+
+    if args.case:
+        print(json.dumps(run_case(*args.case, args.repeat, args.transport)))
+        return
+
+    results = []
+    for direction in args.directions.split(','):
+        for kind in args.kinds.split(','):
+            for pages in args.pages.split(','):
+                name = f'{kind}-{pages}'
+                # Generate in the parent so the child's peak RSS excludes corpus generation
+                corpus_path(name, DIRECTIONS[direction][0])
+                for mode in args.modes.split(','):
+                    out = subprocess.run(
+                        [sys.executable, os.path.abspath(__file__), '--case', direction, mode, name,
+                         '--repeat', str(args.repeat), '--transport', args.transport],
+                        check=True, stdout=subprocess.PIPE
+                    ).stdout
+                    results.append(json.loads(out.decode('utf-8').strip().splitlines()[-1]))
+                    print(f'  done {direction} {mode} {name}', file=sys.stderr)
+
+    print_table(results)
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump({'created_at': time.time(), 'results': results}, f, indent=2)
+        print(f'Baseline saved to {args.save_baseline}')
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        for key, metric, before, after in regressions:
+            print(f'REGRESSION {key} {metric}: {before} -> {after} (+{(after / before - 1) * 100:.0f}%)')
+        if regressions:
+            sys.exit(1)
+        print(f'No regressions beyond {args.tolerance:.0%}')
+
+
+if __name__ == '__main__':
+    main()
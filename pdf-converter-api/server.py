@@ -0,0 +1,308 @@
+"""
+Standalone HTTP server hosting every handler in api/ on its Vercel route.
+
+For self-hosted boxes: one warm process with HTTP/1.1 keep-alive, a bounded
+pool of connection threads and a separate executor for CPU-heavy conversions,
+so health checks, CORS preflights and auth failures never wait behind them.
+The executor has a thread for every conversion admission control can run or
+queue (ADMISSION_SLOTS + ADMISSION_QUEUE, see api/_admission.py), so its queue
+timeout and 503s apply; a conversion POST finding every executor thread busy is
+answered 503 on its connection thread instead of waiting behind them.
+
+Usage:
+    python server.py [--host 0.0.0.0] [--port 8000] [--threads 32] [--workers N]
+                     [--keepalive 15] [--drain-timeout 30] [--no-warm]
+
+Routes mirror the serverless layout: api/<name>.py is served at /api/<name>.
+SIGTERM/SIGINT stop accepting connections and let in-flight requests finish.
+"""
+
+import os
+import sys
+import time
+import signal
+import socket
+import argparse
+import threading
+import importlib.util
+from concurrent.futures import ThreadPoolExecutor
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse
+
+API_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'api')
+sys.path.insert(0, API_DIR)
+
+from _admission import admission, send_rejected  # noqa: E402
+from _auth import authenticate_request, check_payload_size, send_unauthorized, send_payload_too_large, get_cors_origin  # noqa: E402
+from _metrics import note_error, request_timing  # noqa: E402
+
+# POST on these routes runs on the conversion executor
+HEAVY_ROUTES = {
+    '/api/pdf-to-docx',
+    '/api/pdf-pages',
+    '/api/docx-to-pdf',
+    '/api/compress-pdf',
+    '/api/ilove-pdf-to-docx',
+    '/api/ilove-docx-to-pdf',
+    '/api/batch',
+}
+
+# Unread request bodies up to this size are drained to keep the connection alive;
+# larger ones close the connection instead.
+MAX_DRAIN_BYTES = 64 * 1024
+
+
+class _RequestBody:
+    """File-like view of one request body on a keep-alive connection."""
+
+    def __init__(self, rfile, length):
+        self._rfile = rfile
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size is None or size < 0 or size > self.remaining:
+            size = self.remaining
+        if size <= 0:
+            return b''
+        data = self._rfile.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def readline(self, size=-1):
+        if size is None or size < 0 or size > self.remaining:
+            size = self.remaining
+        if size <= 0:
+            return b''
+        data = self._rfile.readline(size)
+        self.remaining -= len(data)
+        return data
+
+
+class Dispatcher(BaseHTTPRequestHandler):
+    """
+    Routes each request on a connection to the handler class mounted at its path.
+    Mounted classes subclass (Dispatcher, api_handler), so a request is served by
+    switching the instance to the mounted class for that route.
+    """
+
+    protocol_version = 'HTTP/1.1'
+    server_version = 'PDFConverterAPI'
+    # Headers and body go out in separate writes; with Nagle on, keep-alive
+    # clients stall on delayed ACKs for ~40 ms per response.
+    disable_nagle_algorithm = True
+    routes = {}
+
+    def handle_one_request(self):
+        try:
+            self.raw_requestline = self.rfile.readline(65537)
+            if len(self.raw_requestline) > 65536:
+                self.requestline = ''
+                self.request_version = ''
+                self.command = ''
+                self.send_error(414)
+                return
+            if not self.raw_requestline:
+                self.close_connection = True
+                return
+            if not self.parse_request():
+                return
+
+            route = urlparse(self.path).path.rstrip('/')
+            mounted = self.routes.get(route)
+            if mounted is None:
+                self.__class__ = Dispatcher
+                self.send_error(404, f'No handler for {route}')
+                return
+            self.__class__ = mounted
+
+            method = getattr(self, 'do_' + self.command, None)
+            if method is None:
+                self.send_error(501, f'Unsupported method ({self.command})')
+                return
+
+            self._sent_length = False
+            raw_rfile = self.rfile
+            self.rfile = _RequestBody(raw_rfile, int(self.headers.get('Content-Length') or 0))
+            try:
+                if self.command == 'POST' and route in HEAVY_ROUTES:
+                    self._dispatch_heavy(method, route)
+                else:
+                    method()
+            finally:
+                self._finish_body(raw_rfile)
+            self.wfile.flush()
+            if self.server.draining:
+                self.close_connection = True
+        except socket.timeout as e:
+            self.log_error('Request timed out: %r', e)
+            self.close_connection = True
+
+    def _dispatch_heavy(self, method, route):
+        """
+        Reject cheap failures inline, then run the conversion on the executor.
+        The request is timed from here, so inline rejections and the wait for
+        an executor thread (the executor stage) show up in its metrics.
+        """
+        with request_timing(self, route.rsplit('/', 1)[-1]) as timings:
+            authed, result = authenticate_request(self)
+            if not authed:
+                send_unauthorized(self, result)
+                return
+            size_ok, _ = check_payload_size(self)
+            if not size_ok:
+                send_payload_too_large(self)
+                return
+            # Never queue on the executor: a request waiting there holds its
+            # connection thread with no timeout and is invisible to admission control
+            if not self.server.executor_threads.acquire(blocking=False):
+                error = admission.overloaded()
+                note_error(error)
+                send_rejected(self, get_cors_origin(self), error)
+                return
+            submitted = time.perf_counter()
+
+            def run():
+                if timings is not None:
+                    timings.add('executor', time.perf_counter() - submitted)
+                method()
+
+            try:
+                self.server.conversions.submit(run).result()
+            finally:
+                self.server.executor_threads.release()
+
+    def _finish_body(self, raw_rfile):
+        """Drain whatever the handler left unread so the next request parses cleanly."""
+        body = self.rfile
+        self.rfile = raw_rfile
+        if body.remaining > MAX_DRAIN_BYTES:
+            self.close_connection = True
+        elif body.remaining:
+            body.read()
+
+    def send_response_only(self, code, message=None):
+        self._status = code
+        super().send_response_only(code, message)
+
+    def send_header(self, keyword, value):
+        if keyword.lower() in ('content-length', 'transfer-encoding'):
+            self._sent_length = True
+        super().send_header(keyword, value)
+
+    def end_headers(self):
+        # Without a Content-Length (or chunked encoding) the client can only find
+        # the end of the body by the connection closing, so don't keep it alive.
+        bodyless = self.command == 'HEAD' or getattr(self, '_status', 200) in (204, 304)
+        if not getattr(self, '_sent_length', True) and not bodyless:
+            super().send_header('Connection', 'close')
+            self.close_connection = True
+        super().end_headers()
+
+
+def load_routes(api_dir=API_DIR, warm=False):
+    """
+    Mount every public api/*.py module at /api/<name>, as Vercel does.
+    With warm, each module's warm_up() hook runs so the first request doesn't
+    pay for lazy imports.
+    """
+    routes = {}
+    for filename in sorted(os.listdir(api_dir)):
+        if not filename.endswith('.py') or filename.startswith(('_', '.')):
+            continue
+        name = filename[:-3]
+        spec = importlib.util.spec_from_file_location(f'api_{name.replace("-", "_")}', os.path.join(api_dir, filename))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        handler_cls = getattr(module, 'handler', None)
+        if handler_cls is None:
+            continue
+        if warm and hasattr(module, 'warm_up'):
+            module.warm_up()
+        routes[f'/api/{name}'] = type(f'Mounted_{name.replace("-", "_")}', (Dispatcher, handler_cls), {})
+    return routes
+
+
+class PooledHTTPServer(HTTPServer):
+    """HTTPServer serving connections on a bounded thread pool."""
+
+    allow_reuse_address = True
+    draining = False
+
+    def __init__(self, address, handler_cls, threads, workers, request_queue_size=128):
+        self.request_queue_size = request_queue_size
+        super().__init__(address, handler_cls)
+        self.connections = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='conn')
+        self.workers = workers or admission.slots + admission.queue_size
+        self.conversions = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='convert')
+        # Free executor threads; conversions are only submitted when one is free
+        self.executor_threads = threading.BoundedSemaphore(self.workers)
+
+    def process_request(self, request, client_address):
+        self.connections.submit(self._serve_connection, request, client_address)
+
+    def _serve_connection(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def drain(self, timeout):
+        """Wait up to timeout seconds for in-flight requests to finish."""
+        self.draining = True
+        done = threading.Event()
+
+        def wait():
+            self.connections.shutdown(wait=True)
+            self.conversions.shutdown(wait=True)
+            done.set()
+
+        threading.Thread(target=wait, daemon=True).start()
+        return done.wait(timeout)
+
+
+def build_server(host, port, threads, workers, keepalive, warm=True):
+    Dispatcher.routes = load_routes(warm=warm)
+    Dispatcher.timeout = keepalive
+    return PooledHTTPServer((host, port), Dispatcher, threads, workers)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Self-hosted PDF Converter API server')
+    parser.add_argument('--host', default=os.environ.get('HOST', '0.0.0.0'))
+    parser.add_argument('--port', type=int, default=int(os.environ.get('PORT', 8000)))
+    parser.add_argument('--threads', type=int, default=int(os.environ.get('SERVER_THREADS', 32)),
+                        help='connection threads (keep-alive connections each hold one)')
+    parser.add_argument('--workers', type=int, default=int(os.environ.get('SERVER_WORKERS', 0)),
+                        help='conversion requests in flight, running or waiting for an admission slot '
+                             '(default: ADMISSION_SLOTS + ADMISSION_QUEUE); more are answered 503')
+    parser.add_argument('--keepalive', type=float, default=float(os.environ.get('SERVER_KEEPALIVE_SECONDS', 15)),
+                        help='idle keep-alive timeout in seconds')
+    parser.add_argument('--no-warm', action='store_true',
+                        help='skip importing converter dependencies at startup')
+    parser.add_argument('--drain-timeout', type=float, default=float(os.environ.get('SERVER_DRAIN_SECONDS', 30)),
+                        help='seconds to wait for in-flight requests on shutdown')
+    args = parser.parse_args()
+
+    server = build_server(args.host, args.port, args.threads, args.workers, args.keepalive, warm=not args.no_warm)
+    print(f'Serving {", ".join(sorted(Dispatcher.routes))} on http://{args.host}:{args.port} '
+          f'(threads={args.threads}, workers={server.workers})')
+
+    def stop(signum, frame):
+        print('Shutting down, waiting for in-flight requests...')
+        server.draining = True
+        # shutdown() blocks until serve_forever returns, so call it off the main thread
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    server.serve_forever()
+    server.server_close()
+    if not server.drain(args.drain_timeout):
+        print('Drain timeout reached, exiting with requests still in flight')
+
+
+if __name__ == '__main__':
+    main()